@@ -0,0 +1,172 @@
+"""
+🗄️ History Store - تاریخچه ستونی کندل‌ها روی دیسک
+هر نماد یک پوشه دارد و هر ستون یک فایل باینری append-only:
+    <root>/<SYMBOL>/timestamp.i64   (epoch ms، صعودی)
+    <root>/<SYMBOL>/<column>.f64    (open, high, low, close, volume و هر ستون اضافه)
+نویسنده: whale_hunter_end4 (کندل‌های بسته‌شده 1m در هر تیک)
+خواننده: موتورهای کشف الگو با np.memmap - بازه زمانی = slice بدون کپی (بدون کوئری SQL)
+"""
+
+import os
+import numpy as np
+
+CANDLE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+TIME_FILE = 'timestamp.i64'
+
+
+class HistoryStore:
+    """ذخیره ستونی append-only با خواندن memory-mapped"""
+
+    def __init__(self, root):
+        self.root = root
+        self._maps = {}  # {(symbol, column): (size, memmap)} - با بزرگ شدن فایل دوباره باز می‌شود
+
+    # ==================== نوشتن ====================
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, symbol)
+
+    @staticmethod
+    def _size(path, itemsize=8):
+        return os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+
+    def _columns_on_disk(self, symbol):
+        folder = self._dir(symbol)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.f64'))
+
+    def append(self, symbol, timestamps, columns):
+        """
+        افزودن ردیف‌ها برای یک نماد (timestamps به ms و صعودی)
+        ردیف‌هایی که از آخرین زمان ثبت‌شده جدیدتر نیستند نادیده گرفته می‌شوند.
+        ستون‌های ناموجود با NaN پر می‌شوند؛ فایل timestamp آخر از همه نوشته می‌شود
+        تا طول آن تعداد ردیف‌های کامل باشد (ستون‌های نیمه‌نوشته در append بعدی بریده می‌شوند)
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        folder = self._dir(symbol)
+        os.makedirs(folder, exist_ok=True)
+        time_path = os.path.join(folder, TIME_FILE)
+        count = self._size(time_path)
+
+        if count:
+            last = np.fromfile(time_path, dtype=np.int64, count=1, offset=(count - 1) * 8)[0]
+            keep = timestamps > last
+            if not keep.all():
+                timestamps = timestamps[keep]
+                columns = {name: np.asarray(values, dtype=np.float64)[keep] for name, values in columns.items()}
+        if not len(timestamps):
+            return 0
+
+        for name in set(self._columns_on_disk(symbol)) | set(columns):
+            path = os.path.join(folder, f'{name}.f64')
+            values = columns.get(name)
+            if values is None:
+                values = np.full(len(timestamps), np.nan)
+            values = np.asarray(values, dtype=np.float64)
+            with open(path, 'ab') as f:
+                size = f.tell() // 8
+                if size > count:
+                    f.truncate(count * 8)  # باقی‌مانده append ناتمام قبلی
+                elif size < count:
+                    np.full(count - size, np.nan).tofile(f)  # ستون جدید: پر کردن ردیف‌های قبلی
+                values.tofile(f)
+
+        with open(time_path, 'ab') as f:
+            timestamps.tofile(f)
+        return len(timestamps)
+
+    def append_rows(self, rows, columns=CANDLE_COLUMNS):
+        """افزودن ردیف‌های (symbol, timestamp_ms, *columns) چند نماد (مثلاً کندل‌های بسته‌شده یک تیک)"""
+        by_symbol = {}
+        for row in rows:
+            by_symbol.setdefault(row[0], []).append(row[1:])
+        written = 0
+        for symbol, items in by_symbol.items():
+            data = np.array(items, dtype=np.float64)
+            written += self.append(symbol, data[:, 0].astype(np.int64),
+                                   {name: data[:, i + 1] for i, name in enumerate(columns)})
+        return written
+
+    # ==================== خواندن ====================
+
+    def _map(self, symbol, name, dtype):
+        path = os.path.join(self._dir(symbol), name)
+        size = self._size(path)
+        cached = self._maps.get((symbol, name))
+        if cached is None or cached[0] != size:
+            mapped = np.memmap(path, dtype=dtype, mode='r') if size else np.empty(0, dtype=dtype)
+            cached = (size, mapped)
+            self._maps[(symbol, name)] = cached
+        return cached[1]
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, TIME_FILE)))
+
+    def read(self, symbol, start_ms=None, end_ms=None, columns=None):
+        """
+        ستون‌های بازه [start_ms, end_ms) به صورت view روی memmap (بدون کپی)
+        خروجی: {'timestamp': int64[], column: float64[], ...} یا {} اگر نماد تاریخچه ندارد
+        """
+        if not os.path.exists(os.path.join(self._dir(symbol), TIME_FILE)):
+            return {}
+        timestamps = self._map(symbol, TIME_FILE, np.int64)
+        count = len(timestamps)
+        lo = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, 'left'))
+        hi = count if end_ms is None else int(np.searchsorted(timestamps, end_ms, 'left'))
+        data = {'timestamp': timestamps[lo:hi]}
+        for name in columns or self._columns_on_disk(symbol):
+            data[name] = self._map(symbol, f'{name}.f64', np.float64)[:count][lo:hi]
+        return data
+
+    def frame(self, symbol, start_ms=None, end_ms=None, columns=None):
+        """همان read به شکل DataFrame با ستون timestamp از نوع datetime64 (pandas فقط اینجا لازم است)"""
+        import pandas as pd
+        data = self.read(symbol, start_ms, end_ms, columns)
+        if not data:
+            return pd.DataFrame()
+        data['timestamp'] = data['timestamp'].view('datetime64[ms]')
+        return pd.DataFrame(data, copy=False)
+
+    # ==================== مهاجرت ====================
+
+    def import_sqlite(self, conn, table='candles_1m', time_column='timestamp', chunk=50000):
+        """
+        انتقال یک‌باره کندل‌های یک جدول SQLite به store (ستون‌های عددی غیر از id/symbol/زمان)
+        ردیف‌ها به ترتیب (symbol, زمان) خوانده می‌شوند و تکراری‌ها با منطق append نادیده می‌مانند
+        """
+        cursor = conn.execute(f'SELECT * FROM {table} LIMIT 0')
+        names = [d[0] for d in cursor.description]
+        value_columns = [n for n in names if n not in ('id', 'symbol', time_column)]
+        cursor = conn.execute(f"SELECT symbol, {time_column}, {', '.join(value_columns)} FROM {table} "
+                              f"ORDER BY symbol, {time_column}")
+        written = 0
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            by_symbol = {}
+            for row in rows:
+                by_symbol.setdefault(row[0], []).append(row[1:])
+            for symbol, items in by_symbol.items():
+                stamps = np.array([str(item[0]).replace(' ', 'T') for item in items], dtype='datetime64[ms]')
+                values = np.array([item[1:] for item in items], dtype=np.float64)
+                written += self.append(symbol, stamps.astype(np.int64),
+                                       {name: values[:, i] for i, name in enumerate(value_columns)})
+        return written
+
+
+if __name__ == '__main__':
+    # python history_store.py <sqlite_db> <history_dir> [table]
+    import sqlite3
+    import sys
+    if len(sys.argv) < 3:
+        print('usage: python history_store.py <sqlite_db> <history_dir> [table]')
+        sys.exit(1)
+    store = HistoryStore(sys.argv[2])
+    with sqlite3.connect(sys.argv[1]) as source:
+        total = store.import_sqlite(source, *(sys.argv[3:4] or []))
+    print(f"✅ {total:,} ردیف به {sys.argv[2]} منتقل شد ({len(store.symbols())} نماد)")
@@ -12,6 +12,7 @@ import logging
 from scipy import stats
 import hashlib
 import json
+import re
 from enum import Enum
 import asyncio
 
@@ -39,6 +40,8 @@ class FormulaDiscoveryEngine:
         self.discovered_formulas = {}  # فرمول‌های کشف‌شده
         self.validated_formulas = {}   # فرمول‌های تأییدشده
         self.performance_log = []
+        self._compiled_formulas = {}  # {(id, condition, thresholds): تابع برداری}
+        self._metrics_cache = None  # (data, len(data), metrics)
         
         # پارامترهای کشف الگو
         self.config = {
@@ -68,8 +71,9 @@ class FormulaDiscoveryEngine:
             # 2. کشف الگوهای اولیه
             candidate_formulas = await self._discover_patterns(historical_data, symbol)
             
-            # 3. اعتبارسنجی هر فرمول
-            for formula in candidate_formulas:
+            # 3. اعتبارسنجی هر فرمول (خروجی کشف: {'formula', 'success_rate', ...})
+            for pattern in candidate_formulas:
+                formula = pattern['formula']
                 validation_result = await self._validate_formula(formula, historical_data, symbol)
                 
                 if validation_result['approved']:
@@ -110,20 +114,21 @@ class FormulaDiscoveryEngine:
                 if i >= j:
                     continue
                 
-                # ساخت فرمول آزمایشی
-                formula = self._create_test_formula(metric1, metric2)
-                
-                # آزمایش فرمول روی داده تاریخی
-                success_rate = await self._test_formula_on_history(formula, data)
-                
-                if success_rate > self.config['min_success_rate'] - 0.1:  # آستانه پایین‌تر برای کشف
-                    patterns.append({
-                        'formula': formula,
-                        'success_rate': success_rate,
-                        'metrics': [metric1, metric2],
-                        'symbol': symbol,
-                        'discovered_at': datetime.now()
-                    })
+                # ساخت فرمول آزمایشی در هر دو جهت (همان شرط برای خرید و فروش)
+                for action in ('BUY', 'SELL'):
+                    formula = self._create_test_formula(metric1, metric2, action)
+                    
+                    # آزمایش فرمول روی داده تاریخی
+                    success_rate = await self._test_formula_on_history(formula, data)
+                    
+                    if success_rate > self.config['min_success_rate'] - 0.1:  # آستانه پایین‌تر برای کشف
+                        patterns.append({
+                            'formula': formula,
+                            'success_rate': success_rate,
+                            'metrics': [metric1, metric2],
+                            'symbol': symbol,
+                            'discovered_at': datetime.now()
+                        })
         
         # الگوهای تکراری را حذف کن
         unique_patterns = self._remove_duplicate_patterns(patterns)
@@ -131,13 +136,14 @@ class FormulaDiscoveryEngine:
         self.logger.info(f"🔍 {len(unique_patterns)} الگوی بالقوه کشف شد")
         return unique_patterns
     
-    def _create_test_formula(self, metric1: str, metric2: str) -> Dict:
+    def _create_test_formula(self, metric1: str, metric2: str, action: str = 'BUY') -> Dict:
         """ساخت یک فرمول آزمایشی از دو متریک"""
         # این فرمول پایه بعداً توسط سیستم تکمیل می‌شود
+        key = f'{metric1}_{metric2}' if action == 'BUY' else f'{metric1}_{metric2}_{action}'
         formula = {
-            'id': f"FORM_{hashlib.md5(f'{metric1}_{metric2}'.encode()).hexdigest()[:8]}",
+            'id': f"FORM_{hashlib.md5(key.encode()).hexdigest()[:8]}",
             'condition': f"{metric1} > threshold_1 AND {metric2} < threshold_2",
-            'action': 'BUY',  # یا 'SELL'
+            'action': action,  # 'BUY' یا 'SELL'
             'thresholds': {
                 'threshold_1': 0.5,  # مقدار اولیه - توسط سیستم تنظیم می‌شود
                 'threshold_2': 0.3
@@ -147,6 +153,125 @@ class FormulaDiscoveryEngine:
         }
         return formula
     
+    # ==================== VECTORIZED METRICS & COMPILED FORMULAS ====================
+    
+    METRIC_WINDOW = 100  # پنجره پشت سر هر کندل (همان data.iloc[i-100:i])
+    CONDITION_PATTERN = re.compile(r'^\s*(\w+)\s*(>=|<=|>|<)\s*([\w.\-]+)\s*$')
+    
+    @staticmethod
+    def _sigmoid_zscore(series: pd.Series, window: int) -> pd.Series:
+        """نرمال‌سازی به بازه (0, 1): sigmoid امتیاز z نسبت به پنجره غلتان"""
+        mean = series.rolling(window, min_periods=window // 2).mean()
+        std = series.rolling(window, min_periods=window // 2).std()
+        z = (series - mean) / std.replace(0, np.nan)
+        return 1 / (1 + np.exp(-z.clip(-20, 20)))
+    
+    def compute_metrics(self, data: pd.DataFrame, shift: bool = True) -> Dict[str, np.ndarray]:
+        """
+        همه متریک‌ها برای همه کندل‌ها در یک گذر (عملیات rolling برداری)
+        با shift=True مقدار کندل i فقط از کندل‌های قبل از i ساخته می‌شود (بدون نگاه به آینده)
+        ستون‌هایی که در داده نیستند متریک NaN می‌دهند (شرط روی NaN همیشه False است)
+        """
+        w = self.METRIC_WINDOW
+        close = data['close'].astype(float)
+        volume = data['volume'].astype(float) if 'volume' in data else pd.Series(np.nan, index=data.index)
+        returns = close.pct_change()
+        nan = pd.Series(np.nan, index=data.index)
+        
+        # سهم حجم کندل‌های صعودی از کل حجم پنجره (جریان خرید)
+        up_volume = volume.where(returns > 0, 0.0)
+        whale_flow_ratio = up_volume.rolling(w).sum() / volume.rolling(w).sum()
+        
+        oi_change_ratio = (self._sigmoid_zscore(data['oi'].astype(float).pct_change(), w)
+                           if 'oi' in data else nan)
+        volume_pressure = self._sigmoid_zscore(volume, w)
+        funding_sentiment = (self._sigmoid_zscore(data['funding_rate'].astype(float), w)
+                             if 'funding_rate' in data else nan)
+        
+        # خوشه لیکوئیدیشن: سهم لیکوئید خرید؛ بدون این ستون‌ها از دامنه کندل (high-low) استفاده می‌شود
+        if 'buy_liq' in data and 'sell_liq' in data:
+            buy_liq = data['buy_liq'].astype(float).rolling(w).sum()
+            liquidation_cluster = buy_liq / (buy_liq + data['sell_liq'].astype(float).rolling(w).sum())
+        elif 'high' in data and 'low' in data:
+            liquidation_cluster = self._sigmoid_zscore((data['high'] - data['low']).astype(float) / close, w)
+        else:
+            liquidation_cluster = nan
+        
+        # واگرایی RSI: موقعیت قیمت در پنجره منهای RSI (نگاشت به 0..1)
+        delta = close.diff()
+        gain = delta.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+        loss = (-delta.clip(upper=0)).ewm(alpha=1 / 14, adjust=False).mean()
+        rsi = 1 - 1 / (1 + gain / loss.replace(0, np.nan))
+        low, high = close.rolling(w).min(), close.rolling(w).max()
+        position = (close - low) / (high - low).replace(0, np.nan)
+        rsi_divergence = (position - rsi + 1) / 2
+        
+        # نوسان کوتاه‌مدت به بلندمدت
+        volatility_ratio = 1 / (1 + np.exp(-np.log(returns.rolling(10).std() / returns.rolling(w).std())))
+        
+        metrics = {
+            'whale_flow_ratio': whale_flow_ratio,
+            'oi_change_ratio': oi_change_ratio,
+            'volume_pressure': volume_pressure,
+            'funding_sentiment': funding_sentiment,
+            'liquidation_cluster': liquidation_cluster,
+            'rsi_divergence': rsi_divergence,
+            'volatility_ratio': volatility_ratio
+        }
+        return {name: (values.shift(1) if shift else values).to_numpy(dtype=np.float64)
+                for name, values in metrics.items()}
+    
+    def _metrics_for(self, data: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """متریک‌های یک دیتافریم فقط یک بار محاسبه می‌شوند (همه فرمول‌های یک چرخه از آن استفاده می‌کنند)"""
+        if self._metrics_cache is None or self._metrics_cache[0] is not data or self._metrics_cache[1] != len(data):
+            self._metrics_cache = (data, len(data), self.compute_metrics(data))
+        return self._metrics_cache[2]
+    
+    def compile_formula(self, formula: Dict):
+        """
+        تبدیل شرط متنی فرمول به تابع برداری: metrics → آرایه bool برای همه کندل‌ها
+        شرط: عبارت‌های "metric op value" با AND یا OR (value عدد یا نام یکی از thresholds)
+        """
+        condition = formula['condition']
+        cache_key = (formula['id'], condition, json.dumps(formula.get('thresholds', {}), sort_keys=True))
+        compiled = self._compiled_formulas.get(cache_key)
+        if compiled is not None:
+            return compiled
+        
+        thresholds = formula.get('thresholds', {})
+        operators = {'>': np.greater, '<': np.less, '>=': np.greater_equal, '<=': np.less_equal}
+        
+        clauses = []  # هر clause: لیست عبارت‌هایی که با AND ترکیب می‌شوند
+        for part in re.split(r'\s+OR\s+', condition):
+            terms = []
+            for text in re.split(r'\s+AND\s+', part):
+                match = self.CONDITION_PATTERN.match(text)
+                if not match:
+                    raise ValueError(f"شرط نامعتبر در فرمول {formula['id']}: {text}")
+                metric, op, value = match.groups()
+                value = float(thresholds[value]) if value in thresholds else float(value)
+                terms.append((metric, operators[op], value))
+            clauses.append(terms)
+        
+        def evaluate(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+            length = len(next(iter(metrics.values())))
+            result = np.zeros(length, dtype=bool)
+            with np.errstate(invalid='ignore'):
+                for terms in clauses:
+                    clause = np.ones(length, dtype=bool)
+                    for metric, op, value in terms:
+                        clause &= op(metrics[metric], value)
+                    result |= clause
+            return result
+        
+        self._compiled_formulas[cache_key] = evaluate
+        return evaluate
+    
+    async def _test_formula_on_history(self, formula: Dict, data: pd.DataFrame) -> float:
+        """امتیاز موفقیت فرمول روی تاریخچه (همان بکتست برداری)"""
+        result = await self._run_backtest(formula, data)
+        return result.get('success_rate', 0)
+    
     # ==================== VALIDATION ENGINE ====================
     
     async def _validate_formula(self, formula: Dict, historical_data: pd.DataFrame, 
@@ -200,64 +325,46 @@ class FormulaDiscoveryEngine:
         return validation_results
     
     async def _run_backtest(self, formula: Dict, data: pd.DataFrame) -> Dict:
-        """اجرای بکتست روی داده تاریخی"""
-        # اینجا بکتست ساده‌ای انجام می‌دهیم
-        # در نسخه کامل از Backtrader یا vectorized backtest استفاده می‌شود
-        
-        trades = []
+        """اجرای بکتست روی داده تاریخی (walk-forward برداری روی همه کندل‌ها در یک گذر)"""
         initial_balance = 10000  # موجودی اولیه فرضی
-        balance = initial_balance
-        equity_curve = []
         
-        # شبیه‌سازی معاملات
-        for i in range(100, len(data) - 1):
-            # اعمال فرمول روی داده
-            signal = self._apply_formula(formula, data.iloc[i-100:i])
-            
-            if signal:
-                entry_price = data.iloc[i]['close']
-                exit_price = data.iloc[i+1]['close']  # خروج در کندل بعدی
-                
-                pnl = (exit_price - entry_price) if signal == 'BUY' else (entry_price - exit_price)
-                pnl_percent = pnl / entry_price
-                
-                trades.append({
-                    'entry': entry_price,
-                    'exit': exit_price,
-                    'pnl': pnl_percent,
-                    'signal': signal
-                })
-                
-                # به‌روزرسانی موجودی
-                balance *= (1 + pnl_percent * 0.1)  # فرض: 10% سرمایه در هر معامله
-                equity_curve.append(balance)
+        # سیگنال همه کندل‌ها: فرمول کامپایل‌شده روی ستون‌های متریک (کندل i فقط از 100 کندل قبلی)
+        signals = self.compile_formula(formula)(self._metrics_for(data))
+        signals[:self.METRIC_WINDOW] = False
+        signals[len(data) - 1:] = False  # خروج در کندل بعدی لازم است
+        index = np.flatnonzero(signals)
+        
+        if not len(index):
+            return {'success_rate': 0, 'total_trades': 0}
+        
+        # شبیه‌سازی معاملات: ورود در close کندل i، خروج در close کندل i+1
+        close = data['close'].to_numpy(dtype=np.float64)
+        entry_price = close[index]
+        exit_price = close[index + 1]
+        pnl = exit_price - entry_price if formula.get('action', 'BUY') == 'BUY' else entry_price - exit_price
+        returns = pnl / entry_price
+        
+        # به‌روزرسانی موجودی (فرض: 10% سرمایه در هر معامله)
+        equity_curve = initial_balance * np.cumprod(1 + returns * 0.1)
+        balance = equity_curve[-1]
         
         # محاسبه معیارها
-        if trades:
-            winning_trades = [t for t in trades if t['pnl'] > 0]
-            win_rate = len(winning_trades) / len(trades)
-            
-            # محاسبه حداکثر افت سرمایه
-            equity_series = pd.Series(equity_curve)
-            rolling_max = equity_series.expanding().max()
-            drawdowns = (equity_series - rolling_max) / rolling_max
-            max_drawdown = abs(drawdowns.min())
-            
-            # محاسبه نسبت شارپ (ساده‌شده)
-            returns = [t['pnl'] for t in trades]
-            sharpe = np.mean(returns) / (np.std(returns) + 1e-10) * np.sqrt(365)
-            
-            return {
-                'success_rate': win_rate * 0.8 + (1 - max_drawdown) * 0.2,  # ترکیب برد و افت
-                'total_trades': len(trades),
-                'win_rate': win_rate,
-                'max_drawdown': max_drawdown,
-                'sharpe_ratio': sharpe,
-                'final_balance': balance,
-                'total_return': (balance - initial_balance) / initial_balance
-            }
+        win_rate = float((returns > 0).mean())
+        rolling_max = np.maximum.accumulate(equity_curve)
+        max_drawdown = float(abs(((equity_curve - rolling_max) / rolling_max).min()))
+        
+        # محاسبه نسبت شارپ (ساده‌شده)
+        sharpe = np.mean(returns) / (np.std(returns) + 1e-10) * np.sqrt(365)
         
-        return {'success_rate': 0, 'total_trades': 0}
+        return {
+            'success_rate': win_rate * 0.8 + (1 - max_drawdown) * 0.2,  # ترکیب برد و افت
+            'total_trades': len(returns),
+            'win_rate': win_rate,
+            'max_drawdown': max_drawdown,
+            'sharpe_ratio': sharpe,
+            'final_balance': balance,
+            'total_return': (balance - initial_balance) / initial_balance
+        }
     
     # ==================== PAPER TRADING EXECUTOR ====================
     
@@ -355,23 +462,11 @@ class FormulaDiscoveryEngine:
             return None
     
     def _apply_formula(self, formula: Dict, data: pd.DataFrame) -> Optional[str]:
-        """اعمال فرمول روی داده و تولید سیگنال"""
+        """اعمال فرمول روی داده و تولید سیگنال (آخرین کندل، با همان تابع کامپایل‌شده بکتست)"""
         try:
-            # در اینجا منطق اعمال فرمول پیاده‌سازی می‌شود
-            # این یک نمونه ساده است
-            
-            condition = formula['condition']
-            
-            # محاسبه متریک‌ها (در نسخه کامل، اینها واقعی محاسبه می‌شوند)
-            whale_flow_ratio = np.random.random()
-            oi_change_ratio = np.random.random()
-            
-            # ارزیابی شرط
-            if 'whale_flow_ratio' in condition and whale_flow_ratio > 0.6:
-                return 'BUY'
-            elif 'oi_change_ratio' in condition and oi_change_ratio > 0.7:
-                return 'SELL'
-            
+            metrics = self.compute_metrics(data, shift=False)
+            if self.compile_formula(formula)(metrics)[-1]:
+                return formula.get('action', 'BUY')
             return None
             
         except Exception as e:
@@ -67,16 +67,20 @@ import hashlib
 import asyncio
 import logging
 
+from history_store import HistoryStore
+
 # ==================== CONFIGURATION ====================
 DB_PATH = Path("./data/quantum_trading.db")  # مسیر دیتابیس اصلی شما
+HISTORY_DIR = Path("./history")  # history store ستونی (memory-mapped) - اگر نباشد از SQL خوانده می‌شود
 SYMBOL = "BTCUSDT"  # نماد هدف برای کشف الگو
 
 class RealDataPatternEngine:
     """موتور کشف الگو با اتصال مستقیم به دیتابیس واقعی"""
     
-    def __init__(self, db_path: Path = DB_PATH):
+    def __init__(self, db_path: Path = DB_PATH, history_dir: Path = HISTORY_DIR):
         self.db_path = db_path
         self.conn = None
+        self.history = HistoryStore(str(history_dir)) if Path(history_dir).is_dir() else None
         self.setup_logging()
         
         # پارامترهای کشف
@@ -123,7 +127,31 @@ class RealDataPatternEngine:
     # ==================== REAL DATA FETCHING ====================
     
     def fetch_candle_data(self, symbol: str = SYMBOL, days: int = 30) -> pd.DataFrame:
-        """خواندن داده‌های کندل واقعی از دیتابیس"""
+        """خواندن داده‌های کندل واقعی (اول از history store، در غیر این صورت از دیتابیس)"""
+        df = self._fetch_candles_from_history(symbol, days)
+        if df is None:
+            df = self._fetch_candles_from_sql(symbol, days)
+            if df.empty:
+                return df
+        
+        # محاسبه اندیکاتورهای پایه
+        df['returns'] = df['close'].pct_change()
+        df['volume_ma'] = df['volume'].rolling(20).mean()
+        df['volatility'] = df['returns'].rolling(50).std()
+        
+        self.logger.info(f"📥 {len(df)} کندل واقعی بارگذاری شد (نماد: {symbol})")
+        return df
+    
+    def _fetch_candles_from_history(self, symbol: str, days: int) -> Optional[pd.DataFrame]:
+        """بازه زمانی از فایل‌های ستونی memory-mapped (slice بدون کپی، بدون تبدیل متن به زمان)"""
+        if self.history is None:
+            return None
+        since = (datetime.now() - timedelta(days=days)).timestamp() * 1000
+        df = self.history.frame(symbol, start_ms=int(since))
+        return df if not df.empty else None
+    
+    def _fetch_candles_from_sql(self, symbol: str, days: int) -> pd.DataFrame:
+        """خواندن کندل‌ها از جدول candles_1m (وقتی history store برای نماد داده ندارد)"""
         query = """
         SELECT 
             timestamp,
@@ -151,13 +179,6 @@ class RealDataPatternEngine:
             
             # تبدیل timestamp به datetime
             df['timestamp'] = pd.to_datetime(df['timestamp'])
-            
-            # محاسبه اندیکاتورهای پایه
-            df['returns'] = df['close'].pct_change()
-            df['volume_ma'] = df['volume'].rolling(20).mean()
-            df['volatility'] = df['returns'].rolling(50).std()
-            
-            self.logger.info(f"📥 {len(df)} کندل واقعی بارگذاری شد (نماد: {symbol})")
             return df
             
         except Exception as e:
@@ -327,104 +348,151 @@ class RealDataPatternEngine:
     # ==================== BACKTESTING ENGINE ====================
     
     def backtest_pattern(self, pattern: Dict, df: pd.DataFrame) -> Dict:
-        """تست الگو روی داده‌های تاریخی"""
+        """تست الگو روی داده‌های تاریخی (هسته برداری NumPy - بدون حلقه روی کندل‌ها)"""
         if 'condition' not in pattern:
             return {'success': False, 'error': 'شرط الگو تعریف نشده'}
         
         try:
-            # شبیه‌سازی ساده - در نسخه کامل باید دقیق‌تر شود
-            trades = []
             initial_balance = 10000
-            balance = initial_balance
             
-            # تشخیص سیگنال‌ها بر اساس نوع الگو
+            # تشخیص سیگنال‌ها بر اساس نوع الگو (ماسک ورود روی همه کندل‌ها)
             if 'VOL_PUMP' in pattern['id']:
                 # تشخیص پامپ حجمی
-                signals = self._detect_volume_pump_signals(df)
+                entries = self._volume_pump_mask(df)
             elif 'WHALE_BUY' in pattern['id']:
                 # تشخیص ورود نهنگ
-                signals = self._detect_whale_buy_signals(df)
+                entries = np.zeros(len(df), dtype=bool)
+                entries[[s['index'] for s in self._detect_whale_buy_signals(df)]] = True
             else:
-                signals = []
-            
-            # شبیه‌سازی معاملات
-            for signal in signals:
-                if signal['action'] == 'BUY':
-                    # فرض: خرید در قیمت بسته شدن و فروش 10 کندل بعد
-                    entry_idx = signal['index']
-                    if entry_idx + 10 < len(df):
-                        entry_price = df.iloc[entry_idx]['close']
-                        exit_price = df.iloc[entry_idx + 10]['close']
-                        
-                        pnl_percent = (exit_price - entry_price) / entry_price
-                        position_size = balance * 0.1  # 10% سرمایه
-                        pnl = position_size * pnl_percent
-                        
-                        balance += pnl
-                        
-                        trades.append({
-                            'entry': entry_price,
-                            'exit': exit_price,
-                            'pnl_percent': pnl_percent,
-                            'pnl_usd': pnl,
-                            'timestamp': df.iloc[entry_idx]['timestamp']
-                        })
+                entries = np.zeros(len(df), dtype=bool)
+            
+            # شبیه‌سازی معاملات: خرید در قیمت بسته شدن و فروش horizon کندل بعد (یا زودتر با SL/TP)
+            result = self._vectorized_backtest(
+                df['close'].to_numpy(dtype=np.float64), entries,
+                horizon=pattern.get('horizon', 10),
+                stop_loss=pattern.get('stop_loss'),
+                take_profit=pattern.get('take_profit'),
+                initial_balance=initial_balance
+            )
             
-            # تحلیل نتایج
-            if trades:
-                winning_trades = [t for t in trades if t['pnl_usd'] > 0]
-                total_return = (balance - initial_balance) / initial_balance
-                win_rate = len(winning_trades) / len(trades)
-                
-                # محاسبه حداکثر افت سرمایه
-                equity_curve = [initial_balance]
-                for trade in trades:
-                    equity_curve.append(equity_curve[-1] + trade['pnl_usd'])
-                
-                equity_series = pd.Series(equity_curve)
-                drawdown = (equity_series.expanding().max() - equity_series) / equity_series.expanding().max()
-                max_drawdown = drawdown.max()
-                
-                return {
-                    'success': True,
-                    'total_trades': len(trades),
-                    'winning_trades': len(winning_trades),
-                    'win_rate': win_rate,
-                    'total_return': total_return,
-                    'max_drawdown': max_drawdown,
-                    'final_balance': balance,
-                    'sharpe_ratio': self._calculate_sharpe_ratio([t['pnl_percent'] for t in trades]),
-                    'trades': trades[:10]  # فقط 10 معامله اول برای نمایش
-                }
-            else:
+            if result is None:
                 return {
                     'success': False,
                     'error': 'هیچ سیگنالی شناسایی نشد'
                 }
+            
+            # تحلیل نتایج
+            pnl_percent = result['returns']
+            pnl_usd = result['pnl']
+            balance = result['equity'][-1]
+            
+            # فقط 10 معامله اول برای نمایش
+            timestamps = df['timestamp'].to_numpy()
+            trades = [{
+                'entry': entry,
+                'exit': exit_,
+                'pnl_percent': ret,
+                'pnl_usd': pnl,
+                'timestamp': timestamps[idx]
+            } for entry, exit_, ret, pnl, idx in zip(
+                result['entry_prices'][:10], result['exit_prices'][:10],
+                pnl_percent[:10], pnl_usd[:10], result['entry_index'][:10])]
+            
+            winning_trades = int((pnl_usd > 0).sum())
+            
+            return {
+                'success': True,
+                'total_trades': len(pnl_usd),
+                'winning_trades': winning_trades,
+                'win_rate': winning_trades / len(pnl_usd),
+                'total_return': (balance - initial_balance) / initial_balance,
+                'max_drawdown': result['max_drawdown'],
+                'final_balance': balance,
+                'sharpe_ratio': self._calculate_sharpe_ratio(pnl_percent.tolist()),
+                'trades': trades
+            }
                 
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def _detect_volume_pump_signals(self, df: pd.DataFrame) -> List[Dict]:
-        """تشخیص سیگنال‌های پامپ حجمی"""
-        signals = []
+    @staticmethod
+    def _vectorized_backtest(close: np.ndarray, entries: np.ndarray, horizon: int = 10,
+                             stop_loss: Optional[float] = None, take_profit: Optional[float] = None,
+                             initial_balance: float = 10000, position_fraction: float = 0.1) -> Optional[Dict]:
+        """
+        هسته بکتست برداری
+        - entries: ماسک bool ورود روی کندل‌ها؛ ورودهایی که horizon کندل بعدشان وجود ندارد حذف می‌شوند
+        - خروج: کندل entry+horizon، یا اولین کندلی که بازده به take_profit/-stop_loss (کسری) برسد
+        - هر معامله position_fraction از موجودی فعلی (مرکب) ← equity = initial * cumprod(1 + f*r)
+        """
+        n = len(close)
+        entry_index = np.flatnonzero(entries[:max(n - horizon, 0)])
+        if not len(entry_index):
+            return None
         
-        if len(df) < 50:
-            return signals
+        entry_prices = close[entry_index]
+        exit_index = entry_index + horizon
+        
+        if stop_loss is not None or take_profit is not None:
+            # مسیر قیمت horizon کندل بعد از هر ورود (view بدون کپی روی close)
+            windows = np.lib.stride_tricks.sliding_window_view(close, horizon + 1)[entry_index, 1:]
+            path = windows / entry_prices[:, None] - 1
+            hit = np.zeros(path.shape, dtype=bool)
+            if take_profit is not None:
+                hit |= path >= take_profit
+            if stop_loss is not None:
+                hit |= path <= -stop_loss
+            first = np.where(hit.any(axis=1), hit.argmax(axis=1) + 1, horizon)
+            exit_index = entry_index + first
         
-        volume_ma = df['volume'].rolling(20).mean()
-        volume_spike = df['volume'] > volume_ma * 2
+        exit_prices = close[exit_index]
+        returns = (exit_prices - entry_prices) / entry_prices
         
-        for i in range(len(df) - 1):
-            if volume_spike.iloc[i] and df['returns'].iloc[i] > 0:
-                signals.append({
-                    'index': i,
-                    'action': 'BUY',
-                    'reason': 'volume_spike',
-                    'volume_ratio': df['volume'].iloc[i] / volume_ma.iloc[i]
-                })
+        # منحنی سرمایه مرکب، PnL هر معامله و حداکثر افت
+        equity = initial_balance * np.cumprod(1 + position_fraction * returns)
+        equity = np.concatenate([[initial_balance], equity])
+        pnl = np.diff(equity)
+        peak = np.maximum.accumulate(equity)
+        max_drawdown = float(((peak - equity) / peak).max())
+        
+        return {
+            'entry_index': entry_index,
+            'exit_index': exit_index,
+            'entry_prices': entry_prices,
+            'exit_prices': exit_prices,
+            'returns': returns,
+            'pnl': pnl,
+            'equity': equity,
+            'max_drawdown': max_drawdown
+        }
+    
+    def _volume_pump_mask(self, df: pd.DataFrame) -> np.ndarray:
+        """ماسک پامپ حجمی: volume > MA(volume,20)*2 و بازده مثبت (کندل آخر سیگنال نمی‌دهد)"""
+        mask = np.zeros(len(df), dtype=bool)
+        if len(df) < 50:
+            return mask
+        
+        volume = df['volume'].to_numpy(dtype=np.float64)
+        volume_ma = df['volume'].rolling(20).mean().to_numpy()
+        returns = df['returns'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            mask[:-1] = ((volume > volume_ma * 2) & (returns > 0))[:-1]
+        return mask
+    
+    def _detect_volume_pump_signals(self, df: pd.DataFrame) -> List[Dict]:
+        """تشخیص سیگنال‌های پامپ حجمی"""
+        mask = self._volume_pump_mask(df)
+        if not mask.any():
+            return []
         
-        return signals
+        index = np.flatnonzero(mask)
+        volume_ratio = df['volume'].to_numpy()[index] / df['volume'].rolling(20).mean().to_numpy()[index]
+        return [{
+            'index': i,
+            'action': 'BUY',
+            'reason': 'volume_spike',
+            'volume_ratio': ratio
+        } for i, ratio in zip(index.tolist(), volume_ratio.tolist())]
     
     # ==================== MAIN DISCOVERY PIPELINE ====================
     
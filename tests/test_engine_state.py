@@ -0,0 +1,51 @@
+"""
+تست ریستارت گرم (EngineState): persister باید وضعیت پایان همان تیک را بنویسد
+حتی اگر تیک بعد قبل از ثبت، وضعیت زنده را تغییر داده باشد (خط لوله)
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+import whale_hunter_end4 as wh
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(wh, 'DB_PATH', str(tmp_path / 'state.db'))
+    wh.Database.close_all()
+    wh.init_db()
+    wh.reset_engine_state()
+    wh.price_history.symbols = ['AUSDT']
+    yield
+    wh.reset_engine_state()
+    wh.Database.close_all()
+
+
+def saved_prices():
+    with wh.Database.connection() as conn:
+        value = conn.execute("SELECT value FROM engine_state WHERE key = 'previous_prices'").fetchone()[0]
+    return json.loads(value)
+
+
+def test_persist_writes_state_captured_in_tick(engine):
+    wh.WhaleDetector.previous_prices = np.array([1.0])
+    unit = wh.TickUnit()
+    wh.EngineState.capture(unit)
+
+    # تیک بعد قبل از ثبت این unit قیمت‌ها را جلو برده است
+    wh.WhaleDetector.previous_prices = np.array([2.0])
+    wh.persist_tick(unit)
+    assert saved_prices() == {'AUSDT': 1.0}
+
+    unit = wh.TickUnit()
+    wh.EngineState.capture(unit)
+    wh.persist_tick(unit)
+    assert saved_prices() == {'AUSDT': 2.0}
+
+
+def test_unit_without_capture_writes_no_state(engine):
+    wh.persist_tick(wh.TickUnit())
+    with wh.Database.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM engine_state WHERE key != 'summaries'").fetchone()[0] == 0
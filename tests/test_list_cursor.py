@@ -0,0 +1,82 @@
+"""
+تست cursor صفحه‌بندی keyset و دلتای روت‌های لیست (query_page)
+هر ردیف جدید و هر تغییر باید دقیقاً یک بار با دنبال کردن cursor برگشتی برسد، حتی وقتی بیشتر از limit است
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import whale_hunter_end4 as wh
+
+LIMIT = 5
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(wh, 'DB_PATH', str(tmp_path / 'cursor.db'))
+    wh.Database.close_all()
+    wh.init_db()
+    yield wh.app.test_client()
+    wh.Database.close_all()
+
+
+def insert(table, count):
+    with sqlite3.connect(wh.DB_PATH) as conn:
+        if table == 'whales':
+            conn.executemany('INSERT INTO whales (symbol, price, volume) VALUES (?, ?, ?)',
+                             [(f'S{i}USDT', 1.0, 1e6) for i in range(count)])
+        else:
+            conn.executemany('INSERT INTO signals (symbol, signal_type, entry_price) VALUES (?, ?, ?)',
+                             [(f'S{i}USDT', 'BUY', 1.0) for i in range(count)])
+        return [row[0] for row in conn.execute(f'SELECT id FROM {table} ORDER BY id DESC LIMIT ?', (count,))]
+
+
+def walk(client, url, list_key, cursor):
+    """دنبال کردن cursor تا has_more=False؛ خروجی: (id های جدید، id های تغییرکرده، cursor نهایی)"""
+    new, updated = [], []
+    while True:
+        query = f"&since_id={cursor['last_id']}"
+        if cursor.get('changed_since'):
+            query += f"&changed_since={cursor['changed_since']}"
+        if cursor.get('changed_id'):
+            query += f"&changed_id={cursor['changed_id']}"
+        body = client.get(f'{url}?limit={LIMIT}{query}').get_json()
+        assert body['delta']
+        assert len(body[list_key]) <= LIMIT
+        new += [row['id'] for row in body[list_key]]
+        updated += [row['id'] for row in body.get('updated', [])]
+        cursor = body['cursor']
+        if not cursor['has_more']:
+            return new, updated, cursor
+
+
+def test_delta_returns_every_new_row_once(client):
+    insert('whales', 3)
+    cursor = client.get(f'/api/whales?limit={LIMIT}').get_json()['cursor']
+
+    added = insert('whales', 23)
+    new, _, cursor = walk(client, '/api/whales', 'whales', cursor)
+    assert sorted(new) == sorted(added)
+    assert cursor['last_id'] == max(added)
+
+    # cursor نهایی: چیزی باقی نمانده
+    assert walk(client, '/api/whales', 'whales', cursor)[0] == []
+
+
+def test_delta_returns_every_update_once(client):
+    ids = insert('signals', 30)
+    cursor = client.get(f'/api/signals?limit={LIMIT}').get_json()['cursor']
+
+    # 23 تغییر، چند تا با زمان یکسان (همان تیک) تا tie-break روی id هم آزموده شود
+    changed = sorted(ids)[:23]
+    with sqlite3.connect(wh.DB_PATH) as conn:
+        conn.executemany("UPDATE signals SET final_status = 'valid', updated_at = ? WHERE id = ?",
+                         [(f'2030-01-01 00:00:{i // 4:02d}', signal_id) for i, signal_id in enumerate(changed)])
+    added = insert('signals', 7)
+
+    new, updated, cursor = walk(client, '/api/signals', 'signals', cursor)
+    assert sorted(new) == sorted(added)
+    assert sorted(updated) == changed
+    assert walk(client, '/api/signals', 'signals', cursor)[:2] == ([], [])
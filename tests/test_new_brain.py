@@ -0,0 +1,78 @@
+"""
+تست‌های موتور کشف فرمول (new_brain.py)
+new_brain.py داخل بلوک ```python ذخیره شده؛ کد از همان بلوک بارگذاری می‌شود
+"""
+
+import asyncio
+import pathlib
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('scipy')
+
+SOURCE = pathlib.Path(__file__).resolve().parent.parent / 'new_brain.py'
+
+
+@pytest.fixture(scope='module')
+def brain():
+    code = re.findall(r'```python\n(.*?)```', SOURCE.read_text(encoding='utf-8'), re.S)[0]
+    namespace = {'__name__': 'new_brain'}
+    exec(compile(code, str(SOURCE), 'exec'), namespace)
+    return namespace
+
+
+@pytest.fixture
+def rising_market():
+    """قیمت همیشه صعودی با حجم تصادفی: فرمول‌های خرید با whale_flow_ratio بالا همیشه سود می‌دهند"""
+    rng = np.random.default_rng(7)
+    n = 3000
+    close = 100 * np.cumprod(np.full(n, 1.001))
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2025-01-01', periods=n, freq='1min'),
+        'open': close,
+        'high': close * 1.001,
+        'low': close * 0.999,
+        'close': close,
+        'volume': rng.uniform(1e3, 1e4, n),
+    })
+
+
+def test_validate_formula_accepts_discovered_patterns(brain, rising_market, caplog):
+    engine = brain['FormulaDiscoveryEngine'](None)
+    patterns = asyncio.run(engine._discover_patterns(rising_market, 'BTCUSDT'))
+    assert patterns
+
+    results = [asyncio.run(engine._validate_formula(pattern['formula'], rising_market, 'BTCUSDT'))
+               for pattern in patterns]
+    assert not [r for r in caplog.records if r.levelname == 'ERROR']
+
+    approved = [pattern['formula'] for pattern, result in zip(patterns, results) if result['approved']]
+    assert approved
+    assert {formula['action'] for formula in approved} == {'BUY'}
+
+
+def test_discovery_cycle_saves_approved_formulas(brain, rising_market):
+    engine = brain['FormulaDiscoveryEngine'](None, brain['SystemMode'].BACKTEST)
+
+    async def history(symbol, days=90):
+        return rising_market
+
+    engine._fetch_historical_data = history
+    asyncio.run(engine.run_discovery_cycle('BTCUSDT'))
+    assert engine.validated_formulas
+    assert all('condition' in entry['formula'] for entry in engine.validated_formulas.values())
+
+
+def test_apply_formula_returns_formula_action(brain, rising_market):
+    engine = brain['FormulaDiscoveryEngine'](None)
+    buy = engine._create_test_formula('whale_flow_ratio', 'volume_pressure')
+    sell = engine._create_test_formula('whale_flow_ratio', 'volume_pressure', 'SELL')
+    assert buy['id'] != sell['id']
+
+    signals = engine.compile_formula(buy)(engine.compute_metrics(rising_market, shift=False))
+    last = int(np.flatnonzero(signals)[-1]) + 1
+    assert engine._apply_formula(buy, rising_market.iloc[:last]) == 'BUY'
+    assert engine._apply_formula(sell, rising_market.iloc[:last]) == 'SELL'
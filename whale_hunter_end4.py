@@ -12,22 +12,37 @@
    ✅ اتصال به LBank و Bitunix
    
    برای اجرا:
-   pip install flask requests
+   pip install flask requests numpy "httpx[http2]"
+   pip install pyarrow  # اختیاری - خروجی parquet/arrow
+   pip install websockets  # اختیاری - ingest_mode = "stream"
    python whale_hunter.py
+   python whale_hunter.py --replay captures/ --speed 0  # بازپخش ضبط‌های capture_dir بدون داشبورد
 ══════════════════════════════════════════════════════════════════════════════
 """
-from flask import Flask, render_template_string, jsonify, send_file, request
+from flask import Flask, render_template_string, jsonify, send_file, request, Response, stream_with_context
 import requests
 import sqlite3
 import hmac
 import hashlib
 import time
 import json
+import gzip
+import argparse
 import threading
 from datetime import datetime, timedelta
 from collections import deque
+from contextlib import contextmanager
+import queue
+import heapq
+import itertools
 import os
+import io
+import csv
 import logging
+import numpy as np
+from history_store import HistoryStore
+import asyncio
+import httpx
 
 app = Flask(__name__)
 
@@ -39,8 +54,21 @@ CONFIG = {
     # API
     "api_source": "coingecko",  # coingecko, kucoin, bybit
     "api_source_sync": True,  # هماهنگ کردن انتخاب صرافی بین بک‌اند و فرانت
+    "api_sources": [],  # منابع همزمان برای background_worker (خالی = فقط api_source)
+    "source_deadlines": {"coingecko": 5, "kucoin": 4, "bybit": 4},  # ثانیه - deadline هر منبع
     "update_interval": 2,  # کاهش زمان بروزرسانی برای سرعت بالاتر (قبلاً 10 بود)
-    "market_cache_ttl": 5,  # زمان cache برای دیتای بازار (ثانیه) - برای سرعت بیشتر
+    "tick_overrun": "skip",  # تیک دیرتر از بودجه: skip (پرش به خانه بعدی) یا catchup (اجرای فوری عقب‌افتاده‌ها)
+    "tick_max_catchup": 3,  # حداکثر تیک عقب‌افتاده که در catchup جبران می‌شود
+    "stage_backoff_max": 60,  # ثانیه - سقف backoff نمایی مرحله‌ای که خطا می‌دهد
+    "persist_max_retries": 5,  # تلاش ناموفق ثبت یک unit تا قرنطینه شدن آن (تیک‌های بعد جدا ثبت می‌شوند)
+    "pipeline": True,  # مراحل تیک در thread های جدا با صف محدود (False = اجرای ترتیبی run_tick)
+    "pipeline_queue_size": 2,  # ظرفیت صف ورودی هر مرحله خط لوله (backpressure)
+    "market_cache_ttl": 5,  # max-age snapshot بازار برای مرورگر (ثانیه) - بعد از آن stale
+    "ingest_mode": "poll",  # poll (REST هر update_interval) یا stream (WebSocket تیکر bybit/kucoin)
+    "ws_urls": {"bybit": "wss://stream.bybit.com/v5/public/spot", "kucoin": ""},  # kucoin خالی = آدرس از bullet-public
+    "stream_symbols": [],  # نمادهای اشتراک bybit (خالی = نمادهای اولین دریافت REST)
+    "stream_min_interval": 1,  # ثانیه - حداقل فاصله دو تیک تشخیص در حالت stream
+    "capture_dir": "",  # پوشه ضبط پاسخ‌های خام منابع برای بازپخش (خالی = خاموش)
     
     # نهنگ
     "whale_threshold": 500000,  # دلار
@@ -70,6 +98,14 @@ CONFIG = {
     "max_daily_trades": 4,
     "max_consecutive_losses": 4,
     "min_score_for_trade": 70,
+    "state_max_age": 60,  # ثانیه - قیمت‌های قبلی ذخیره‌شده قدیمی‌تر از این بعد از ریستارت استفاده نمی‌شوند
+    
+    # نگهداری داده (Retention)
+    "retention_raw_hours": 24,  # ساعت - کندل‌های 1m در دیتابیس اصلی
+    "retention_hot_days": 7,  # روز - rollup ها، indicators و whales در دیتابیس اصلی
+    "retention_archive_days": 90,  # روز - نگهداری فایل‌های آرشیو روزانه (0 = همیشه)
+    "retention_interval": 600,  # ثانیه - فاصله بررسی پارتیشن‌های قدیمی
+    "history_dir": "history",  # پوشه history store ستونی (کندل‌های 1m هر نماد)
     
     # صرافی
     "exchange": "lbank",
@@ -77,15 +113,398 @@ CONFIG = {
     "secret_key": "",
 }
 
+class Clock:
+    """
+    ساعت منطق موتور (کندل‌ها، مراحل اعتبارسنجی، پامپ/دامپ، شمارنده‌های روزانه اتوترید)
+    پیش‌فرض ساعت واقعی؛ در بازپخش (PayloadReplay) زمان ضبط‌شده هر تیک تا تیک بعدی ثابت می‌ماند.
+    زمان‌سنجی کارایی، امضای API صرافی و هدرهای HTTP همچنان time.time() هستند
+    """
+    
+    virtual = None  # None = ساعت واقعی
+    
+    @staticmethod
+    def time():
+        return time.time() if Clock.virtual is None else Clock.virtual
+    
+    @staticmethod
+    def now():
+        return datetime.now() if Clock.virtual is None else datetime.fromtimestamp(Clock.virtual)
+    
+    @staticmethod
+    def stamp():
+        """زمان ستون‌های ایجاد ردیف (UTC هم‌قالب CURRENT_TIMESTAMP) - در بازپخش همان زمان مجازی تیک"""
+        return format_ms(int(Clock.time() * 1000))
+    
+    @staticmethod
+    def set(t):
+        Clock.virtual = t
+
 # ═══════════════════════════════════════════════════════════════════════════
 # دیتابیس sqlite3
 # ═══════════════════════════════════════════════════════════════════════════
 
 DB_PATH = "whale_hunter.db"
 
+# تنظیمات PRAGMA برای اتصال‌های ماندگار
+DB_PRAGMAS = {
+    'journal_mode': 'WAL',  # خواننده‌های Flask و نویسنده worker همدیگر را قفل نمی‌کنند
+    'synchronous': 'NORMAL',  # در حالت WAL امن است و fsync فقط در checkpoint
+    'cache_size': -64000,  # حدود 64MB کش صفحه برای هر اتصال
+    'mmap_size': 268435456,  # 256MB خواندن memory-mapped
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # میلی‌ثانیه
+}
+DB_POOL_SIZE = 8  # حداکثر اتصال بیکار در استخر
+DB_STATEMENT_CACHE = 256  # تعداد prepared statement های کش‌شده در هر اتصال
+
+class Database:
+    """استخر اتصال‌های ماندگار sqlite3 (WAL + prepared statement cache)"""
+    
+    _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+    _local = threading.local()  # اتصالی که thread فعلی در دست دارد (برای فراخوانی تو در تو)
+    
+    @staticmethod
+    def _open():
+        conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        for key, value in DB_PRAGMAS.items():
+            conn.execute(f'PRAGMA {key} = {value}')
+        return conn
+    
+    @staticmethod
+    @contextmanager
+    def connection():
+        """
+        گرفتن یک اتصال از استخر (یا ساخت اتصال جدید اگر خالی بود)
+        فراخوانی تو در تو در همان thread همان اتصال را می‌گیرد تا دو نویسنده همدیگر را قفل نکنند
+        در پایان، تراکنش نیمه‌کاره rollback می‌شود و اتصال به استخر برمی‌گردد
+        """
+        held = getattr(Database._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+        
+        try:
+            conn = Database._pool.get_nowait()
+        except queue.Empty:
+            conn = Database._open()
+        Database._local.conn = conn
+        try:
+            yield conn
+        finally:
+            Database._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                Database._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    @staticmethod
+    def close_all():
+        """بستن همه اتصال‌های بیکار استخر"""
+        while True:
+            try:
+                Database._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+class TickUnit:
+    """
+    واحد کار یک تیک: همه تغییرات (OHLCV، نهنگ، سیگنال، پامپ، اندیکاتور، معامله)
+    در حافظه جمع می‌شوند و در flush با executemany در یک تراکنش ثبت می‌شوند.
+    رویدادهای داشبورد (emit) هم فقط بعد از commit در EventBus منتشر می‌شوند
+    """
+    
+    _next_ids = {}  # {table: شناسه بعدی}
+    _id_lock = threading.Lock()
+    
+    def __init__(self):
+        self.statements = {}  # {sql: [params, ...]} به ترتیب اولین استفاده
+        self.events = {}  # {event_type: [row, ...]}
+        self.failures = 0  # flush های ناموفق (TickScheduler.flush_backlog)
+        self.engine_state = None  # (زمان، وضعیت حافظه) در پایان همین تیک (EngineState.capture)
+    
+    @staticmethod
+    def allocate_ids(table, count):
+        """رزرو count شناسه پشت سر هم قبل از flush (جایگزین lastrowid)"""
+        with TickUnit._id_lock:
+            if table not in TickUnit._next_ids:
+                with Database.connection() as conn:
+                    max_id = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+                    seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+                TickUnit._next_ids[table] = max(max_id, seq[0] if seq else 0) + 1
+            first = TickUnit._next_ids[table]
+            TickUnit._next_ids[table] += count
+            return range(first, first + count)
+    
+    @staticmethod
+    def allocate_id(table):
+        """رزرو شناسه ردیف جدید قبل از flush"""
+        return TickUnit.allocate_ids(table, 1)[0]
+    
+    def add(self, sql, params):
+        self.statements.setdefault(sql, []).append(params)
+    
+    def add_many(self, sql, rows):
+        if rows:
+            self.statements.setdefault(sql, []).extend(rows)
+    
+    def emit(self, event_type, row):
+        self.events.setdefault(event_type, []).append(row)
+    
+    def emit_many(self, event_type, rows):
+        if rows:
+            self.events.setdefault(event_type, []).extend(rows)
+    
+    def flush(self):
+        """ثبت همه تغییرات در یک تراکنش (یک fsync برای کل تیک) و سپس انتشار رویدادها"""
+        total = 0
+        if self.statements:
+            with Database.connection() as conn:
+                for sql, rows in self.statements.items():
+                    conn.executemany(sql, rows)
+                    total += len(rows)
+                conn.commit()
+            self.statements = {}
+        if self.events:
+            ValidationGrid.apply(self.events)
+            EventBus.publish_many(list(self.events.items()))
+            self.events = {}
+        return total
+
+class Summaries:
+    """
+    جداول خلاصه که داخل همان تراکنش تیک بروز می‌شوند (روت‌های آمار بدون اسکن جدول جواب می‌دهند):
+    - signal_stats: تعداد سیگنال‌ها به تفکیک final_status
+    - whale_flow: ورود/خروج نهنگ‌ها در bucket های یک‌دقیقه‌ای (فقط 24 ساعت اخیر نگه داشته می‌شود)
+    - trade_stats: آمار روزانه معاملات بر اساس روز باز شدن (UTC مثل DATE(opened_at))
+    """
+    
+    FLOW_WINDOW = 24 * 60  # دقیقه
+    _pruned_minute = None
+    
+    SIGNAL_SQL = '''INSERT INTO signal_stats (final_status, count) VALUES (?, ?)
+                    ON CONFLICT(final_status) DO UPDATE SET count = count + excluded.count'''
+    FLOW_SQL = '''INSERT INTO whale_flow (minute, inflow, outflow) VALUES (?, ?, ?)
+                  ON CONFLICT(minute) DO UPDATE SET inflow = inflow + excluded.inflow,
+                                                    outflow = outflow + excluded.outflow'''
+    TRADE_SQL = '''INSERT INTO trade_stats (day, total, wins, losses, pnl, commission) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(day) DO UPDATE SET total = total + excluded.total, wins = wins + excluded.wins,
+                                                  losses = losses + excluded.losses, pnl = pnl + excluded.pnl,
+                                                  commission = commission + excluded.commission'''
+    
+    @staticmethod
+    def signal_status(unit, status, delta=1):
+        unit.add(Summaries.SIGNAL_SQL, (status, delta))
+    
+    @staticmethod
+    def whale_flow(unit, inflow, outflow):
+        minute = int(Clock.time() // 60)
+        unit.add(Summaries.FLOW_SQL, (minute, inflow, outflow))
+        # حذف bucket های خارج از پنجره (یک بار در هر دقیقه)
+        if Summaries._pruned_minute != minute:
+            unit.add('DELETE FROM whale_flow WHERE minute <= ?', (minute - Summaries.FLOW_WINDOW,))
+            Summaries._pruned_minute = minute
+    
+    @staticmethod
+    def trade(unit, day, total=0, wins=0, losses=0, pnl=0.0, commission=0.0):
+        unit.add(Summaries.TRADE_SQL, (day, total, wins, losses, pnl, commission))
+    
+    @staticmethod
+    def backfill(conn):
+        """ساخت یک‌باره جداول خلاصه از روی جداول اصلی (دیتابیس‌های قدیمی)"""
+        if conn.execute("SELECT 1 FROM engine_state WHERE key = 'summaries'").fetchone():
+            return
+        conn.execute('DELETE FROM signal_stats')
+        conn.execute('DELETE FROM whale_flow')
+        conn.execute('DELETE FROM trade_stats')
+        conn.execute('''INSERT INTO signal_stats (final_status, count)
+                        SELECT final_status, COUNT(*) FROM signals GROUP BY final_status''')
+        conn.execute('''INSERT INTO whale_flow (minute, inflow, outflow)
+                        SELECT CAST(strftime('%s', timestamp) AS INTEGER) / 60,
+                               SUM(CASE WHEN whale_type = 'buy' THEN volume ELSE 0 END),
+                               SUM(CASE WHEN whale_type = 'sell' THEN volume ELSE 0 END)
+                        FROM whales WHERE timestamp > datetime('now', '-24 hours') GROUP BY 1''')
+        conn.execute('''INSERT INTO trade_stats (day, total, wins, losses, pnl, commission)
+                        SELECT DATE(opened_at), COUNT(*),
+                               SUM(CASE WHEN net_pnl > 0 THEN 1 ELSE 0 END),
+                               SUM(CASE WHEN net_pnl < 0 THEN 1 ELSE 0 END),
+                               COALESCE(SUM(net_pnl), 0), COALESCE(SUM(commission), 0)
+                        FROM trades GROUP BY 1''')
+        conn.execute("INSERT INTO engine_state (key, value, updated_at) VALUES ('summaries', '1', ?)", (Clock.time(),))
+        conn.commit()
+    
+    @staticmethod
+    def signal_counts(c):
+        return dict(c.execute('SELECT final_status, count FROM signal_stats').fetchall())
+    
+    @staticmethod
+    def flow_24h(c):
+        minute = int(Clock.time() // 60)
+        return c.execute('SELECT SUM(inflow), SUM(outflow) FROM whale_flow WHERE minute > ?',
+                         (minute - Summaries.FLOW_WINDOW,)).fetchone()
+    
+    @staticmethod
+    def trade_totals(c, since_day, until_day=None):
+        """(total, wins, losses, pnl, commission) برای روزهای since_day تا until_day"""
+        return c.execute('''SELECT SUM(total), SUM(wins), SUM(losses), SUM(pnl), SUM(commission)
+                            FROM trade_stats WHERE day >= ? AND day <= ?''',
+                         (since_day, until_day or '9999-12-31')).fetchone()
+
+class Retention:
+    """
+    نگهداری داده‌های حجیم (ohlcv، indicators، whales) بر اساس پارتیشن روزانه:
+    - ردیف‌های قدیمی‌تر از پنجره داغ، روز به روز به فایل آرشیو همان روز منتقل می‌شوند
+      ({DB_PATH}_archive/YYYY-MM-DD.db با همان schema - با ATTACH قابل کوئری است)
+    - کندل‌های 1m قبل از انتقال به 5m/15m/1h خلاصه می‌شوند (اگر آن bucket هنوز rollup نداشته باشد)
+      تا دیتابیس اصلی فقط کندل‌های درشت تاریخچه را نگه دارد
+    - فایل‌های آرشیو قدیمی‌تر از retention_archive_days حذف می‌شوند
+    در هر فراخوانی فقط یک پارتیشن (یک جدول، یک روز) جابجا می‌شود تا تیک worker طولانی نشود
+    """
+    
+    # (جدول، شرط، کلید CONFIG پنجره داغ، ضریب به ساعت)
+    POLICIES = [
+        ('ohlcv', "timeframe = '1m'", 'retention_raw_hours', 1),
+        ('ohlcv', "timeframe != '1m'", 'retention_hot_days', 24),
+        ('indicators', '1', 'retention_hot_days', 24),
+        ('whales', '1', 'retention_hot_days', 24),
+    ]
+    
+    next_run = 0
+    
+    DOWNSAMPLE_SQL = '''WITH bars AS (
+                            SELECT symbol, CAST(strftime('%s', timestamp) AS INTEGER) / ? * ? AS bucket,
+                                   MIN(id) AS first_id, MAX(id) AS last_id, MAX(high) AS high, MIN(low) AS low,
+                                   SUM(volume) AS volume, MIN(COALESCE(first_tick, timestamp)) AS first_tick,
+                                   MAX(COALESCE(last_tick, timestamp)) AS last_tick
+                            FROM main.ohlcv
+                            WHERE timeframe = '1m' AND timestamp >= ? AND timestamp < ?
+                            GROUP BY symbol, bucket
+                        )
+                        INSERT INTO main.ohlcv (symbol, timeframe, open, high, low, close, volume,
+                                               timestamp, first_tick, last_tick)
+                        SELECT b.symbol, ?, f.open, b.high, b.low, l.close, b.volume,
+                               datetime(b.bucket, 'unixepoch'), b.first_tick, b.last_tick
+                        FROM bars b
+                        JOIN main.ohlcv f ON f.id = b.first_id
+                        JOIN main.ohlcv l ON l.id = b.last_id
+                        WHERE NOT EXISTS (SELECT 1 FROM main.ohlcv r
+                                          WHERE r.symbol = b.symbol AND r.timeframe = ?
+                                            AND r.timestamp = datetime(b.bucket, 'unixepoch'))'''
+    
+    @staticmethod
+    def archive_dir():
+        return os.path.splitext(DB_PATH)[0] + '_archive'
+    
+    @staticmethod
+    def _cutoff(now, hours):
+        """مرز پنجره داغ (گرد شده به ساعت کامل تا bucket های rollup نصفه نشوند)"""
+        edge = int(now - hours * 3600)
+        return format_ms((edge - edge % 3600) * 1000)
+    
+    @staticmethod
+    def _next_partition(conn, now):
+        """قدیمی‌ترین پارتیشنی که از پنجره داغ بیرون افتاده: (table, condition, lo, hi) یا None"""
+        for table, condition, key, scale in Retention.POLICIES:
+            cutoff = Retention._cutoff(now, CONFIG[key] * scale)
+            oldest = conn.execute(f'SELECT MIN(timestamp) FROM {table} WHERE {condition}').fetchone()[0]
+            if oldest and str(oldest) < cutoff:
+                day = str(oldest)[:10]
+                next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+                return table, condition, f'{day} 00:00:00', min(next_day, cutoff)
+        return None
+    
+    @staticmethod
+    def archive_partition(table, condition, lo, hi):
+        """انتقال ردیف‌های [lo, hi) به فایل آرشیو آن روز؛ خروجی: تعداد ردیف منتقل‌شده"""
+        os.makedirs(Retention.archive_dir(), exist_ok=True)
+        path = os.path.join(Retention.archive_dir(), f'{lo[:10]}.db')
+        # اتصال جدا (ATTACH روی اتصال‌های استخر باقی نماند)
+        conn = Database._open()
+        attached = False
+        try:
+            conn.execute('ATTACH DATABASE ? AS archive', (path,))
+            attached = True
+            schema = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                                  (table,)).fetchone()[0]
+            conn.execute(schema.replace(f'CREATE TABLE {table}', f'CREATE TABLE IF NOT EXISTS archive.{table}', 1))
+            
+            # فایل آرشیو قدیمی ممکن است ستون‌های مهاجرت‌های بعدی را نداشته باشد
+            columns = [(row[1], row[2]) for row in conn.execute(f'PRAGMA main.table_info({table})')]
+            archived = {row[1] for row in conn.execute(f'PRAGMA archive.table_info({table})')}
+            for name, kind in columns:
+                if name not in archived:
+                    conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {kind}')
+            names = ', '.join(name for name, _ in columns)
+            
+            where = f'{condition} AND timestamp >= ? AND timestamp < ?'
+            if table == 'ohlcv' and condition == "timeframe = '1m'":
+                for name, period in CANDLE_ROLLUPS.items():
+                    seconds = period // 1000
+                    conn.execute(Retention.DOWNSAMPLE_SQL, (seconds, seconds, lo, hi, name, name))
+            conn.execute(f'INSERT INTO archive.{table} ({names}) SELECT {names} FROM main.{table} WHERE {where}',
+                         (lo, hi))
+            moved = conn.execute(f'DELETE FROM main.{table} WHERE {where}', (lo, hi)).rowcount
+            conn.commit()
+            return moved
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if attached:
+                conn.execute('DETACH DATABASE archive')
+            conn.close()
+    
+    @staticmethod
+    def drop_old_archives(now):
+        """حذف فایل‌های آرشیو قدیمی‌تر از retention_archive_days (صفر = نگه‌داشتن همیشگی)"""
+        days = CONFIG['retention_archive_days']
+        folder = Retention.archive_dir()
+        if not days or not os.path.isdir(folder):
+            return 0
+        oldest = format_ms(int(now - days * 86400) * 1000)[:10]
+        dropped = 0
+        for name in os.listdir(folder):
+            if name.endswith('.db') and name[:-3] < oldest:
+                os.remove(os.path.join(folder, name))
+                dropped += 1
+        return dropped
+    
+    @staticmethod
+    def run_due(now=None):
+        """یک قدم نگهداری اگر زمانش رسیده باشد (از background_worker بعد از ثبت تیک)"""
+        now = now or Clock.time()
+        if now < Retention.next_run:
+            return
+        with Database.connection() as conn:
+            partition = Retention._next_partition(conn, now)
+        if partition is None:
+            dropped = Retention.drop_old_archives(now)
+            if dropped:
+                print(f"🗄️ {dropped} فایل آرشیو قدیمی حذف شد")
+            Retention.next_run = now + CONFIG['retention_interval']
+            return
+        table, condition, lo, hi = partition
+        started = time.time()
+        moved = Retention.archive_partition(table, condition, lo, hi)
+        print(f"🗄️ آرشیو {table} ({condition}) {lo} → {hi}: {moved} ردیف ({(time.time() - started) * 1000:.0f}ms)")
+        # تا خالی شدن صف پارتیشن‌ها، تیک بعدی ادامه می‌دهد
+
+def _add_missing_columns(c, table, columns):
+    """مهاجرت دیتابیس‌های قدیمی: افزودن ستون‌های جدید در صورت نبودن"""
+    existing = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+    for name, kind in columns.items():
+        if name not in existing:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {name} {kind}')
+
 def init_db():
     """ایجاد جداول دیتابیس"""
-    conn = sqlite3.connect(DB_PATH)
+    with Database.connection() as conn:
+        _create_tables(conn)
+        Summaries.backfill(conn)
+    print("✅ دیتابیس آماده شد (ایندکس‌گذاری شد)")
+
+def _create_tables(conn):
     c = conn.cursor()
     
     # جدول نهنگ‌ها
@@ -126,8 +545,10 @@ def init_db():
         macd_histogram REAL,
         volume REAL,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        validated_at DATETIME
+        validated_at DATETIME,
+        updated_at DATETIME
     )''')
+    _add_missing_columns(c, 'signals', {'updated_at': 'DATETIME'})
     
     # جدول پامپ/دامپ
     c.execute('''CREATE TABLE IF NOT EXISTS pump_dumps (
@@ -178,8 +599,11 @@ def init_db():
         low REAL,
         close REAL,
         volume REAL,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        first_tick DATETIME,
+        last_tick DATETIME
     )''')
+    _add_missing_columns(c, 'ohlcv', {'first_tick': 'DATETIME', 'last_tick': 'DATETIME'})
     
     # جدول اندیکاتورها
     c.execute('''CREATE TABLE IF NOT EXISTS indicators (
@@ -232,277 +656,1445 @@ def init_db():
     c.execute('CREATE INDEX IF NOT EXISTS idx_trades_status ON trades(status)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_trades_time ON trades(opened_at)')
     
+    # ایندکس ستون‌های تغییر برای پاسخ‌های دلتا
+    c.execute('CREATE INDEX IF NOT EXISTS idx_signals_updated ON signals(updated_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pump_validated ON pump_dumps(validated_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trades_closed ON trades(closed_at)')
+    
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ohlcv_symbol_tf ON ohlcv(symbol, timeframe, timestamp)')
+    
+    # ایندکس زمان برای پیدا کردن پارتیشن‌های قدیمی (Retention)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ohlcv_timestamp ON ohlcv(timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_indicators_symbol ON indicators(symbol, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_indicators_timestamp ON indicators(timestamp)')
+    
+    # وضعیت حافظه موتور (برای ریستارت گرم)
+    c.execute('''CREATE TABLE IF NOT EXISTS engine_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    
+    # جداول خلاصه (Summaries)
+    c.execute('''CREATE TABLE IF NOT EXISTS signal_stats (
+        final_status TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS whale_flow (
+        minute INTEGER PRIMARY KEY,
+        inflow REAL NOT NULL DEFAULT 0,
+        outflow REAL NOT NULL DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS trade_stats (
+        day TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        pnl REAL NOT NULL DEFAULT 0,
+        commission REAL NOT NULL DEFAULT 0
+    )''')
+    
     conn.commit()
-    conn.close()
-    print("✅ دیتابیس آماده شد (ایندکس‌گذاری شد)")
 
 # ═══════════════════════════════════════════════════════════════════════════
 # کلاس‌های اصلی
 # ═══════════════════════════════════════════════════════════════════════════
 
-class PriceHistory:
-    """ذخیره تاریخچه قیمت برای محاسبه اندیکاتورها"""
-    def __init__(self, max_size=100):
-        self.data = {}
-        self.max_size = max_size
+def nan_to_none(value):
+    """NaN های NumPy در JSON و sqlite3 باید None باشند"""
+    return None if value != value else value
+
+class EMAColumns:
+    """EMA افزایشی برای چند نماد به صورت برداری (شروع با میانگین ساده‌ی period مقدار اول)"""
     
-    def add(self, symbol, price, volume):
-        if symbol not in self.data:
-            self.data[symbol] = deque(maxlen=self.max_size)
-        self.data[symbol].append({
-            'price': price,
-            'volume': volume,
-            'time': datetime.now()
-        })
+    def __init__(self, period, capacity):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.total = np.zeros(capacity, dtype=np.float64)
+        self.value = np.full(capacity, np.nan, dtype=np.float64)
     
-    def get(self, symbol, count=14):
-        if symbol not in self.data:
-            return []
-        return list(self.data[symbol])[-count:]
-
-price_history = PriceHistory()
+    def grow(self, capacity):
+        extra = capacity - len(self.count)
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.total = np.concatenate([self.total, np.zeros(extra, dtype=np.float64)])
+        self.value = np.concatenate([self.value, np.full(extra, np.nan, dtype=np.float64)])
+    
+    def update(self, rows, x):
+        count = self.count[rows] + 1
+        total = self.total[rows] + x
+        value = self.value[rows]
+        value = np.where(count == self.period, total / self.period,
+                         np.where(count > self.period, value + (x - value) * self.alpha, value))
+        self.count[rows] = count
+        self.total[rows] = np.where(count < self.period, total, 0.0)
+        self.value[rows] = value
+        return value
 
-class Indicators:
-    """محاسبه اندیکاتورها"""
+class IndicatorEngine:
+    """
+    وضعیت اندیکاتورها برای همه نمادها (هر نماد یک ردیف) که با هر تیک در زمان ثابت بروز می‌شود:
+    RSI با هموارسازی Wilder، MACD واقعی با خط سیگنال EMA، EMA-20/50 و میانگین متحرک حجم
+    """
     
-    @staticmethod
-    def calculate_rsi(prices, period=14):
-        if len(prices) < period + 1:
-            return None
+    def __init__(self, capacity, rsi_period=14, fast=12, slow=26, signal=9, volume_window=30):
+        self.rsi_period = rsi_period
+        self.volume_window = volume_window
+        self.changes = np.zeros(capacity, dtype=np.int64)
+        self.avg_gain = np.zeros(capacity, dtype=np.float64)
+        self.avg_loss = np.zeros(capacity, dtype=np.float64)
+        self.macd = np.full(capacity, np.nan, dtype=np.float64)
+        self.volume_sum = np.zeros(capacity, dtype=np.float64)
+        self.ema_fast = EMAColumns(fast, capacity)
+        self.ema_slow = EMAColumns(slow, capacity)
+        self.macd_signal = EMAColumns(signal, capacity)
+        self.ema_20 = EMAColumns(20, capacity)
+        self.ema_50 = EMAColumns(50, capacity)
+    
+    def grow(self, capacity):
+        extra = capacity - len(self.changes)
+        self.changes = np.concatenate([self.changes, np.zeros(extra, dtype=np.int64)])
+        self.avg_gain = np.concatenate([self.avg_gain, np.zeros(extra, dtype=np.float64)])
+        self.avg_loss = np.concatenate([self.avg_loss, np.zeros(extra, dtype=np.float64)])
+        self.macd = np.concatenate([self.macd, np.full(extra, np.nan, dtype=np.float64)])
+        self.volume_sum = np.concatenate([self.volume_sum, np.zeros(extra, dtype=np.float64)])
+        for ema in (self.ema_fast, self.ema_slow, self.macd_signal, self.ema_20, self.ema_50):
+            ema.grow(capacity)
+    
+    def update(self, rows, prices, volumes, last_prices, has_last, dropped_volumes):
+        """
+        rows: ردیف نمادها، last_prices/has_last: قیمت قبلی هر ردیف
+        dropped_volumes: حجمی که از پنجره میانگین حجم خارج می‌شود (0 اگر پنجره پر نیست)
+        """
+        # RSI (Wilder) - دوره اول میانگین ساده، بعد هموارسازی
+        period = self.rsi_period
+        change = np.where(has_last, prices - last_prices, 0.0)
+        gain = np.maximum(change, 0.0)
+        loss = np.maximum(-change, 0.0)
+        changes = self.changes[rows] + has_last
+        seeding = changes <= period
+        avg_gain = self.avg_gain[rows]
+        avg_loss = self.avg_loss[rows]
+        self.avg_gain[rows] = np.where(~has_last, avg_gain,
+                                       np.where(seeding, avg_gain + gain / period,
+                                                (avg_gain * (period - 1) + gain) / period))
+        self.avg_loss[rows] = np.where(~has_last, avg_loss,
+                                       np.where(seeding, avg_loss + loss / period,
+                                                (avg_loss * (period - 1) + loss) / period))
+        self.changes[rows] = changes
         
-        gains = []
-        losses = []
+        # MACD و خط سیگنال (فقط برای ردیف‌هایی که EMA کند آماده است)
+        fast = self.ema_fast.update(rows, prices)
+        slow = self.ema_slow.update(rows, prices)
+        macd = fast - slow
+        self.macd[rows] = macd
+        ready = ~np.isnan(macd)
+        if ready.any():
+            self.macd_signal.update(rows[ready], macd[ready])
         
-        for i in range(1, len(prices)):
-            change = prices[i] - prices[i-1]
-            if change > 0:
-                gains.append(change)
-                losses.append(0)
-            else:
-                gains.append(0)
-                losses.append(abs(change))
+        self.ema_20.update(rows, prices)
+        self.ema_50.update(rows, prices)
         
-        if len(gains) < period:
-            return None
+        self.volume_sum[rows] += volumes - dropped_volumes
+    
+    def rsi(self, rows):
+        avg_gain = self.avg_gain[rows]
+        avg_loss = self.avg_loss[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+        return np.where(self.changes[rows] < self.rsi_period, np.nan, np.round(rsi, 2))
+    
+    def columns(self, rows, counts):
+        """مقادیر فعلی چند ردیف به صورت آرایه (NaN یعنی هنوز آماده نیست)"""
+        macd = self.macd[rows]
+        signal = self.macd_signal.value[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            volume_avg = np.where(counts > 0, self.volume_sum[rows] / np.minimum(counts, self.volume_window), 0.0)
+        return {
+            'rsi': self.rsi(rows),
+            'macd': np.round(macd, 4),
+            'macd_signal': np.round(signal, 4),
+            'macd_histogram': np.round(macd - signal, 4),
+            'volume_avg': volume_avg,
+            'ema_20': self.ema_20.value[rows],
+            'ema_50': self.ema_50.value[rows],
+        }
+    
+    def snapshot(self, row, count):
+        """مقادیر فعلی یک نماد به صورت dict (NaN → None)"""
+        columns = self.columns(np.array([row]), np.array([count]))
+        return {key: nan_to_none(float(values[0])) for key, values in columns.items()}
+
+class PriceHistory:
+    """
+    تاریخچه ستونی قیمت/حجم/زمان در بافر حلقوی NumPy (یک ردیف برای هر نماد)
+    هر مقدار دو بار (در pos و pos+max_size) نوشته می‌شود تا هر پنجره یک view پیوسته و بدون کپی باشد
+    """
+    def __init__(self, max_size=100, capacity=256):
+        self.max_size = max_size
+        self.capacity = capacity
+        self.symbol_ids = {}  # {symbol: row}
+        self.symbols = []
+        self.prices = np.zeros((capacity, 2 * max_size), dtype=np.float64)
+        self.volumes = np.zeros((capacity, 2 * max_size), dtype=np.float64)
+        self.times = np.zeros((capacity, 2 * max_size), dtype=np.int64)  # میلی‌ثانیه epoch
+        self.pos = np.zeros(capacity, dtype=np.int64)  # محل نوشتن بعدی در [0, max_size)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.indicators = IndicatorEngine(
+            capacity, CONFIG['rsi_period'], CONFIG['macd_fast'], CONFIG['macd_slow'], CONFIG['macd_signal']
+        )
+    
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        width = 2 * self.max_size
+        self.prices = np.vstack([self.prices, np.zeros((extra, width), dtype=np.float64)])
+        self.volumes = np.vstack([self.volumes, np.zeros((extra, width), dtype=np.float64)])
+        self.times = np.vstack([self.times, np.zeros((extra, width), dtype=np.int64)])
+        self.pos = np.concatenate([self.pos, np.zeros(extra, dtype=np.int64)])
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+        self.indicators.grow(capacity)
+        self.capacity = capacity
+    
+    def rows_for(self, symbols):
+        """نگاشت نماد → ردیف (نمادهای جدید ردیف می‌گیرند)"""
+        ids = self.symbol_ids
+        for symbol in symbols:
+            if symbol not in ids:
+                ids[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        if len(self.symbols) > self.capacity:
+            capacity = self.capacity
+            while capacity < len(self.symbols):
+                capacity *= 2
+            self._grow(capacity)
+        return np.fromiter((ids[s] for s in symbols), dtype=np.int64, count=len(symbols))
+    
+    def add_many(self, symbols, prices, volumes, timestamp=None, rows=None):
+        """افزودن یک تیک برای چند نماد به صورت برداری (نمادها نباید تکراری باشند)"""
+        if not len(symbols):
+            return
+        if rows is None:
+            rows = self.rows_for(symbols)
+        prices = np.asarray(prices, dtype=np.float64)
+        volumes = np.asarray(volumes, dtype=np.float64)
+        ts = int((timestamp or Clock.time()) * 1000)
+        
+        pos = self.pos[rows]
+        counts = self.counts[rows]
+        last = (pos - 1) % self.max_size
+        has_last = counts > 0
+        last_prices = self.prices[rows, last]
         
-        avg_gain = sum(gains[-period:]) / period
-        avg_loss = sum(losses[-period:]) / period
+        # حجمی که از پنجره میانگین حجم خارج می‌شود
+        window = self.indicators.volume_window
+        dropped = np.where(counts >= window, self.volumes[rows, (pos - window) % self.max_size], 0.0)
         
-        if avg_loss == 0:
-            return 100
+        for column, values in ((self.prices, prices), (self.volumes, volumes), (self.times, ts)):
+            column[rows, pos] = values
+            column[rows, pos + self.max_size] = values
+        self.pos[rows] = (pos + 1) % self.max_size
+        self.counts[rows] = np.minimum(counts + 1, self.max_size)
         
-        rs = avg_gain / avg_loss
-        rsi = 100 - (100 / (1 + rs))
-        return round(rsi, 2)
+        self.indicators.update(rows, prices, volumes, last_prices, has_last, dropped)
     
-    @staticmethod
-    def calculate_macd(prices, fast=12, slow=26, signal=9):
-        if len(prices) < slow:
-            return None, None, None
+    def add(self, symbol, price, volume):
+        self.add_many([symbol], [price], [volume])
+    
+    def get(self, symbol, count=14):
+        """آخرین count تیک نماد به صورت view های (prices, volumes, times) بدون کپی"""
+        row = self.symbol_ids.get(symbol)
+        if row is None:
+            empty = np.empty(0)
+            return empty, empty, np.empty(0, dtype=np.int64)
+        n = min(count, int(self.counts[row]))
+        end = int(self.pos[row]) + self.max_size
+        return (self.prices[row, end - n:end], self.volumes[row, end - n:end],
+                self.times[row, end - n:end])
+    
+    def count(self, symbol):
+        row = self.symbol_ids.get(symbol)
+        return 0 if row is None else int(self.counts[row])
+    
+    def universe(self, count):
+        """
+        پنجره آخرین count تیک همه نمادها به صورت ماتریس (n_symbols × count) برای محاسبات برداری
+        (برای نمادهایی که کمتر از count تیک دارند، ابتدای ردیف صفر است - با self.counts چک شود)
+        """
+        n = len(self.symbols)
+        end = self.pos[:n] + self.max_size
+        cols = end[:, None] - count + np.arange(count)
+        rows = np.arange(n)[:, None]
+        return self.prices[rows, cols], self.volumes[rows, cols]
+    
+    def indicator_columns(self, rows):
+        return self.indicators.columns(rows, self.counts[rows])
+    
+    def indicator_snapshot(self, symbol):
+        row = self.symbol_ids.get(symbol)
+        if row is None:
+            return None
+        return self.indicators.snapshot(row, int(self.counts[row]))
+
+price_history = PriceHistory()
+
+CANDLE_ROLLUPS = {'5m': 5 * 60000, '15m': 15 * 60000, '1h': 60 * 60000}  # تایم‌فریم‌های مشتق از 1m (ms)
+
+def format_ms(ms, with_ms=False):
+    """epoch ms → متن UTC هم‌قالب CURRENT_TIMESTAMP"""
+    text = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ms // 1000))
+    return f"{text}.{ms % 1000:03d}" if with_ms else text
+
+class CandleColumns:
+    """کندل‌های باز یک تایم‌فریم برای همه نمادها (هر نماد یک ردیف هم‌ردیف با price_history)"""
+    
+    FIELDS = ('start', 'open', 'high', 'low', 'close', 'volume', 'first_tick', 'last_tick')
+    
+    def __init__(self, capacity):
+        self.start = np.full(capacity, -1, dtype=np.int64)  # شروع کندل (ms)، ‎-1 یعنی کندل باز ندارد
+        self.open = np.zeros(capacity, dtype=np.float64)
+        self.high = np.zeros(capacity, dtype=np.float64)
+        self.low = np.zeros(capacity, dtype=np.float64)
+        self.close = np.zeros(capacity, dtype=np.float64)
+        self.volume = np.zeros(capacity, dtype=np.float64)
+        self.first_tick = np.zeros(capacity, dtype=np.int64)
+        self.last_tick = np.zeros(capacity, dtype=np.int64)
+    
+    def grow(self, capacity):
+        extra = capacity - len(self.start)
+        for field in self.FIELDS:
+            column = getattr(self, field)
+            fill = -1 if field == 'start' else 0
+            setattr(self, field, np.concatenate([column, np.full(extra, fill, dtype=column.dtype)]))
+    
+    def merge(self, rows, start, open_, high, low, close, volume, first_tick, last_tick):
+        """ادغام برداری تیک‌ها یا کندل‌های کوچک‌تر در کندل باز (ردیف‌ها نباید تکراری باشند)"""
+        fresh = self.start[rows] != start
+        self.start[rows] = start
+        self.open[rows] = np.where(fresh, open_, self.open[rows])
+        self.high[rows] = np.where(fresh, high, np.maximum(self.high[rows], high))
+        self.low[rows] = np.where(fresh, low, np.minimum(self.low[rows], low))
+        self.close[rows] = close
+        self.volume[rows] = np.where(fresh, volume, self.volume[rows] + volume)
+        self.first_tick[rows] = np.where(fresh, first_tick, self.first_tick[rows])
+        self.last_tick[rows] = last_tick
+    
+    def take(self, rows):
+        """برداشتن کندل‌های بسته‌شده {field: array} و خالی کردن ردیف‌ها"""
+        bars = {field: getattr(self, field)[rows] for field in self.FIELDS}
+        bars['rows'] = rows
+        self.start[rows] = -1
+        return bars
+
+class CandleBuilder:
+    """
+    تجمیع تیک‌ها به کندل واقعی 1m (open/high/low/close/volume و زمان اولین/آخرین تیک)
+    هر کندل فقط یک بار و بعد از بسته شدن ثبت می‌شود؛ 5m/15m/1h از روی کندل‌های بسته‌شده 1m ساخته می‌شوند
+    حجم کندل = مجموع افزایش حجم 24 ساعته بین تیک‌ها (API ها حجم هر معامله را نمی‌دهند)
+    """
+    
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.minute = CandleColumns(capacity)
+        self.rollups = {name: CandleColumns(capacity) for name in CANDLE_ROLLUPS}
+        self.last_volume = np.full(capacity, np.nan, dtype=np.float64)
+        self.minute_bars = None  # کندل‌های 1m بسته‌شده در آخرین update (برای history store)
+    
+    def _grow(self, capacity):
+        self.minute.grow(capacity)
+        for columns in self.rollups.values():
+            columns.grow(capacity)
+        extra = capacity - self.capacity
+        self.last_volume = np.concatenate([self.last_volume, np.full(extra, np.nan, dtype=np.float64)])
+        self.capacity = capacity
+    
+    def update(self, rows, prices, volumes, timestamp=None):
+        """افزودن یک تیک؛ خروجی: ردیف‌های INSERT کندل‌هایی که در این تیک بسته شدند"""
+        if price_history.capacity > self.capacity:
+            self._grow(price_history.capacity)
+        ts = int((timestamp or Clock.time()) * 1000)
+        minute = ts - ts % 60000
+        closed = []
+        self.minute_bars = None
         
-        def ema(data, period):
-            multiplier = 2 / (period + 1)
-            ema_val = data[0]
-            for price in data[1:]:
-                ema_val = (price - ema_val) * multiplier + ema_val
-            return ema_val
+        # بستن کندل‌های 1m دقیقه‌های قبل (برای همه نمادها، حتی آنهایی که در این تیک نیامده‌اند)
+        stale = np.flatnonzero((self.minute.start >= 0) & (self.minute.start < minute))
+        if len(stale):
+            bars = self.minute.take(stale)
+            closed.append(('1m', bars))
+            self.minute_bars = bars
+            for name, period in CANDLE_ROLLUPS.items():
+                columns = self.rollups[name]
+                bucket = bars['start'] - bars['start'] % period
+                ended = stale[(columns.start[stale] >= 0) & (columns.start[stale] != bucket)]
+                if len(ended):
+                    closed.append((name, columns.take(ended)))
+                columns.merge(stale, bucket, bars['open'], bars['high'], bars['low'], bars['close'],
+                              bars['volume'], bars['first_tick'], bars['last_tick'])
         
-        ema_fast = ema(prices[-fast:], fast)
-        ema_slow = ema(prices[-slow:], slow)
-        macd_line = ema_fast - ema_slow
+        # بستن rollup هایی که دوره‌شان تمام شده
+        for name, period in CANDLE_ROLLUPS.items():
+            columns = self.rollups[name]
+            ended = np.flatnonzero((columns.start >= 0) & (columns.start + period <= minute))
+            if len(ended):
+                closed.append((name, columns.take(ended)))
         
-        # برای سیگنال نیاز به تاریخچه MACD داریم
-        signal_line = macd_line * 0.9  # ساده‌سازی
-        histogram = macd_line - signal_line
+        # تیک جاری در کندل 1m باز
+        if len(rows):
+            prices = np.asarray(prices, dtype=np.float64)
+            volumes = np.asarray(volumes, dtype=np.float64)
+            last = self.last_volume[rows]
+            traded = np.where(np.isnan(last), 0.0, np.maximum(volumes - last, 0.0))
+            self.last_volume[rows] = volumes
+            self.minute.merge(rows, minute, prices, prices, prices, prices, traded, ts, ts)
         
-        return round(macd_line, 4), round(signal_line, 4), round(histogram, 4)
+        return [
+            (price_history.symbols[row], timeframe, o, h, l, c, v,
+             format_ms(start), format_ms(first, True), format_ms(last, True))
+            for timeframe, bars in closed
+            for row, start, o, h, l, c, v, first, last in zip(
+                bars['rows'].tolist(), bars['start'].tolist(), bars['open'].tolist(),
+                bars['high'].tolist(), bars['low'].tolist(), bars['close'].tolist(),
+                bars['volume'].tolist(), bars['first_tick'].tolist(), bars['last_tick'].tolist())
+        ]
+
+candle_builder = CandleBuilder()
+history = HistoryStore(CONFIG['history_dir'])
+
+def append_history(bars):
+    """کندل‌های 1m بسته‌شده → history store ستونی (خواندن memory-mapped برای موتورهای کشف الگو)"""
+    symbols = price_history.symbols
+    rows = [(symbols[row], start, o, h, l, c, v) for row, start, o, h, l, c, v in zip(
+        bars['rows'].tolist(), bars['start'].tolist(), bars['open'].tolist(), bars['high'].tolist(),
+        bars['low'].tolist(), bars['close'].tolist(), bars['volume'].tolist())]
+    try:
+        history.append_rows(rows)
+    except OSError as e:
+        logging.error(f"History store error: {e}")
+
+class Indicators:
+    """محاسبه اندیکاتورها"""
     
     @staticmethod
-    def calculate_all(symbol):
-        history = price_history.get(symbol, 30)
-        if len(history) < 14:
+    def calculate_all(symbol, unit=None):
+        if price_history.count(symbol) < 14:
             return {}
         
-        prices = [h['price'] for h in history]
-        volumes = [h['volume'] for h in history]
+        # مقادیر از قبل در PriceHistory.add_many بروز شده‌اند
+        result = price_history.indicator_snapshot(symbol)
         
-        rsi = Indicators.calculate_rsi(prices)
-        macd, macd_sig, macd_hist = Indicators.calculate_macd(prices)
+        # ذخیره در دیتابیس (در واحد کار تیک)
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
+        unit.add('''INSERT INTO indicators (symbol, rsi, macd, macd_signal, macd_histogram, ema_20, ema_50, volume_avg,
+                                          timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                 (symbol, result['rsi'], result['macd'], result['macd_signal'], 
+                  result['macd_histogram'], result['ema_20'], result['ema_50'], result['volume_avg'], Clock.stamp()))
+        if own_unit:
+            unit.flush()
         
-        result = {
-            'rsi': rsi,
-            'macd': macd,
-            'macd_signal': macd_sig,
-            'macd_histogram': macd_hist,
-            'volume_avg': sum(volumes) / len(volumes) if volumes else 0,
-            'ema_20': sum(prices[-20:]) / min(len(prices), 20) if prices else 0,
-        }
+        return result
+
+    @staticmethod
+    def calculate_many(symbols, rows, unit=None, frozen=None):
+        """
+        اندیکاتورهای چند نماد به صورت برداری + ثبت دسته‌ای در جدول indicators
+        frozen: (columns, ready) ثبت‌شده در MarketSnapshot همان تیک (خط لوله تیک بعد را همزمان در price_history می‌ریزد)
+        خروجی: dict از آرایه‌ها (برای نمادهای کمتر از 14 تیک همه NaN)
+        """
+        if frozen is None:
+            columns = price_history.indicator_columns(rows)
+            ready = price_history.counts[rows] >= 14
+        else:
+            columns, ready = frozen
+        for key in columns:
+            columns[key] = np.where(ready, columns[key], np.nan)
         
-        # ذخیره در دیتابیس
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''INSERT INTO indicators (symbol, rsi, macd, macd_signal, macd_histogram, ema_20, volume_avg)
-                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                  (symbol, result['rsi'], result['macd'], result['macd_signal'], 
-                   result['macd_histogram'], result['ema_20'], result['volume_avg']))
-        conn.commit()
-        conn.close()
+        keys = ('rsi', 'macd', 'macd_signal', 'macd_histogram', 'ema_20', 'ema_50', 'volume_avg')
+        table = np.column_stack([columns[key] for key in keys]).tolist()
+        stamp = Clock.stamp()
+        batch = [(symbols[i], *map(nan_to_none, table[i]), stamp) for i in np.flatnonzero(ready)]
         
-        return result
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
+        unit.add_many('''INSERT INTO indicators (symbol, rsi, macd, macd_signal, macd_histogram, ema_20, ema_50, volume_avg,
+                                               timestamp)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+        if own_unit:
+            unit.flush()
+        
+        return columns
 
 class MarketAPI:
-    """دریافت قیمت از API"""
+    """
+    دریافت قیمت از API
+    همه منابع پیکربندی‌شده به صورت همزمان (asyncio + httpx با اتصال‌های HTTP/2 مشترک) گرفته می‌شوند
+    و هر منبع deadline جداگانه دارد؛ زمان تیک = کندترین منبعی که قبل از deadline جواب داده
+    """
     
-    session = requests.Session()
+    @staticmethod
+    def parse_coingecko(data):
+        return [{
+            'symbol': f"{item['symbol'].upper()}USDT",
+            'price': item['current_price'],
+            'change_24h': item.get('price_change_percentage_24h', 0) or 0,
+            'change_1h': item.get('price_change_percentage_1h_in_currency', 0) or 0,
+            'high_24h': item.get('high_24h', 0),
+            'low_24h': item.get('low_24h', 0),
+            'volume': item.get('total_volume', 0),
+            'market_cap': item.get('market_cap', 0),
+        } for item in data]
     
     @staticmethod
-    def fetch_coingecko():
-        try:
-            url = "https://api.coingecko.com/api/v3/coins/markets"
-            params = {
+    def parse_kucoin(data):
+        tickers = data.get('data', {}).get('ticker', [])
+        return [{
+            'symbol': t['symbol'].replace('-', ''),
+            'price': float(t.get('last', 0)),
+            'change_24h': float(t.get('changeRate', 0)) * 100,
+            'change_1h': 0,
+            'high_24h': float(t.get('high', 0)),
+            'low_24h': float(t.get('low', 0)),
+            'volume': float(t.get('volValue', 0)),
+            'market_cap': 0,
+        } for t in tickers if t['symbol'].endswith('-USDT')][:100]
+    
+    @staticmethod
+    def parse_bybit(data):
+        tickers = data.get('result', {}).get('list', [])
+        return [{
+            'symbol': t['symbol'],
+            'price': float(t.get('lastPrice', 0)),
+            'change_24h': float(t.get('price24hPcnt', 0)) * 100,
+            'change_1h': 0,
+            'high_24h': float(t.get('highPrice24h', 0)),
+            'low_24h': float(t.get('lowPrice24h', 0)),
+            'volume': float(t.get('turnover24h', 0)),
+            'market_cap': 0,
+        } for t in tickers if t['symbol'].endswith('USDT')][:100]
+    
+    SOURCES = {
+        'coingecko': {
+            'url': "https://api.coingecko.com/api/v3/coins/markets",
+            'params': {
                 "vs_currency": "usd",
                 "order": "market_cap_desc",
                 "per_page": 100,
                 "page": 1,
-                "sparkline": False,
+                "sparkline": "false",
                 "price_change_percentage": "1h,24h"
-            }
-            # استفاده از Session برای سرعت بیشتر
-            response = MarketAPI.session.get(url, params=params, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                return [{
-                    'symbol': f"{item['symbol'].upper()}USDT",
-                    'price': item['current_price'],
-                    'change_24h': item.get('price_change_percentage_24h', 0) or 0,
-                    'change_1h': item.get('price_change_percentage_1h_in_currency', 0) or 0,
-                    'high_24h': item.get('high_24h', 0),
-                    'low_24h': item.get('low_24h', 0),
-                    'volume': item.get('total_volume', 0),
-                    'market_cap': item.get('market_cap', 0),
-                } for item in data]
-        except Exception as e:
-            print(f"❌ CoinGecko Error: {e}")
-        return None
+            },
+            'parse': parse_coingecko,
+        },
+        'kucoin': {
+            'url': "https://api.kucoin.com/api/v1/market/allTickers",
+            'params': {},
+            'parse': parse_kucoin,
+        },
+        'bybit': {
+            'url': "https://api.bybit.com/v5/market/tickers",
+            'params': {"category": "spot"},
+            'parse': parse_bybit,
+        },
+    }
+    
+    _loop = None
+    _loop_lock = threading.Lock()
+    _client = None
+    last_sources = {}  # {source: freshness stamp آخرین دریافت}
+    fingerprints = {}  # {source: {'digest', 'updated_at', 'unchanged'}}
+    noop_ticks = 0  # تیک‌هایی که payload هیچ منبعی عوض نشده بود
+    _last_merged = None  # لیست ادغام‌شده آخرین دریافت
+    _ingested = (None, None)  # (لیست خام، snapshot) آخرین ingest
     
     @staticmethod
-    def fetch_kucoin():
-        try:
-            url = "https://api.kucoin.com/api/v1/market/allTickers"
-            response = MarketAPI.session.get(url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                tickers = data.get('data', {}).get('ticker', [])
-                return [{
-                    'symbol': t['symbol'].replace('-', ''),
-                    'price': float(t.get('last', 0)),
-                    'change_24h': float(t.get('changeRate', 0)) * 100,
-                    'change_1h': 0,
-                    'high_24h': float(t.get('high', 0)),
-                    'low_24h': float(t.get('low', 0)),
-                    'volume': float(t.get('volValue', 0)),
-                    'market_cap': 0,
-                } for t in tickers if t['symbol'].endswith('-USDT')][:100]
-        except Exception as e:
-            print(f"❌ KuCoin Error: {e}")
-        return None
+    def configured_sources():
+        return CONFIG.get('api_sources') or [CONFIG['api_source']]
     
     @staticmethod
-    def fetch_bybit():
-        try:
-            url = "https://api.bybit.com/v5/market/tickers"
-            params = {"category": "spot"}
-            response = requests.get(url, params=params, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                tickers = data.get('result', {}).get('list', [])
-                return [{
-                    'symbol': t['symbol'],
-                    'price': float(t.get('lastPrice', 0)),
-                    'change_24h': float(t.get('price24hPcnt', 0)) * 100,
-                    'change_1h': 0,
-                    'high_24h': float(t.get('highPrice24h', 0)),
-                    'low_24h': float(t.get('lowPrice24h', 0)),
-                    'volume': float(t.get('turnover24h', 0)),
-                    'market_cap': 0,
-                } for t in tickers if t['symbol'].endswith('USDT')][:100]
-        except Exception as e:
-            print(f"❌ Bybit Error: {e}")
-        return None
+    def _run(coro):
+        """اجرای coroutine روی event loop دائمی دریافت (thread-safe)"""
+        with MarketAPI._loop_lock:
+            if MarketAPI._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name='market-fetch-loop').start()
+                MarketAPI._loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, MarketAPI._loop).result()
     
-    # Cache برای سرعت بیشتر (غیرفعال شده برای دیتای fresh)
-    _cache = {}
-    _cache_time = {}
+    @staticmethod
+    def _get_client():
+        if MarketAPI._client is None:
+            MarketAPI._client = httpx.AsyncClient(
+                http2=True,
+                headers={'Accept': 'application/json'},
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return MarketAPI._client
     
     @staticmethod
-    def fetch(source=None):
-        source = source or CONFIG['api_source']
-        # Cache غیرفعال شده - همیشه دیتای fresh بگیر
-        # cache_ttl = CONFIG.get('market_cache_ttl', 5)
-        
-        # بررسی cache (غیرفعال)
-        # cache_key = f"market_{source}"
-        # now = time.time()
-        # if cache_key in MarketAPI._cache and cache_key in MarketAPI._cache_time:
-        #     if now - MarketAPI._cache_time[cache_key] < cache_ttl:
-        #         return MarketAPI._cache[cache_key]
+    async def _fetch_source(source):
+        spec = MarketAPI.SOURCES.get(source)
+        deadline = CONFIG['source_deadlines'].get(source, 5)
+        started = time.time()
+        items = None
+        error = None
+        status = body = None
+        if spec is None:
+            error = 'unknown source'
+        else:
+            try:
+                response = await asyncio.wait_for(
+                    MarketAPI._get_client().get(spec['url'], params=spec['params'], timeout=deadline),
+                    deadline
+                )
+                status = response.status_code
+                if status == 200:
+                    body = response.text
+                    items = spec['parse'](json.loads(body))
+                else:
+                    error = f"HTTP {status}"
+            except asyncio.TimeoutError:
+                error = f"deadline {deadline}s"
+            except Exception as e:
+                error = str(e)
         
-        # دریافت دیتا
-        if source == 'coingecko':
-            data = MarketAPI.fetch_coingecko()
-        elif source == 'kucoin':
-            data = MarketAPI.fetch_kucoin()
-        elif source == 'bybit':
-            data = MarketAPI.fetch_bybit()
+        if error:
+            print(f"❌ {source} Error: {error}")
+        stamp = {
+            'ok': items is not None,
+            'count': len(items) if items else 0,
+            'fetched_at': Clock.now().isoformat(),
+            'latency_ms': round((time.time() - started) * 1000),
+            'error': error,
+        }
+        stamp.update(MarketAPI._fingerprint(source, body))
+        if CONFIG.get('capture_dir'):
+            PayloadRecorder.add(source, started, stamp['latency_ms'], status, body, error)
+        return source, items, stamp
+    
+    @staticmethod
+    def _fingerprint(source, body):
+        """
+        اثر انگشت محتوای پاسخ هر منبع (CoinGecko فقط حدود هر دقیقه تازه می‌شود)
+        خروجی برای stamp: changed، زمان آخرین تغییر محتوا و تعداد دریافت‌های بدون تغییر پشت سر هم
+        """
+        digest = hashlib.blake2b(body.encode(), digest_size=16).hexdigest() if body is not None else None
+        previous = MarketAPI.fingerprints.get(source)
+        changed = digest is None or previous is None or previous['digest'] != digest
+        if changed:
+            previous = MarketAPI.fingerprints[source] = {'digest': digest, 'updated_at': Clock.now().isoformat(),
+                                                          'unchanged': 0}
         else:
-            data = None
+            previous['unchanged'] += 1
+        return {'changed': changed, 'content_updated_at': previous['updated_at'], 'unchanged_polls': previous['unchanged']}
+    
+    @staticmethod
+    def _unchanged_or(merged, changed):
+        """
+        اگر payload هیچ منبعی عوض نشده همان لیست تیک قبل برمی‌گردد؛
+        ingest با مقایسه is تیک را no-op تشخیص می‌دهد (بدون پرچم مشترک بین مراحل خط لوله)
+        """
+        if merged and not changed and MarketAPI._last_merged is not None:
+            return MarketAPI._last_merged
+        MarketAPI._last_merged = merged
+        return merged
+    
+    @staticmethod
+    async def _fetch_all(sources):
+        return await asyncio.gather(*(MarketAPI._fetch_source(source) for source in sources))
+    
+    @staticmethod
+    def fetch_sources(sources):
+        """
+        دریافت همزمان همه منابع و ادغام در یک لیست (هر آیتم با فیلد source)
+        خروجی None یعنی هیچ منبعی قبل از deadline جواب نداد (در بازپخش: تیک ضبط‌شده بعدی)
+        """
+        if PayloadReplay.active:
+            return PayloadReplay.next_tick()
+        merged = []
+        changed = False
+        for source, items, stamp in MarketAPI._run(MarketAPI._fetch_all(sources)):
+            MarketAPI.last_sources[source] = stamp
+            changed = changed or stamp['changed']
+            for item in items or []:
+                item['source'] = source
+                merged.append(item)
+        PayloadRecorder.commit()
+        return MarketAPI._unchanged_or(merged, changed) or None
+    
+    @staticmethod
+    def fetch(source=None, unit=None):
+        # بدون source: همه منابع پیکربندی‌شده (CONFIG['api_sources']) به صورت همزمان
+        sources = [source] if source else MarketAPI.configured_sources()
         
+        # دریافت دیتا
+        return MarketAPI.ingest(MarketAPI.fetch_sources(sources), unit)
+    
+    @staticmethod
+    def ingest(data, unit=None):
+        """
+        لیست خام آیتم‌ها → MarketSnapshot + تاریخچه قیمت، کندل‌ها و history store
+        فقط نمادهایی که قیمت یا حجمشان تغییر کرده وارد تاریخچه قیمت می‌شوند (snapshot.changed)؛
+        payload بدون تغییر (همان لیست تیک قبل) فقط کندل‌های دقیقه تمام‌شده را می‌بندد
+        """
         if data:
-            # حذف تکرارها بر اساس symbol (برای رفع مشکل ارزهای تکراری)
-            seen = {}
-            unique_data = []
-            for item in data:
-                symbol = item['symbol']
-                if symbol not in seen or item.get('volume', 0) > seen[symbol].get('volume', 0):
-                    if symbol in seen:
-                        # جایگزین با داده بهتر
-                        idx = unique_data.index(seen[symbol])
-                        unique_data[idx] = item
-                    else:
-                        unique_data.append(item)
-                    seen[symbol] = item
-            
-            data = unique_data
-            
-            # ذخیره در تاریخچه و OHLCV (بهینه شده - batch insert)
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            batch_data = []
-            for item in data:
-                price_history.add(item['symbol'], item['price'], item['volume'])
-                batch_data.append((
-                    item['symbol'], item['price'], item.get('high_24h', item['price']), 
-                    item.get('low_24h', item['price']), item['price'], item['volume']
-                ))
-            
-            # Batch insert برای سرعت بیشتر
-            if batch_data:
-                c.executemany('''INSERT INTO ohlcv (symbol, open, high, low, close, volume)
-                                 VALUES (?, ?, ?, ?, ?, ?)''', batch_data)
-            conn.commit()
-            conn.close()
+            now = Clock.time()
+            raw, previous = MarketAPI._ingested
+            if data is raw:
+                MarketAPI.noop_ticks += 1
+                data = previous.unchanged()
+                candles = candle_builder.update(data.rows[:0], data.prices[:0], data.volumes[:0], now)
+            else:
+                # حذف تکرارها بر اساس symbol در یک گذر (بیشترین حجم می‌ماند)
+                snapshot = MarketSnapshot(data)
+                MarketAPI._ingested = (data, snapshot)
+                data = snapshot
+                moved = data.changed = SymbolChanges.update(data.rows, data.prices, data.volumes)
+                
+                # ذخیره در تاریخچه و کندل‌های بسته‌شده (batch insert)
+                price_history.add_many([data.symbols[i] for i in moved], data.prices[moved], data.volumes[moved],
+                                       now, rows=data.rows[moved])
+                data.freeze_indicators()
+                candles = candle_builder.update(data.rows, data.prices, data.volumes, now)
+            if candle_builder.minute_bars is not None:
+                append_history(candle_builder.minute_bars)
             
-            # Cache غیرفعال - همیشه دیتای fresh
-            # MarketAPI._cache[cache_key] = data
-            # MarketAPI._cache_time[cache_key] = now
+            # Batch insert برای سرعت بیشتر (اگر unit داده شود، همراه کل تیک ثبت می‌شود)
+            own_unit = unit is None
+            if own_unit:
+                unit = TickUnit()
+            unit.add_many('''INSERT INTO ohlcv (symbol, timeframe, open, high, low, close, volume,
+                                                timestamp, first_tick, last_tick)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', candles)
+            if own_unit:
+                unit.flush()
         
         return data
 
+class PayloadRecorder:
+    """
+    ضبط پاسخ‌های خام منابع (CONFIG['capture_dir'] غیرخالی) برای بازپخش قطعی با PayloadReplay
+    فایل روزانه gzip append-only: <capture_dir>/YYYY-MM-DD.jsonl.gz
+    هر خط {"tick", "t", "source", "status", "latency_ms", "body", "error"} - پاسخ‌های یک دریافت همزمان tick یکسان دارند
+    """
+    
+    _lock = threading.Lock()
+    _pending = []
+    _file = None
+    _day = None
+    tick = 0
+    
+    @staticmethod
+    def add(source, t, latency_ms, status, body, error):
+        with PayloadRecorder._lock:
+            PayloadRecorder._pending.append({'t': t, 'source': source, 'status': status,
+                                             'latency_ms': latency_ms, 'body': body, 'error': error})
+    
+    @staticmethod
+    def _last_tick(path):
+        """آخرین شماره tick فایل روز (ادامه شمارش بعد از ری‌استارت - شماره تیک‌های یک فایل تکرار نمی‌شود)"""
+        last = 0
+        if not os.path.exists(path):
+            return last
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    last = json.loads(line)['tick']
+        except (EOFError, OSError, ValueError, KeyError):
+            pass  # انتهای ناتمام بعد از کرش
+        return last
+    
+    @staticmethod
+    def commit():
+        """نوشتن پاسخ‌های یک دریافت به عنوان یک تیک (flush همگام: فایل بعد از کرش تا آخرین تیک خواناست)"""
+        with PayloadRecorder._lock:
+            records, PayloadRecorder._pending = PayloadRecorder._pending, []
+            if not records or not CONFIG.get('capture_dir'):
+                return
+            day = datetime.fromtimestamp(records[0]['t']).strftime('%Y-%m-%d')
+            if PayloadRecorder._day != day:
+                if PayloadRecorder._file:
+                    PayloadRecorder._file.close()
+                os.makedirs(CONFIG['capture_dir'], exist_ok=True)
+                path = os.path.join(CONFIG['capture_dir'], f'{day}.jsonl.gz')
+                PayloadRecorder.tick = max(PayloadRecorder.tick, PayloadRecorder._last_tick(path))
+                PayloadRecorder._file = gzip.open(path, 'at', encoding='utf-8')
+                PayloadRecorder._day = day
+            PayloadRecorder.tick += 1
+            for record in records:
+                PayloadRecorder._file.write(json.dumps(dict(record, tick=PayloadRecorder.tick)) + '\n')
+            PayloadRecorder._file.flush()
+
+class PayloadReplay:
+    """
+    منبع بازپخش: تیک‌های ضبط‌شده PayloadRecorder به جای دریافت زنده از MarketAPI.fetch_sources برمی‌گردند
+    (همان parse ها → همان ingest، تشخیص، اعتبارسنجی و اتوترید). Clock روی زمان ضبط هر تیک قرار می‌گیرد؛
+    speed=1 زمان واقعی، N برابر سریع‌تر، 0 بدون مکث (benchmark)
+    """
+    
+    active = False
+    finished = False
+    speed = 1.0
+    ticks = 0
+    _ticks = None  # generator تیک‌ها
+    _last = None  # (زمان ضبط، زمان واقعی) تیک قبلی برای تنظیم سرعت
+    
+    @staticmethod
+    def files(path):
+        if not os.path.isdir(path):
+            return [path]
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith(('.jsonl.gz', '.jsonl'))]
+    
+    @staticmethod
+    def read(paths):
+        """رکوردها گروه‌بندی‌شده به تیک (generator) - فایل باز یا ناتمام تا آخرین خط کامل خوانده می‌شود"""
+        group = []
+        for path in paths:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                try:
+                    for line in f:
+                        record = json.loads(line)
+                        if group and record['tick'] != group[-1]['tick']:
+                            yield group
+                            group = []
+                        group.append(record)
+                except (EOFError, ValueError):
+                    pass
+        if group:
+            yield group
+    
+    @staticmethod
+    def start(path, speed=1.0):
+        PayloadReplay._ticks = PayloadReplay.read(PayloadReplay.files(path))
+        PayloadReplay.speed = speed
+        PayloadReplay.active = True
+        PayloadReplay.finished = False
+        PayloadReplay.ticks = 0
+        PayloadReplay._last = None
+    
+    @staticmethod
+    def next_tick():
+        """آیتم‌های ادغام‌شده تیک بعدی (مثل fetch_sources)؛ None و finished در پایان ضبط‌ها"""
+        records = next(PayloadReplay._ticks, None)
+        if records is None:
+            PayloadReplay.finished = True
+            return None
+        
+        # زمان مجازی = پایان کندترین دریافت تیک (مثل لحظه شروع پردازش در اجرای زنده)
+        t = max(record['t'] + (record['latency_ms'] or 0) / 1000 for record in records)
+        if PayloadReplay.speed > 0 and PayloadReplay._last:
+            recorded, real = PayloadReplay._last
+            wait = real + (t - recorded) / PayloadReplay.speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        PayloadReplay._last = (t, time.time())
+        Clock.set(t)
+        PayloadReplay.ticks += 1
+        
+        merged = []
+        changed = False
+        for record in records:
+            source = record['source']
+            items = None
+            if record['body'] is not None:
+                items = MarketAPI.SOURCES[source]['parse'](json.loads(record['body']))
+            MarketAPI.last_sources[source] = stamp = {
+                'ok': items is not None,
+                'count': len(items) if items else 0,
+                'fetched_at': datetime.fromtimestamp(record['t']).isoformat(),
+                'latency_ms': record['latency_ms'],
+                'error': record['error'],
+                'mode': 'replay',
+                **MarketAPI._fingerprint(source, record['body']),
+            }
+            changed = changed or stamp['changed']
+            for item in items or []:
+                item['source'] = source
+                merged.append(item)
+        return MarketAPI._unchanged_or(merged, changed) or None
+
+class SymbolChanges:
+    """آخرین قیمت/حجم دیده‌شده هر ردیف price_history برای ماسک تغییرات هر تیک"""
+    
+    prices = np.full(0, np.nan)
+    volumes = np.full(0, np.nan)
+    
+    @staticmethod
+    def update(rows, prices, volumes):
+        """اندیس نمادهایی که قیمت یا حجمشان از آخرین دیده‌شده تغییر کرده (نماد جدید = تغییر)"""
+        if len(SymbolChanges.prices) < price_history.capacity:
+            extra = np.full(price_history.capacity - len(SymbolChanges.prices), np.nan)
+            SymbolChanges.prices = np.concatenate([SymbolChanges.prices, extra])
+            SymbolChanges.volumes = np.concatenate([SymbolChanges.volumes, extra])
+        moved = (SymbolChanges.prices[rows] != prices) | (SymbolChanges.volumes[rows] != volumes)
+        SymbolChanges.prices[rows] = prices
+        SymbolChanges.volumes[rows] = volumes
+        return np.flatnonzero(moved)
+
+class MarketSnapshot:
+    """
+    snapshot یکتاشده بازار در یک تیک (یک بار ساخته می‌شود و همه مراحل تیک از آن استفاده می‌کنند)
+    - items / by_symbol: آیتم‌ها به ترتیب اولین ظهور، برای هر symbol آیتم با بیشترین حجم
+    - price_map: {symbol: price}
+    - symbols, prices, volumes, changes, rows: آرایه‌های هم‌ردیف برای پردازش برداری
+    """
+    
+    def __init__(self, data):
+        by_symbol = {}
+        for item in data:
+            current = by_symbol.get(item['symbol'])
+            if current is None or item.get('volume', 0) > current.get('volume', 0):
+                by_symbol[item['symbol']] = item
+        items = list(by_symbol.values())
+        
+        self.by_symbol = by_symbol
+        self.items = items
+        self.symbols = list(by_symbol)
+        self.price_map = {item['symbol']: item['price'] for item in items}
+        self.prices = np.array([item['price'] for item in items], dtype=np.float64)
+        self.volumes = np.array([item['volume'] for item in items], dtype=np.float64)
+        self.changes = np.array([item.get('change_24h', 0) or 0 for item in items], dtype=np.float64)
+        self.rows = price_history.rows_for(self.symbols)
+        self.indicators = None  # با freeze_indicators در ingest پر می‌شود
+        self.indicators_ready = None
+        self.changed = None  # اندیس نمادهای تغییرکرده (ingest)؛ None = همه
+    
+    @staticmethod
+    def of(market_data):
+        """پذیرش snapshot یا لیست خام آیتم‌ها"""
+        if isinstance(market_data, MarketSnapshot):
+            return market_data
+        return MarketSnapshot(market_data)
+    
+    def freeze_indicators(self):
+        """کپی اندیکاتورهای همین تیک (بلافاصله بعد از price_history.add_many)"""
+        self.indicators = price_history.indicator_columns(self.rows)
+        self.indicators_ready = price_history.counts[self.rows] >= 14
+    
+    def subset(self, index):
+        """snapshot فقط برای اندیس‌های index (مثلاً نمادهای تغییرکرده)"""
+        part = object.__new__(MarketSnapshot)
+        part.items = [self.items[i] for i in index]
+        part.by_symbol = {item['symbol']: item for item in part.items}
+        part.symbols = list(part.by_symbol)
+        part.price_map = {item['symbol']: item['price'] for item in part.items}
+        part.prices = self.prices[index]
+        part.volumes = self.volumes[index]
+        part.changes = self.changes[index]
+        part.rows = self.rows[index]
+        part.indicators, part.indicators_ready = self.indicators_at(index) or (None, None)
+        part.changed = None
+        return part
+    
+    def moved(self):
+        """snapshot نمادهای تغییرکرده در این تیک (مراحلی که فقط روی حرکت قیمت/حجم کار دارند)"""
+        if self.changed is None or len(self.changed) == len(self.items):
+            return self
+        return self.subset(self.changed)
+    
+    def unchanged(self):
+        """همین snapshot برای تیکی که payload آن تغییری نکرده (هیچ نماد تغییرکرده‌ای ندارد)"""
+        copy = object.__new__(MarketSnapshot)
+        copy.__dict__.update(self.__dict__)
+        copy.changed = self.changed[:0] if self.changed is not None else np.empty(0, dtype=np.intp)
+        return copy
+    
+    def indicators_at(self, index):
+        """(columns, ready) ثبت‌شده برای زیرمجموعه index - None اگر snapshot از ingest نیامده"""
+        if self.indicators is None:
+            return None
+        return {key: values[index] for key, values in self.indicators.items()}, self.indicators_ready[index]
+    
+    def moved_count(self):
+        return len(self.items) if self.changed is None else len(self.changed)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __iter__(self):
+        return iter(self.items)
+
+class MarketCache:
+    """
+    آخرین snapshot بازار که background_worker منتشر می‌کند (نسخه‌دار، فقط‌خواندنی برای روت‌ها)
+    بدنه JSON یک بار در هر تیک ساخته می‌شود و داشبوردها هیچ درخواستی به صرافی یا دیتابیس نمی‌زنند
+    """
+    
+    _lock = threading.Lock()
+    version = 0
+    published_at = 0.0
+    data = []
+    sources = {}
+    body = None
+    
+    @staticmethod
+    def publish(data, sources):
+        """انتشار snapshot جدید (فقط از background_worker)"""
+        published_at = time.time()
+        version = MarketCache.version + 1
+        body = json.dumps({
+            'success': True,
+            'data': data,
+            'source': ','.join(sources),
+            'count': len(data),
+            'sources': {s: MarketAPI.last_sources.get(s) for s in sources},  # freshness هر منبع
+            'version': version,
+            'timestamp': datetime.fromtimestamp(published_at).isoformat()  # زمان انتشار snapshot
+        })
+        with MarketCache._lock:
+            MarketCache.data = data
+            MarketCache.sources = sources
+            MarketCache.body = body
+            MarketCache.published_at = published_at
+            MarketCache.version = version
+    
+    @staticmethod
+    def get():
+        """(version, published_at, data, body) به صورت یکجا"""
+        with MarketCache._lock:
+            return MarketCache.version, MarketCache.published_at, MarketCache.data, MarketCache.body
+
+class TickerStream:
+    """
+    حالت stream (CONFIG['ingest_mode'] = 'stream'): اشتراک در تیکر عمومی WebSocket صرافی‌ها روی event loop دریافت
+    دفتر زنده آخرین قیمت/حجم هر (منبع، نماد) در حافظه نگه داشته می‌شود و background_worker به جای sleep ثابت
+    با اولین تغییر بیدار می‌شود (حداقل فاصله تیک‌ها stream_min_interval، بدون تغییر هر update_interval یک تیک)
+    """
+    
+    _cond = threading.Condition()
+    book = {}  # {(source, symbol): آیتم نرمال‌شده (همان شکل parse_*)}
+    changed = set()  # کلیدهای تغییرکرده از آخرین take
+    last_take = 0.0
+    _tasks = {}  # {source: future اتصال روی MarketAPI._loop}
+    stats = {}  # {source: {'messages', 'updates', 'reconnects', 'lag_ms', 'connected_at'}}
+    _warned = False
+    rest_sources = []  # منابع پیکربندی‌شده بدون WebSocket که کنار stream با REST دریافت می‌شوند
+    rest_items = []  # آخرین دریافت REST آن‌ها
+    rest_at = 0.0
+    
+    @staticmethod
+    def parse_bybit(message):
+        # v5 spot: {"topic": "tickers.BTCUSDT", "ts": ..., "data": {...}} با همان فیلدهای REST
+        data = message.get('data')
+        if not data or not str(message.get('topic', '')).startswith('tickers.'):
+            return []
+        return MarketAPI.parse_bybit({'result': {'list': data if isinstance(data, list) else [data]}})
+    
+    @staticmethod
+    def parse_kucoin(message):
+        # /market/snapshot:USDS → {"data": {"data": {"symbol": "BTC-USDT", "lastTradedPrice": ..., ...}}}
+        data = (message.get('data') or {}).get('data')
+        if message.get('type') != 'message' or not data:
+            return []
+        return MarketAPI.parse_kucoin({'data': {'ticker': [{
+            'symbol': data['symbol'],
+            'last': data.get('lastTradedPrice', 0),
+            'changeRate': data.get('changeRate', 0),
+            'high': data.get('high', 0),
+            'low': data.get('low', 0),
+            'volValue': data.get('volValue', 0),
+        }]}})
+    
+    PARSERS = {'bybit': parse_bybit, 'kucoin': parse_kucoin}
+    
+    @staticmethod
+    def apply(source, items):
+        """ادغام آیتم‌ها در دفتر؛ فقط تغییر قیمت یا حجم بیدارباش می‌دهد"""
+        with TickerStream._cond:
+            book = TickerStream.book
+            for item in items:
+                item['source'] = source
+                key = (source, item['symbol'])
+                current = book.get(key)
+                if current is not None and current['price'] == item['price'] and current['volume'] == item['volume']:
+                    continue
+                book[key] = item
+                TickerStream.changed.add(key)
+            if TickerStream.changed:
+                TickerStream._cond.notify_all()
+    
+    @staticmethod
+    def take(timeout):
+        """منتظر اولین تغییر (حداکثر timeout ثانیه) و برگرداندن کل دفتر برای یک تیک"""
+        with TickerStream._cond:
+            if not TickerStream.changed:
+                TickerStream._cond.wait(timeout)
+        # throttle: تیک بلافاصله بعد از تغییر، ولی نه زودتر از stream_min_interval بعد از تیک قبلی
+        wait = TickerStream.last_take + CONFIG['stream_min_interval'] - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        with TickerStream._cond:
+            TickerStream.changed = set()
+            TickerStream.last_take = time.time()
+            return list(TickerStream.book.values())
+    
+    @staticmethod
+    def poll_rest(sources):
+        """
+        منابع بدون WebSocket در حالت stream (مثل coingecko): REST هر update_interval،
+        بین دو دریافت همان آخرین آیتم‌ها کنار دفتر زنده برمی‌گردند
+        """
+        if sources != TickerStream.rest_sources:
+            if sources:
+                print(f"🔁 منابع بدون WebSocket با REST دریافت می‌شوند: {', '.join(sources)}")
+            TickerStream.rest_sources = sources
+            TickerStream.rest_at = 0.0
+        if not sources:
+            return []
+        if time.time() - TickerStream.rest_at >= CONFIG['update_interval']:
+            TickerStream.rest_items = MarketAPI.fetch_sources(sources) or []
+            TickerStream.rest_at = time.time()
+        return TickerStream.rest_items
+    
+    @staticmethod
+    def start(sources):
+        """
+        شروع اتصال منابع دارای WebSocket (یک بار برای هر منبع، با seed از یک دریافت REST)
+        و توقف منابعی که دیگر پیکربندی نشده‌اند؛ خروجی: منابع stream فعال (خالی = حالت poll)
+        """
+        streaming = [source for source in sources if source in TickerStream.PARSERS]
+        if streaming:
+            try:
+                import websockets  # noqa: F401 - وابستگی اختیاری حالت stream
+            except ImportError:
+                if not TickerStream._warned:
+                    print("⚠️ websockets نصب نیست (pip install websockets) - ادامه در حالت poll")
+                    TickerStream._warned = True
+                streaming = []
+        
+        for source in [s for s in TickerStream._tasks if s not in streaming]:
+            TickerStream._tasks.pop(source).cancel()
+            with TickerStream._cond:
+                TickerStream.book = {key: item for key, item in TickerStream.book.items() if key[0] != source}
+            print(f"⏹️ {source} stream stopped")
+        
+        new = [source for source in streaming if source not in TickerStream._tasks]
+        if new:
+            results = MarketAPI._run(MarketAPI._fetch_all(new))
+            PayloadRecorder.commit()
+            for source, items, stamp in results:
+                MarketAPI.last_sources[source] = stamp
+                if items:
+                    TickerStream.apply(source, items)
+                TickerStream.stats[source] = {'messages': 0, 'updates': 0, 'reconnects': 0,
+                                              'lag_ms': None, 'connected_at': None}
+                TickerStream._tasks[source] = asyncio.run_coroutine_threadsafe(
+                    TickerStream._run_source(source, CONFIG.get('stream_symbols') or
+                                             [item['symbol'] for item in items or []]), MarketAPI._loop)
+        return streaming
+    
+    @staticmethod
+    async def _endpoint(source):
+        """(url, فاصله ping ثانیه) - kucoin بدون آدرس دستی توکن عمومی bullet-public می‌گیرد"""
+        url = CONFIG['ws_urls'].get(source)
+        if url:
+            return url, 20
+        response = await MarketAPI._get_client().post("https://api.kucoin.com/api/v1/bullet-public", timeout=5)
+        data = response.json()['data']
+        server = data['instanceServers'][0]
+        return f"{server['endpoint']}?token={data['token']}&connectId={int(time.time() * 1000)}", \
+            server.get('pingInterval', 18000) / 1000
+    
+    @staticmethod
+    async def _subscribe(source, ws, symbols):
+        if source == 'bybit':
+            topics = [f"tickers.{symbol}" for symbol in symbols]
+            for i in range(0, len(topics), 10):  # spot: حداکثر 10 topic در هر درخواست
+                await ws.send(json.dumps({'op': 'subscribe', 'args': topics[i:i + 10]}))
+        else:
+            await ws.send(json.dumps({'id': str(int(time.time() * 1000)), 'type': 'subscribe',
+                                      'topic': '/market/snapshot:USDS', 'response': True}))
+    
+    @staticmethod
+    async def _keepalive(source, ws, interval):
+        # ping سطح برنامه (هر دو صرافی بدون آن اتصال را می‌بندند)
+        while True:
+            await asyncio.sleep(interval)
+            if source == 'bybit':
+                await ws.send(json.dumps({'op': 'ping'}))
+            else:
+                await ws.send(json.dumps({'id': str(int(time.time() * 1000)), 'type': 'ping'}))
+    
+    @staticmethod
+    def _on_frame(source, frame):
+        received = time.time()
+        message = json.loads(frame)
+        items = TickerStream.PARSERS[source](message)
+        stats = TickerStream.stats[source]
+        stats['messages'] += 1
+        if not items:
+            return
+        stats['updates'] += len(items)
+        sent = message.get('ts') or ((message.get('data') or {}).get('data') or {}).get('datetime')
+        if sent:
+            stats['lag_ms'] = round(received * 1000 - sent)
+        TickerStream.apply(source, items)
+        MarketAPI.last_sources[source] = {
+            'ok': True,
+            'count': sum(1 for key in TickerStream.book if key[0] == source),
+            'fetched_at': datetime.fromtimestamp(received).isoformat(),
+            'latency_ms': stats['lag_ms'],
+            'error': None,
+            'mode': 'stream',
+            'messages': stats['messages'],
+        }
+    
+    @staticmethod
+    async def _run_source(source, symbols):
+        """اتصال دائمی یک منبع با اتصال مجدد (backoff نمایی تا 30 ثانیه)"""
+        import websockets
+        delay = 1
+        while True:
+            try:
+                if not symbols and source == 'bybit':
+                    _, items, _ = await MarketAPI._fetch_source(source)
+                    symbols = [item['symbol'] for item in items or []]
+                url, ping_interval = await TickerStream._endpoint(source)
+                async with websockets.connect(url, ping_interval=None, max_size=2 ** 22) as ws:
+                    await TickerStream._subscribe(source, ws, symbols)
+                    TickerStream.stats[source]['connected_at'] = datetime.now().isoformat()
+                    print(f"🔌 {source} stream connected ({url.split('?')[0]})")
+                    delay = 1
+                    keepalive = asyncio.ensure_future(TickerStream._keepalive(source, ws, ping_interval))
+                    try:
+                        async for frame in ws:
+                            TickerStream._on_frame(source, frame)
+                    finally:
+                        keepalive.cancel()
+                error = 'connection closed'
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            print(f"❌ {source} stream: {error} - اتصال مجدد بعد از {delay}s")
+            TickerStream.stats[source]['reconnects'] += 1
+            MarketAPI.last_sources[source] = dict(MarketAPI.last_sources.get(source) or {}, ok=False, error=error)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+EVENT_BACKLOG = 2000  # رویدادهای نگه‌داشته برای کلاینت‌هایی که دوباره وصل می‌شوند
+STREAM_KEEPALIVE = 15  # ثانیه - فاصله keepalive در استریم بدون رویداد
+
+class EventBus:
+    """
+    کانال push داشبوردها (SSE): هر تیک بعد از commit رویدادهای diff خود را منتشر می‌کند
+    شناسه رویداد = "run:n" تا کلاینت بعد از قطع اتصال با Last-Event-ID از همان‌جا ادامه دهد
+    """
+    
+    _cond = threading.Condition()
+    run_id = format(int(time.time()), 'x')  # شناسه این اجرای سرور
+    events = deque(maxlen=EVENT_BACKLOG)  # (n, event_type, data_json)
+    last_id = 0
+    _last_market = {}  # {symbol: (price, volume)} آخرین مقادیر منتشرشده
+    _last_stats = None
+    
+    @staticmethod
+    def publish_many(events):
+        """انتشار [(event_type, data), ...] و بیدار کردن استریم‌ها"""
+        with EventBus._cond:
+            for event_type, data in events:
+                EventBus.last_id += 1
+                EventBus.events.append((EventBus.last_id, event_type, json.dumps(data, default=str)))
+            EventBus._cond.notify_all()
+    
+    @staticmethod
+    def parse_id(event_id):
+        """Last-Event-ID → شماره رویداد در همین اجرا (None اگر از اجرای دیگری است)"""
+        run, _, n = (event_id or '').partition(':')
+        if run != EventBus.run_id or not n.isdigit():
+            return None
+        return int(n)
+    
+    @staticmethod
+    def since(position, timeout):
+        """
+        رویدادهای بعد از position (حداکثر timeout ثانیه منتظر می‌ماند)
+        None یعنی position از backlog خارج شده و کلاینت snapshot جدید لازم دارد
+        """
+        with EventBus._cond:
+            if EventBus.last_id <= position:
+                EventBus._cond.wait(timeout)
+            if position > EventBus.last_id:
+                return None
+            if position == EventBus.last_id:
+                return []
+            first = EventBus.events[0][0]
+            if position < first - 1:
+                return None
+            return list(itertools.islice(EventBus.events, position - first + 1, None))
+    
+    @staticmethod
+    def market_delta(items):
+        """فقط نمادهایی که قیمت یا حجمشان از آخرین انتشار تغییر کرده"""
+        last = EventBus._last_market
+        changed = []
+        for item in items:
+            key = (item['price'], item['volume'])
+            if last.get(item['symbol']) != key:
+                last[item['symbol']] = key
+                changed.append(item)
+        return changed
+
+GRID_LIMIT = 100  # تعداد ردیف نگه‌داشته از هر نوع در دیتاگرید اعتبارسنجی
+
+class ValidationGrid:
+    """
+    مدل سمت سرور دیتاگرید اعتبارسنجی (سیگنال، نهنگ، پامپ/دامپ)
+    از رویدادهای همان تیک بروز می‌شود (بدون کوئری در هر درخواست) و هر تغییر یک version جدید می‌سازد
+    تا کلاینت با since فقط ردیف‌های اضافه/تغییرکرده را بگیرد
+    """
+    
+    _lock = threading.Lock()
+    loaded = False
+    version = 0
+    records = {}  # {(type, id): ردیف خام جدول}
+    rows = {}  # {(type, id): ردیف دیتاگرید}
+    changed = {}  # {(type, id): version آخرین تغییر}
+    order = {'signal': deque(), 'whale': deque(), 'pump_dump': deque()}  # id ها به ترتیب ورود
+    _merged = (None, [])  # (version, ردیف‌های مرتب‌شده بر اساس زمان)
+    
+    TABLES = {'signals': 'signal', 'whales': 'whale', 'pump_dumps': 'pump_dump'}
+    UPDATES = {'signal_update': 'signal', 'pump_update': 'pump_dump'}
+    
+    @staticmethod
+    def format_row(kind, r):
+        """ردیف جدول → ردیف دیتاگرید"""
+        if kind == 'signal':
+            return {
+                'type': 'signal',
+                'symbol': r['symbol'],
+                'action': r['signal_type'],  # LONG/SHORT
+                'price': r['entry_price'],
+                'score': r.get('score'),
+                'status': r.get('final_status'),
+                'source': r.get('source'),
+                'time': r['timestamp'],
+                'details': f"مرحله: {r.get('valid_4min') or r.get('valid_2min') or r.get('valid_1min') or 0}/3"
+            }
+        if kind == 'whale':
+            return {
+                'type': 'whale',
+                'symbol': r['symbol'],
+                'action': 'BUY' if r['whale_type'] == 'buy' else 'SELL',
+                'price': r['price'],
+                'score': r['confidence_score'],
+                'status': 'detected',
+                'source': 'Whale Monitor',
+                'time': r['timestamp'],
+                'details': f"حجم: {r['volume']:,.0f}$"
+            }
+        return {
+            'type': 'pump_dump',
+            'symbol': r['symbol'],
+            'action': r['event_type'].upper(),
+            'price': r['price_after'],
+            'score': r.get('score'),
+            'status': 'valid' if r.get('is_valid') else 'invalid',
+            'source': 'Pump Detector',
+            'time': r['timestamp'],
+            'details': f"تغییر: {r['change_percent']:.2f}%"
+        }
+    
+    @staticmethod
+    def _put(kind, record, patch=False):
+        """درج/بروزرسانی یک ردیف (باید داخل _lock صدا زده شود)"""
+        key = (kind, record['id'])
+        if patch:
+            if key not in ValidationGrid.records:
+                return  # قدیمی‌تر از پنجره دیتاگرید
+            record = {**ValidationGrid.records[key], **record}
+        elif key not in ValidationGrid.records:
+            order = ValidationGrid.order[kind]
+            order.append(record['id'])
+            if len(order) > GRID_LIMIT:
+                old = (kind, order.popleft())
+                for table in (ValidationGrid.records, ValidationGrid.rows, ValidationGrid.changed):
+                    table.pop(old, None)
+        ValidationGrid.records[key] = record
+        ValidationGrid.rows[key] = dict(ValidationGrid.format_row(kind, record), id=record['id'])
+        ValidationGrid.changed[key] = ValidationGrid.version
+    
+    @staticmethod
+    def load():
+        """بار اول از دیتابیس (تنبل - در اولین درخواست)"""
+        with ValidationGrid._lock:
+            if ValidationGrid.loaded:
+                return
+            with Database.connection() as conn:
+                c = conn.cursor()
+                ValidationGrid.version += 1
+                for table, kind in ValidationGrid.TABLES.items():
+                    c.execute(f'SELECT * FROM {table} ORDER BY id DESC LIMIT ?', (GRID_LIMIT,))
+                    columns = [desc[0] for desc in c.description]
+                    for row in reversed(c.fetchall()):
+                        ValidationGrid._put(kind, dict(zip(columns, row)))
+            ValidationGrid.loaded = True
+    
+    @staticmethod
+    def apply(events):
+        """اعمال رویدادهای یک تیک (بعد از commit)"""
+        with ValidationGrid._lock:
+            if not ValidationGrid.loaded:
+                return  # load بعداً همین ردیف‌ها را از دیتابیس می‌خواند
+            touched = False
+            for event_type, rows in events.items():
+                if event_type in ValidationGrid.TABLES:
+                    kind, patch = ValidationGrid.TABLES[event_type], False
+                elif event_type in ValidationGrid.UPDATES:
+                    kind, patch = ValidationGrid.UPDATES[event_type], True
+                else:
+                    continue
+                if not touched:
+                    ValidationGrid.version += 1
+                    touched = True
+                for row in rows:
+                    ValidationGrid._put(kind, row, patch)
+    
+    @staticmethod
+    def snapshot(since=None):
+        """(version, ردیف‌ها): همه ردیف‌ها مرتب بر اساس زمان، یا فقط تغییرات بعد از since"""
+        ValidationGrid.load()
+        with ValidationGrid._lock:
+            version = ValidationGrid.version
+            if since is not None:
+                return version, [ValidationGrid.rows[key] for key, v in ValidationGrid.changed.items() if v > since]
+            if ValidationGrid._merged[0] != version:
+                merged = sorted(ValidationGrid.rows.values(), key=lambda r: (str(r['time']), r['id']), reverse=True)
+                ValidationGrid._merged = (version, merged)
+            return version, ValidationGrid._merged[1]
+
 class SignalValidator:
-    """اعتبارسنجی سیگنال‌ها"""
+    """
+    اعتبارسنجی سیگنال‌ها
+    هر checkpoint (مراحل validation_times و pump_dump_time) با زمان سررسیدش در یک min-heap ثبت می‌شود
+    و هر تیک فقط موارد سررسیده را از heap برمی‌دارد
+    """
     
     pending_signals = {}  # {signal_id: signal_data}
     pending_pumps = {}  # {pump_id: pump_data}
+    signal_schedule = []  # heap: (due_ts, seq, signal_id, stage_index, minutes)
+    pump_schedule = []  # heap: (due_ts, seq, pump_id)
+    _seq = itertools.count()
+    _lock = threading.Lock()  # heap ها: detector و validator خط لوله در دو thread
+    
+    @staticmethod
+    def _pop_due(schedule, now):
+        """برداشتن همه ورودی‌های سررسیده به ترتیب زمان"""
+        due = []
+        with SignalValidator._lock:
+            while schedule and schedule[0][0] <= now:
+                due.append(heapq.heappop(schedule))
+        return due
+    
+    @staticmethod
+    def _push(schedule, entries):
+        with SignalValidator._lock:
+            for entry in entries:
+                heapq.heappush(schedule, entry)
     
     @staticmethod
     def validate_signal(signal_id, signal_type, entry_price, current_price, stage):
@@ -550,76 +2142,86 @@ class SignalValidator:
         return min(score, 100)  # حداکثر 100
     
     @staticmethod
-    def add_pending_signal(signal_id, symbol, signal_type, entry_price):
-        """افزودن سیگنال به لیست انتظار"""
+    def add_pending_signal(signal_id, symbol, signal_type, entry_price, created=None, validations=None):
+        """افزودن سیگنال به لیست انتظار (created/validations برای بازیابی بعد از ریستارت)"""
+        created = created or Clock.time()
+        validations = validations or [None, None, None]
         SignalValidator.pending_signals[signal_id] = {
             'symbol': symbol,
             'signal_type': signal_type,
             'entry_price': entry_price,
-            'created_at': datetime.now(),
-            'validations': [None, None, None]
+            'created_at': datetime.fromtimestamp(created),
+            'validations': validations
         }
+        
+        # زمان‌بندی مراحل (با tolerance 0.1 دقیقه = 6 ثانیه تا اعتبارسنجی به موقع انجام شود)
+        time_tolerance = 0.1
+        SignalValidator._push(SignalValidator.signal_schedule, [
+            (created + (minutes - time_tolerance) * 60, next(SignalValidator._seq), signal_id, i, minutes)
+            for i, minutes in enumerate(CONFIG['validation_times']) if validations[i] is None
+        ])
     
     @staticmethod
-    def check_pending_signals(market_data):
+    def check_pending_signals(market_data, unit=None):
         """بررسی سیگنال‌های در انتظار"""
-        price_map = {item['symbol']: item['price'] for item in market_data}
-        validation_times = CONFIG['validation_times']
+        price_map = MarketSnapshot.of(market_data).price_map
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
         
-        for signal_id, signal in list(SignalValidator.pending_signals.items()):
+        # فقط مراحلی که زمانشان رسیده (اگر قیمت نماد در این تیک نیامده، برای تیک بعد برمی‌گردند)
+        deferred = []
+        for entry in SignalValidator._pop_due(SignalValidator.signal_schedule, Clock.time()):
+            _, _, signal_id, i, minutes = entry
+            signal = SignalValidator.pending_signals.get(signal_id)
+            if signal is None or signal['validations'][i] is not None:
+                continue
             symbol = signal['symbol']
             if symbol not in price_map:
+                deferred.append(entry)
                 continue
             
             current_price = price_map[symbol]
-            elapsed = (datetime.now() - signal['created_at']).total_seconds() / 60
+            result = SignalValidator.validate_signal(
+                signal_id,
+                signal['signal_type'],
+                signal['entry_price'],
+                current_price,
+                i + 1
+            )
+            signal['validations'][i] = result
             
-            # بررسی هر مرحله اعتبارسنجی (با timing دقیق و به موقع)
-            for i, minutes in enumerate(validation_times):
-                # بررسی دقیق: اگر زمان رسیده (با tolerance 0.1 دقیقه) و هنوز اعتبارسنجی نشده
-                # این باعث می‌شود اعتبارسنجی به موقع انجام شود
-                time_tolerance = 0.1  # 6 ثانیه tolerance
-                if elapsed >= (minutes - time_tolerance) and signal['validations'][i] is None:
-                    result = SignalValidator.validate_signal(
-                        signal_id,
-                        signal['signal_type'],
-                        signal['entry_price'],
-                        current_price,
-                        i + 1
-                    )
-                    signal['validations'][i] = result
-                    
-                    # بروزرسانی دیتابیس با نام فیلدهای صحیح
-                    # استفاده از نام‌های ثابت: price_1min, price_2min, price_4min
-                    if minutes == 1:
-                        field = "price_1min"
-                        change_field = "change_1min"
-                        valid_field = "valid_1min"
-                    elif minutes == 2:
-                        field = "price_2min"
-                        change_field = "change_2min"
-                        valid_field = "valid_2min"
-                    elif minutes == 4:
-                        field = "price_4min"
-                        change_field = "change_4min"
-                        valid_field = "valid_4min"
-                    else:
-                        # برای زمان‌های دیگر از نام پویا استفاده کن
-                        field = f"price_{minutes}min"
-                        change_field = f"change_{minutes}min"
-                        valid_field = f"valid_{minutes}min"
-                    
-                    c.execute(f'''UPDATE signals SET 
-                                  {field} = ?, {change_field} = ?, {valid_field} = ?
-                                  WHERE id = ?''',
-                              (current_price, result['change'], 
-                               1 if result['is_valid'] else 0, signal_id))
-                    
-                    print(f"⏱️ اعتبارسنجی مرحله {i+1} ({minutes} دقیقه): {signal['symbol']} - {'✅ معتبر' if result['is_valid'] else '❌ نامعتبر'} (تغییر: {result['change']:.2f}%)")
+            # بروزرسانی دیتابیس با نام فیلدهای صحیح
+            # استفاده از نام‌های ثابت: price_1min, price_2min, price_4min
+            if minutes == 1:
+                field = "price_1min"
+                change_field = "change_1min"
+                valid_field = "valid_1min"
+            elif minutes == 2:
+                field = "price_2min"
+                change_field = "change_2min"
+                valid_field = "valid_2min"
+            elif minutes == 4:
+                field = "price_4min"
+                change_field = "change_4min"
+                valid_field = "valid_4min"
+            else:
+                # برای زمان‌های دیگر از نام پویا استفاده کن
+                field = f"price_{minutes}min"
+                change_field = f"change_{minutes}min"
+                valid_field = f"valid_{minutes}min"
+            
+            unit.add(f'''UPDATE signals SET 
+                         {field} = ?, {change_field} = ?, {valid_field} = ?, updated_at = ?
+                         WHERE id = ?''',
+                     (current_price, result['change'], 
+                      1 if result['is_valid'] else 0, Clock.now(), signal_id))
+            unit.emit('signal_update', {'id': signal_id, field: current_price, change_field: result['change'],
+                                        valid_field: 1 if result['is_valid'] else 0, 'updated_at': Clock.now()})
             
+            print(f"⏱️ اعتبارسنجی مرحله {i+1} ({minutes} دقیقه): {signal['symbol']} - {'✅ معتبر' if result['is_valid'] else '❌ نامعتبر'} (تغییر: {result['change']:.2f}%)")
+    
             # کنترل نهایی: اگر همه مراحل تکمیل شد
             if all(v is not None for v in signal['validations']):
                 # محاسبه امتیاز با وزن‌های دقیق
@@ -630,10 +2232,15 @@ class SignalValidator:
                 final_status = 'valid' if valid_count >= 2 else 'invalid'
                 
                 # بروزرسانی دیتابیس
-                c.execute('''UPDATE signals SET 
-                             final_status = ?, score = ?, validated_at = ?
-                             WHERE id = ?''',
-                          (final_status, score, datetime.now(), signal_id))
+                now = Clock.now()
+                unit.add('''UPDATE signals SET 
+                            final_status = ?, score = ?, validated_at = ?, updated_at = ?
+                            WHERE id = ?''',
+                         (final_status, score, now, now, signal_id))
+                Summaries.signal_status(unit, 'pending', -1)
+                Summaries.signal_status(unit, final_status)
+                unit.emit('signal_update', {'id': signal_id, 'final_status': final_status, 'score': score,
+                                            'validated_at': now, 'updated_at': now})
                 
                 # لاگ کنترل نهایی
                 print(f"🎯 کنترل نهایی اعتبارسنجی: {signal['symbol']} {signal['signal_type']}")
@@ -650,163 +2257,241 @@ class SignalValidator:
                 
                 del SignalValidator.pending_signals[signal_id]
         
-        conn.commit()
-        conn.close()
+        SignalValidator._push(SignalValidator.signal_schedule, deferred)
+        
+        if own_unit:
+            unit.flush()
     
     @staticmethod
-    def add_pending_pump(pump_id, symbol, event_type, price):
+    def add_pending_pump(pump_id, symbol, event_type, price, created=None):
         """افزودن پامپ/دامپ به لیست انتظار"""
+        created = created or Clock.time()
         SignalValidator.pending_pumps[pump_id] = {
             'symbol': symbol,
             'event_type': event_type,
             'entry_price': price,
-            'created_at': datetime.now()
+            'created_at': datetime.fromtimestamp(created)
         }
+        due = created + CONFIG['pump_dump_time'] * 60
+        SignalValidator._push(SignalValidator.pump_schedule, [(due, next(SignalValidator._seq), pump_id)])
     
     @staticmethod
-    def check_pending_pumps(market_data):
+    def check_pending_pumps(market_data, unit=None):
         """بررسی پامپ/دامپ‌های در انتظار (1 دقیقه)"""
-        price_map = {item['symbol']: item['price'] for item in market_data}
-        pump_time = CONFIG['pump_dump_time']
+        price_map = MarketSnapshot.of(market_data).price_map
         pump_weight = CONFIG['pump_dump_weight']
         min_change = CONFIG['min_price_change']
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
         
-        for pump_id, pump in list(SignalValidator.pending_pumps.items()):
+        deferred = []
+        for entry in SignalValidator._pop_due(SignalValidator.pump_schedule, Clock.time()):
+            pump_id = entry[2]
+            pump = SignalValidator.pending_pumps.get(pump_id)
+            if pump is None:
+                continue
             symbol = pump['symbol']
             if symbol not in price_map:
+                deferred.append(entry)
                 continue
             
             current_price = price_map[symbol]
-            elapsed = (datetime.now() - pump['created_at']).total_seconds() / 60
+            change = ((current_price - pump['entry_price']) / pump['entry_price']) * 100
             
-            if elapsed >= pump_time:
-                change = ((current_price - pump['entry_price']) / pump['entry_price']) * 100
-                
-                # پامپ معتبر = قیمت بالا رفت
-                # دامپ معتبر = قیمت پایین آمد
-                if pump['event_type'] == 'pump':
-                    is_valid = change >= min_change
-                else:
-                    is_valid = change <= -min_change
-                
-                score = pump_weight if is_valid else 0
-                
-                c.execute('''UPDATE pump_dumps SET 
-                             is_valid = ?, validation_price = ?, score = ?, validated_at = ?
-                             WHERE id = ?''',
-                          (1 if is_valid else 0, current_price, score, datetime.now(), pump_id))
-                
-                # اگر معتبر بود، سیگنال ایجاد کن
-                if is_valid and score >= CONFIG['min_score_for_trade']:
-                    signal_type = 'LONG' if pump['event_type'] == 'pump' else 'SHORT'
-                    c.execute('''INSERT INTO signals 
-                                 (symbol, signal_type, entry_price, final_status, score, source, validated_at)
-                                 VALUES (?, ?, ?, 'valid', ?, 'pump_dump', ?)''',
-                              (symbol, signal_type, current_price, score, datetime.now()))
-                    print(f"✅ پامپ/دامپ معتبر: {symbol} {signal_type} (امتیاز: {score}) - به صف اتوترید اضافه شد")
-                
-                del SignalValidator.pending_pumps[pump_id]
+            # پامپ معتبر = قیمت بالا رفت
+            # دامپ معتبر = قیمت پایین آمد
+            if pump['event_type'] == 'pump':
+                is_valid = change >= min_change
+            else:
+                is_valid = change <= -min_change
+            
+            score = pump_weight if is_valid else 0
+            
+            unit.add('''UPDATE pump_dumps SET 
+                        is_valid = ?, validation_price = ?, score = ?, validated_at = ?
+                        WHERE id = ?''',
+                     (1 if is_valid else 0, current_price, score, Clock.now(), pump_id))
+            unit.emit('pump_update', {'id': pump_id, 'is_valid': 1 if is_valid else 0, 'validation_price': current_price,
+                                      'score': score, 'validated_at': Clock.now()})
+            
+            # اگر معتبر بود، سیگنال ایجاد کن
+            if is_valid and score >= CONFIG['min_score_for_trade']:
+                signal_type = 'LONG' if pump['event_type'] == 'pump' else 'SHORT'
+                signal_id = TickUnit.allocate_id('signals')
+                now = Clock.now()
+                stamp = Clock.stamp()
+                unit.add('''INSERT INTO signals 
+                            (id, symbol, signal_type, entry_price, final_status, score, source, validated_at, timestamp)
+                            VALUES (?, ?, ?, ?, 'valid', ?, 'pump_dump', ?, ?)''',
+                         (signal_id, symbol, signal_type, current_price, score, now, stamp))
+                Summaries.signal_status(unit, 'valid')
+                unit.emit('signals', {'id': signal_id, 'symbol': symbol, 'signal_type': signal_type,
+                                      'entry_price': current_price, 'final_status': 'valid', 'score': score,
+                                      'source': 'pump_dump', 'validated_at': now, 'timestamp': stamp})
+                print(f"✅ پامپ/دامپ معتبر: {symbol} {signal_type} (امتیاز: {score}) - به صف اتوترید اضافه شد")
+            
+            del SignalValidator.pending_pumps[pump_id]
         
-        conn.commit()
-        conn.close()
+        SignalValidator._push(SignalValidator.pump_schedule, deferred)
+        
+        if own_unit:
+            unit.flush()
 
 class WhaleDetector:
-    """تشخیص نهنگ و پامپ/دامپ"""
+    """تشخیص نهنگ و پامپ/دامپ (برداری روی کل بازار)"""
     
-    previous_prices = {}
+    previous_prices = np.full(0, np.nan)  # قیمت تیک قبلی، به ترتیب ردیف‌های price_history
+    
+    # ترتیب ستون‌های batch های INSERT (برای ساخت رویدادهای داشبورد)
+    WHALE_FIELDS = ('id', 'symbol', 'price', 'volume', 'change_percent', 'whale_type', 'confidence_score', 'pattern',
+                    'timestamp')
+    SIGNAL_FIELDS = ('id', 'symbol', 'signal_type', 'entry_price', 'rsi', 'macd', 'macd_signal', 'macd_histogram', 'volume',
+                     'timestamp')
+    PUMP_FIELDS = ('id', 'symbol', 'event_type', 'price_before', 'price_after', 'change_percent', 'volume', 'timestamp')
+    
+    @staticmethod
+    def _previous(rows):
+        prev = WhaleDetector.previous_prices
+        if len(prev) < price_history.capacity:
+            extra = np.full(price_history.capacity - len(prev), np.nan)
+            WhaleDetector.previous_prices = prev = np.concatenate([prev, extra])
+        return prev[rows]
     
     @staticmethod
-    def detect(market_data):
+    def detect(market_data, unit=None):
         whales = []
         pump_dumps = []
+        if not market_data:
+            return whales, pump_dumps
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
         
-        for item in market_data:
-            symbol = item['symbol']
-            price = item['price']
-            volume = item['volume']
-            change = item.get('change_24h', 0)
+        # آرایه‌های snapshot بازار (یک بار در MarketAPI.fetch ساخته شده‌اند) - فقط نمادهایی که حرکت کرده‌اند
+        snapshot = MarketSnapshot.of(market_data).moved()
+        if not len(snapshot):
+            return whales, pump_dumps
+        symbols = snapshot.symbols
+        prices = snapshot.prices
+        volumes = snapshot.volumes
+        changes = snapshot.changes
+        rows = snapshot.rows
+        prev = WhaleDetector._previous(rows)
+        
+        # محاسبه همه ماسک‌ها در یک گذر
+        threshold = CONFIG['whale_threshold']
+        has_prev = ~np.isnan(prev) & (prev != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            quick_change = np.where(has_prev, (prices - prev) / prev * 100, 0.0)
+        whale_mask = volumes >= threshold  # تشخیص نهنگ (حجم بالای $500K)
+        bait_mask = has_prev & (np.abs(quick_change) > 5)  # نوک‌زدن به طعمه
+        confidence = np.minimum(100, volumes / threshold * 50 + np.abs(changes) * 5)  # امتیاز اعتبار نهنگ
+        pump_mask = has_prev & (np.abs(quick_change) >= CONFIG['pump_dump_threshold'])
+        
+        WhaleDetector.previous_prices[rows] = prices
+        
+        price_list = prices.tolist()
+        volume_list = volumes.tolist()
+        change_list = changes.tolist()
+        quick_list = quick_change.tolist()
+        
+        # نهنگ‌ها و سیگنال‌های آنها (ثبت دسته‌ای)
+        hits = np.flatnonzero(whale_mask)
+        if len(hits):
+            whale_ids = TickUnit.allocate_ids('whales', len(hits))
+            signal_ids = TickUnit.allocate_ids('signals', len(hits))
+            hit_symbols = [symbols[i] for i in hits]
+            indicators = Indicators.calculate_many(hit_symbols, rows[hits], unit, snapshot.indicators_at(hits))
+            ind_rows = np.column_stack([indicators['rsi'], indicators['macd'],
+                                        indicators['macd_signal'], indicators['macd_histogram']]).tolist()
+            confidence_list = confidence[hits].tolist()
+            bait_list = bait_mask[hits].tolist()
             
-            # تشخیص نهنگ (حجم بالای $500K)
-            if volume >= CONFIG['whale_threshold']:
+            stamp = Clock.stamp()
+            whale_batch = []
+            signal_batch = []
+            for k, i in enumerate(hits.tolist()):
+                symbol = symbols[i]
+                price = price_list[i]
+                volume = volume_list[i]
+                change = change_list[i]
                 whale_type = 'buy' if change > 0 else 'sell'
+                signal_type = 'LONG' if whale_type == 'buy' else 'SHORT'
+                pattern = 'bait_pecking' if bait_list[k] else None
                 
-                # تشخیص الگو (نوک‌زدن به طعمه)
-                pattern = None
-                if symbol in WhaleDetector.previous_prices:
-                    prev = WhaleDetector.previous_prices[symbol]
-                    quick_change = ((price - prev) / prev) * 100
-                    if abs(quick_change) > 5:
-                        pattern = 'bait_pecking'  # نوک‌زدن به طعمه
-                
-                # امتیاز اعتبار نهنگ
-                confidence = min(100, (volume / CONFIG['whale_threshold']) * 50 + abs(change) * 5)
-                
-                c.execute('''INSERT INTO whales 
-                             (symbol, price, volume, change_percent, whale_type, confidence_score, pattern)
-                             VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                          (symbol, price, volume, change, whale_type, confidence, pattern))
-                
-                whale_id = c.lastrowid
+                whale_batch.append((whale_ids[k], symbol, price, volume, change, whale_type,
+                                    confidence_list[k], pattern, stamp))
                 whales.append({
-                    'id': whale_id,
+                    'id': whale_ids[k],
                     'symbol': symbol,
                     'price': price,
                     'volume': volume,
                     'change': change,
                     'type': whale_type,
-                    'confidence': confidence,
+                    'confidence': confidence_list[k],
                     'pattern': pattern
                 })
                 
                 # ایجاد سیگنال از نهنگ
-                signal_type = 'LONG' if whale_type == 'buy' else 'SHORT'
-                indicators = Indicators.calculate_all(symbol)
-                
-                c.execute('''INSERT INTO signals 
-                             (symbol, signal_type, entry_price, source, rsi, macd, macd_signal, macd_histogram, volume)
-                             VALUES (?, ?, ?, 'whale', ?, ?, ?, ?, ?)''',
-                          (symbol, signal_type, price, 
-                           indicators.get('rsi'), indicators.get('macd'),
-                           indicators.get('macd_signal'), indicators.get('macd_histogram'),
-                           volume))
-                
-                signal_id = c.lastrowid
-                SignalValidator.add_pending_signal(signal_id, symbol, signal_type, price)
+                signal_batch.append((signal_ids[k], symbol, signal_type, price,
+                                     *map(nan_to_none, ind_rows[k]), volume, stamp))
+                SignalValidator.add_pending_signal(signal_ids[k], symbol, signal_type, price)
             
-            # تشخیص پامپ/دامپ
-            if symbol in WhaleDetector.previous_prices:
-                prev_price = WhaleDetector.previous_prices[symbol]
-                quick_change = ((price - prev_price) / prev_price) * 100
+            unit.add_many('''INSERT INTO whales 
+                             (id, symbol, price, volume, change_percent, whale_type, confidence_score, pattern, timestamp)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', whale_batch)
+            unit.add_many('''INSERT INTO signals 
+                             (id, symbol, signal_type, entry_price, source, rsi, macd, macd_signal, macd_histogram, volume,
+                              timestamp)
+                             VALUES (?, ?, ?, ?, 'whale', ?, ?, ?, ?, ?, ?)''', signal_batch)
+            
+            # رویدادهای داشبورد (هم‌شکل ردیف‌های دیتابیس)
+            unit.emit_many('whales', [dict(zip(WhaleDetector.WHALE_FIELDS, row), is_real=1)
+                                      for row in whale_batch])
+            unit.emit_many('signals', [dict(zip(WhaleDetector.SIGNAL_FIELDS, row), source='whale',
+                                            final_status='pending', score=0)
+                                       for row in signal_batch])
+            
+            # جداول خلاصه
+            hit_volumes = volumes[hits]
+            buys = changes[hits] > 0
+            Summaries.signal_status(unit, 'pending', len(hits))
+            Summaries.whale_flow(unit, float(hit_volumes[buys].sum()), float(hit_volumes[~buys].sum()))
+        
+        # پامپ/دامپ‌ها
+        hits = np.flatnonzero(pump_mask)
+        if len(hits):
+            pump_ids = TickUnit.allocate_ids('pump_dumps', len(hits))
+            prev_list = prev[hits].tolist()
+            stamp = Clock.stamp()
+            pump_batch = []
+            for k, i in enumerate(hits.tolist()):
+                symbol = symbols[i]
+                price = price_list[i]
+                quick = quick_list[i]
+                event_type = 'pump' if quick > 0 else 'dump'
                 
-                if abs(quick_change) >= CONFIG['pump_dump_threshold']:
-                    event_type = 'pump' if quick_change > 0 else 'dump'
-                    
-                    c.execute('''INSERT INTO pump_dumps 
-                                 (symbol, event_type, price_before, price_after, change_percent, volume)
-                                 VALUES (?, ?, ?, ?, ?, ?)''',
-                              (symbol, event_type, prev_price, price, quick_change, volume))
-                    
-                    pump_id = c.lastrowid
-                    pump_dumps.append({
-                        'id': pump_id,
-                        'symbol': symbol,
-                        'type': event_type,
-                        'change': quick_change,
-                        'price': price
-                    })
-                    
-                    SignalValidator.add_pending_pump(pump_id, symbol, event_type, price)
+                pump_batch.append((pump_ids[k], symbol, event_type, prev_list[k], price, quick, volume_list[i], stamp))
+                pump_dumps.append({
+                    'id': pump_ids[k],
+                    'symbol': symbol,
+                    'type': event_type,
+                    'change': quick,
+                    'price': price
+                })
+                SignalValidator.add_pending_pump(pump_ids[k], symbol, event_type, price)
             
-            WhaleDetector.previous_prices[symbol] = price
+            unit.add_many('''INSERT INTO pump_dumps 
+                             (id, symbol, event_type, price_before, price_after, change_percent, volume, timestamp)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', pump_batch)
+            unit.emit_many('pump_dumps', [dict(zip(WhaleDetector.PUMP_FIELDS, row), is_valid=0, score=0)
+                                          for row in pump_batch])
         
-        conn.commit()
-        conn.close()
+        if own_unit:
+            unit.flush()
         
         return whales, pump_dumps
 
@@ -958,7 +2643,7 @@ class AutoTrader:
     @staticmethod
     def can_trade():
         """بررسی امکان معامله"""
-        today = datetime.now().date()
+        today = Clock.now().date()
         
         if AutoTrader.last_trade_date != today:
             AutoTrader.daily_trades = 0
@@ -976,22 +2661,21 @@ class AutoTrader:
     @staticmethod
     def get_trade_queue():
         """دریافت صف اتوترید (مرتب بر امتیاز)"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        with Database.connection() as conn:
+            c = conn.cursor()
         
-        c.execute('''SELECT * FROM signals 
-                     WHERE final_status = 'valid' AND score >= ?
-                     ORDER BY score DESC
-                     LIMIT 20''', (CONFIG['min_score_for_trade'],))
+            c.execute('''SELECT * FROM signals 
+                         WHERE final_status = 'valid' AND score >= ?
+                         ORDER BY score DESC
+                         LIMIT 20''', (CONFIG['min_score_for_trade'],))
         
-        columns = [desc[0] for desc in c.description]
-        signals = [dict(zip(columns, row)) for row in c.fetchall()]
+            columns = [desc[0] for desc in c.description]
+            signals = [dict(zip(columns, row)) for row in c.fetchall()]
         
-        conn.close()
         return signals
     
     @staticmethod
-    def execute_trade(signal):
+    def execute_trade(signal, unit=None):
         """اجرای معامله"""
         can, reason = AutoTrader.can_trade()
         if not can:
@@ -1036,19 +2720,28 @@ class AutoTrader:
         # محاسبه کمیسیون
         commission = amount * CONFIG['commission'] / 100
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
         
-        c.execute('''INSERT INTO trades 
-                     (signal_id, symbol, side, entry_price, amount, leverage, 
-                      stop_loss, take_profit, commission, exchange)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (signal['id'], symbol, side, entry_price, amount, leverage,
-                   stop_loss, take_profit, commission, CONFIG['exchange']))
+        trade_id = TickUnit.allocate_id('trades')
+        opened_at = Clock.stamp()
+        unit.add('''INSERT INTO trades 
+                    (id, signal_id, symbol, side, entry_price, amount, leverage, 
+                     stop_loss, take_profit, commission, exchange, opened_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                 (trade_id, signal['id'], symbol, side, entry_price, amount, leverage,
+                  stop_loss, take_profit, commission, CONFIG['exchange'], opened_at))
+        opened_day = time.strftime('%Y-%m-%d', time.gmtime(Clock.time()))  # مثل DATE(opened_at)
+        Summaries.trade(unit, opened_day, total=1, commission=commission)
+        unit.emit('trades', {'id': trade_id, 'signal_id': signal['id'], 'symbol': symbol, 'side': side,
+                             'entry_price': entry_price, 'amount': amount, 'leverage': leverage,
+                             'stop_loss': stop_loss, 'take_profit': take_profit, 'commission': commission,
+                             'exchange': CONFIG['exchange'], 'status': 'open',
+                             'opened_at': opened_at})
         
-        trade_id = c.lastrowid
-        conn.commit()
-        conn.close()
+        if own_unit:
+            unit.flush()
         
         AutoTrader.daily_trades += 1
         AutoTrader.open_trades[trade_id] = {
@@ -1058,18 +2751,21 @@ class AutoTrader:
             'stop_loss': stop_loss,
             'take_profit': take_profit,
             'amount': amount,
-            'leverage': leverage
+            'leverage': leverage,
+            'commission': commission,
+            'opened_day': opened_day
         }
         
         return {'success': True, 'trade_id': trade_id}
     
     @staticmethod
-    def check_open_trades(market_data):
+    def check_open_trades(market_data, unit=None):
         """بررسی معاملات باز"""
-        price_map = {item['symbol']: item['price'] for item in market_data}
+        price_map = MarketSnapshot.of(market_data).price_map
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        own_unit = unit is None
+        if own_unit:
+            unit = TickUnit()
         
         for trade_id, trade in list(AutoTrader.open_trades.items()):
             symbol = trade['symbol']
@@ -1116,12 +2812,17 @@ class AutoTrader:
                 commission = amount * CONFIG['commission'] / 100 * 2  # ورود + خروج
                 net_pnl = pnl - commission
                 
-                c.execute('''UPDATE trades SET 
-                             exit_price = ?, pnl = ?, pnl_percent = ?, 
-                             commission = ?, net_pnl = ?, status = 'closed', closed_at = ?
-                             WHERE id = ?''',
-                          (current_price, pnl, pnl_percent, commission, net_pnl, 
-                           datetime.now(), trade_id))
+                unit.add('''UPDATE trades SET 
+                            exit_price = ?, pnl = ?, pnl_percent = ?, 
+                            commission = ?, net_pnl = ?, status = 'closed', closed_at = ?
+                            WHERE id = ?''',
+                         (current_price, pnl, pnl_percent, commission, net_pnl, 
+                          Clock.now(), trade_id))
+                Summaries.trade(unit, trade['opened_day'], wins=int(net_pnl > 0), losses=int(net_pnl < 0),
+                                pnl=net_pnl, commission=commission - trade['commission'])
+                unit.emit('trade_update', {'id': trade_id, 'exit_price': current_price, 'pnl': pnl,
+                                           'pnl_percent': pnl_percent, 'commission': commission, 'net_pnl': net_pnl,
+                                           'status': 'closed', 'closed_at': Clock.now(), 'reason': close_reason})
                 
                 # بروزرسانی آمار
                 if net_pnl < 0:
@@ -1131,104 +2832,732 @@ class AutoTrader:
                 
                 del AutoTrader.open_trades[trade_id]
         
-        conn.commit()
-        conn.close()
+        if own_unit:
+            unit.flush()
+    
+    @staticmethod
+    def get_stats():
+        """آمار معاملات"""
+        with Database.connection() as conn:
+            c = conn.cursor()
+        
+            # روزانه (از جدول خلاصه trade_stats)
+            today = Clock.now().date().isoformat()
+            daily = Summaries.trade_totals(c, today, today)
+        
+            # ماهانه
+            month_start = Clock.now().replace(day=1).date().isoformat()
+            monthly = Summaries.trade_totals(c, month_start)
+        
+        
+        def calc_stats(row):
+            if not row or not row[0]:
+                return {'total': 0, 'wins': 0, 'losses': 0, 'pnl': 0, 'commission': 0, 'win_rate': 0}
+            total = row[0] or 0
+            wins = row[1] or 0
+            return {
+                'total': total,
+                'wins': wins,
+                'losses': row[2] or 0,
+                'pnl': round(row[3] or 0, 2),
+                'commission': round(row[4] or 0, 2),
+                'win_rate': round(wins / total * 100, 1) if total > 0 else 0
+            }
+        
+        return {
+            'daily': calc_stats(daily),
+            'monthly': calc_stats(monthly),
+            'is_running': AutoTrader.is_running,
+            'daily_trades': AutoTrader.daily_trades,
+            'consecutive_losses': AutoTrader.consecutive_losses,
+            'open_trades': len(AutoTrader.open_trades)
+        }
+
+class EngineState:
+    """
+    ریستارت گرم: وضعیت حافظه (قیمت‌های قبلی WhaleDetector و شمارنده‌های AutoTrader) در پایان هر تیک
+    روی unit گرفته می‌شود و داخل همان تراکنش تیک در engine_state نوشته می‌شود؛ فقط کلیدهایی که تغییر کرده‌اند.
+    سیگنال‌ها/پامپ‌های در انتظار و معاملات باز از جداول اصلی بازیابی می‌شوند
+    """
+    
+    _saved = {}  # {key: آخرین value نوشته‌شده}
+    
+    @staticmethod
+    def _snapshot():
+        prev = WhaleDetector.previous_prices
+        known = np.flatnonzero(~np.isnan(prev[:len(price_history.symbols)]))
+        return {
+            'previous_prices': json.dumps(dict(zip([price_history.symbols[i] for i in known.tolist()],
+                                                   prev[known].tolist()))),
+            'autotrader': json.dumps({
+                'daily_trades': AutoTrader.daily_trades,
+                'consecutive_losses': AutoTrader.consecutive_losses,
+                'last_trade_date': AutoTrader.last_trade_date.isoformat() if AutoTrader.last_trade_date else None,
+            }),
+        }
+    
+    @staticmethod
+    def capture(unit):
+        """
+        snapshot وضعیت در پایان تیک، در thread آخرین مرحله‌ای که آن را تغییر می‌دهد (trader، با نوبت _id_turn)
+        persister بعداً همین مقدار را می‌نویسد، نه وضعیت زنده‌ای که تیک‌های بعد تغییرش داده‌اند
+        """
+        unit.engine_state = (Clock.time(), EngineState._snapshot())
+    
+    @staticmethod
+    def save(unit):
+        """ثبت کلیدهای تغییرکرده همراه تیک (از snapshot گرفته‌شده روی unit)"""
+        if unit.engine_state is None:
+            return
+        now, state = unit.engine_state
+        rows = []
+        for key, value in state.items():
+            if EngineState._saved.get(key) != value:
+                rows.append((key, value, now))
+                EngineState._saved[key] = value
+        unit.add_many('''INSERT OR REPLACE INTO engine_state (key, value, updated_at)
+                         VALUES (?, ?, ?)''', rows)
+    
+    @staticmethod
+    def restore():
+        """بازیابی وضعیت با یک بار خواندن دسته‌ای از دیتابیس"""
+        started = time.time()
+        stage_columns = [(f"price_{m}min", f"change_{m}min", f"valid_{m}min") for m in CONFIG['validation_times']]
+        with Database.connection() as conn:
+            state = {key: (value, updated_at) for key, value, updated_at in
+                     conn.execute('SELECT key, value, updated_at FROM engine_state')}
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(signals)')}
+            select = ', '.join(col if col in existing else 'NULL' for cols in stage_columns for col in cols)
+            # timestamp به زمان Clock (UTC) ثبت شده
+            signals = conn.execute(f'''SELECT id, symbol, signal_type, entry_price,
+                                              CAST(strftime('%s', timestamp) AS REAL), {select}
+                                       FROM signals WHERE final_status = 'pending' ORDER BY id''').fetchall()
+            pumps = conn.execute('''SELECT id, symbol, event_type, price_after,
+                                           CAST(strftime('%s', timestamp) AS REAL)
+                                    FROM pump_dumps WHERE validated_at IS NULL ORDER BY id''').fetchall()
+            trades = conn.execute('''SELECT id, symbol, side, entry_price, stop_loss, take_profit, amount, leverage,
+                                            commission, DATE(opened_at)
+                                     FROM trades WHERE status = 'open' ORDER BY id''').fetchall()
+        
+        # شمارنده‌های اتوترید
+        if 'autotrader' in state:
+            counters = json.loads(state['autotrader'][0])
+            AutoTrader.daily_trades = counters['daily_trades']
+            AutoTrader.consecutive_losses = counters['consecutive_losses']
+            if counters['last_trade_date']:
+                AutoTrader.last_trade_date = datetime.strptime(counters['last_trade_date'], '%Y-%m-%d').date()
+        
+        # قیمت‌های قبلی فقط اگر تازه باشند (وگرنه تغییر قیمت در تیک اول پامپ/دامپ کاذب می‌سازد)
+        restored_prices = 0
+        if 'previous_prices' in state and Clock.time() - state['previous_prices'][1] <= CONFIG['state_max_age']:
+            prices = json.loads(state['previous_prices'][0])
+            rows = price_history.rows_for(list(prices))
+            WhaleDetector._previous(rows)
+            WhaleDetector.previous_prices[rows] = list(prices.values())
+            restored_prices = len(prices)
+        
+        for signal_id, symbol, signal_type, entry_price, created, *stages in signals:
+            validations = []
+            for i in range(len(stage_columns)):
+                price, change, valid = stages[i * 3:i * 3 + 3]
+                validations.append(None if price is None else
+                                   {'is_valid': bool(valid), 'change': change, 'price': price, 'stage': i + 1})
+            SignalValidator.add_pending_signal(signal_id, symbol, signal_type, entry_price, created, validations)
+        
+        for pump_id, symbol, event_type, price, created in pumps:
+            SignalValidator.add_pending_pump(pump_id, symbol, event_type, price, created)
+        
+        for trade_id, symbol, side, entry_price, stop_loss, take_profit, amount, leverage, commission, day in trades:
+            AutoTrader.open_trades[trade_id] = {
+                'symbol': symbol,
+                'side': side,
+                'entry_price': entry_price,
+                'stop_loss': stop_loss,
+                'take_profit': take_profit,
+                'amount': amount,
+                'leverage': leverage,
+                'commission': commission or 0,
+                'opened_day': day
+            }
+        
+        EngineState._saved = {key: value for key, (value, _) in state.items()}
+        print(f"♻️ وضعیت بازیابی شد: {len(signals)} سیگنال، {len(pumps)} پامپ/دامپ، {len(trades)} معامله باز، "
+              f"{restored_prices} قیمت قبلی ({(time.time() - started) * 1000:.0f}ms)")
+
+# ═══════════════════════════════════════════════════════════════════════════
+# Background Worker
+# ═══════════════════════════════════════════════════════════════════════════
+
+class TickScheduler:
+    """
+    زمان‌بند تیک‌های background_worker
+    - cadence مطلق: تیک k در start + k × update_interval (زمان پردازش به فاصله تیک‌ها اضافه نمی‌شود)
+    - زمان هر مرحله اندازه‌گیری و تیک با بودجه update_interval مقایسه می‌شود؛ overrun گزارش و طبق
+      tick_overrun جبران (catchup: اجرای فوری تا tick_max_catchup تیک عقب‌افتاده) یا رد (skip) می‌شود
+    - خطای یک مرحله فقط همان مرحله را با backoff نمایی کنار می‌گذارد و بقیه تیک ادامه می‌یابد
+    """
+    
+    STAGES = ('fetch', 'normalize', 'detect', 'signals', 'pumps', 'trade', 'persist', 'publish', 'retention')
+    
+    stats = {}  # {stage: {'runs', 'errors', 'skipped', 'last_ms', 'max_ms', 'total_ms', 'backoff', 'retry_at', 'last_error'}}
+    next_at = None  # deadline تیک بعد (time.time)
+    ticks = 0
+    overruns = 0
+    skipped_ticks = 0
+    caught_up = 0
+    last_tick = {}  # {'at', 'duration_ms', 'budget_ms', 'stages': {stage: ms}}
+    backlog = deque()  # TickUnit های ثبت‌نشده (persist ناموفق یا در backoff) به ترتیب تیک
+    quarantined = 0  # unit هایی که بعد از persist_max_retries کنار گذاشته شدند
+    _started = 0.0
+    _stage_ms = {}
+    
+    @staticmethod
+    def _stage(stage):
+        stats = TickScheduler.stats.get(stage)
+        if stats is None:
+            stats = TickScheduler.stats[stage] = {'runs': 0, 'errors': 0, 'skipped': 0, 'last_ms': 0.0,
+                                                  'max_ms': 0.0, 'total_ms': 0.0, 'backoff': 0,
+                                                  'retry_at': 0.0, 'last_error': None}
+        return stats
+    
+    @staticmethod
+    def run(stage, func, *args):
+        """اجرای یک مرحله با زمان‌سنجی؛ خروجی func یا None اگر مرحله در backoff است یا خطا داد"""
+        stats = TickScheduler._stage(stage)
+        now = time.time()
+        if now < stats['retry_at']:
+            stats['skipped'] += 1
+            return None
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            if PayloadReplay.active:
+                raise  # در بازپخش خطا پنهان نمی‌شود (نتیجه باید قطعی باشد)
+            stats['errors'] += 1
+            stats['backoff'] = min(stats['backoff'] * 2 or CONFIG['update_interval'], CONFIG['stage_backoff_max'])
+            stats['retry_at'] = now + stats['backoff']
+            stats['last_error'] = str(e)
+            print(f"❌ {stage} Error: {e} - تلاش دوباره بعد از {stats['backoff']:g}s")
+            result = None
+        else:
+            stats['backoff'] = 0
+            stats['retry_at'] = 0.0
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            stats['runs'] += 1
+            stats['last_ms'] = ms
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            TickScheduler._stage_ms[stage] = ms
+        return result
+    
+    @staticmethod
+    def persist(unit):
+        """
+        مرحله ثبت: unit تیک به انتهای backlog و ثبت همه به ترتیب تیک
+        تا ثبت موفق unit نگه داشته می‌شود (هیچ ردیفی با خطای گذرای دیتابیس گم نمی‌شود)
+        """
+        TickScheduler.backlog.append(unit)
+        TickScheduler.run('persist', TickScheduler.flush_backlog)
     
     @staticmethod
-    def get_stats():
-        """آمار معاملات"""
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+    def flush_backlog():
+        """
+        ثبت unit های backlog به ترتیب؛ هر unit جدا و در تراکنش خودش
+        unit ای که persist_max_retries بار پشت سر هم ناموفق بوده (IntegrityError، خطای schema)
+        قرنطینه می‌شود تا تیک‌های بعد پشت آن نمانند
+        """
+        backlog = TickScheduler.backlog
+        while backlog:
+            unit = backlog[0]
+            try:
+                persist_tick(unit)
+            except Exception as e:
+                unit.failures += 1
+                if unit.failures < CONFIG['persist_max_retries']:
+                    raise
+                TickScheduler.quarantine(unit, e)
+            backlog.popleft()
+    
+    @staticmethod
+    def quarantine_path():
+        return os.path.splitext(DB_PATH)[0] + '_quarantine.jsonl'
+    
+    @staticmethod
+    def quarantine(unit, error):
+        """کنار گذاشتن unit مسموم: ردیف‌ها در فایل قرنطینه (JSONL کنار دیتابیس) برای بررسی دستی"""
+        path = TickScheduler.quarantine_path()
+        rows = sum(len(params) for params in unit.statements.values())
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'at': Clock.now().isoformat(),
+                'error': str(error),
+                'failures': unit.failures,
+                'statements': [{'sql': sql, 'rows': params} for sql, params in unit.statements.items()],
+            }, default=str) + '\n')
+        TickScheduler.quarantined += 1
+        EngineState._saved = {}  # وضعیت همراه این unit ثبت نشد؛ تیک بعد همه کلیدها را دوباره می‌نویسد
+        print(f"🚫 unit تیک بعد از {unit.failures} تلاش ناموفق قرنطینه شد ({rows} ردیف): {error} → {path}")
+    
+    @staticmethod
+    def begin():
+        TickScheduler._started = time.perf_counter()
+        TickScheduler._stage_ms = {}
+    
+    @staticmethod
+    def end():
+        """ثبت زمان تیک اجرای ترتیبی"""
+        TickScheduler.record((time.perf_counter() - TickScheduler._started) * 1000, TickScheduler._stage_ms)
+    
+    @staticmethod
+    def record(duration, stage_ms, latency=None):
+        """
+        مقایسه زمان تیک با بودجه update_interval و گزارش overrun
+        در خط لوله duration = کندترین مرحله (گلوگاه throughput) و latency = دریافت تا انتشار
+        """
+        budget = CONFIG['update_interval'] * 1000
+        TickScheduler.ticks += 1
+        TickScheduler.last_tick = {
+            'at': datetime.now().isoformat(),
+            'duration_ms': round(duration, 1),
+            'latency_ms': round(duration if latency is None else latency, 1),
+            'budget_ms': budget,
+            'stages': {stage: round(ms, 1) for stage, ms in stage_ms.items()},
+        }
+        if budget and duration > budget and CONFIG.get('ingest_mode') != 'stream':
+            TickScheduler.overruns += 1
+            slowest = sorted(stage_ms.items(), key=lambda item: -item[1])[:3]
+            print(f"⏱️ overrun: تیک {duration:.0f}ms > بودجه {budget:.0f}ms "
+                  f"({', '.join(f'{stage} {ms:.0f}ms' for stage, ms in slowest)})")
+    
+    @staticmethod
+    def wait():
+        """خواب تا deadline تیک بعد"""
+        if TickScheduler.next_at is None:
+            TickScheduler.next_at = time.time()
+        delay = TickScheduler.next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    
+    @staticmethod
+    def advance(streaming):
+        """deadline تیک بعد روی شبکه زمانی ثابت؛ تیک‌های عقب‌افتاده صریحاً جبران یا رد می‌شوند"""
+        now = time.time()
+        if streaming:
+            TickScheduler.next_at = now  # حالت stream: تیک‌ها با تغییر دفتر زنده (TickerStream.take منتظر می‌ماند)
+            return
+        interval = CONFIG['update_interval']
+        TickScheduler.next_at += interval
+        if now <= TickScheduler.next_at or interval <= 0:
+            return
+        behind = int((now - TickScheduler.next_at) // interval)  # خانه‌های کامل از دست رفته
+        if CONFIG.get('tick_overrun') == 'catchup' and behind < CONFIG['tick_max_catchup']:
+            TickScheduler.caught_up += 1  # next_at در گذشته: تیک بعد بلافاصله اجرا می‌شود
+            return
+        TickScheduler.next_at += (behind + 1) * interval
+        TickScheduler.skipped_ticks += behind + 1
+    
+    @staticmethod
+    def report():
+        stages = {}
+        for stage in TickScheduler.STAGES:
+            stats = TickScheduler.stats.get(stage)
+            if stats is None:
+                continue
+            stages[stage] = {
+                'runs': stats['runs'],
+                'errors': stats['errors'],
+                'skipped': stats['skipped'],
+                'last_ms': round(stats['last_ms'], 1),
+                'avg_ms': round(stats['total_ms'] / stats['runs'], 1) if stats['runs'] else 0,
+                'max_ms': round(stats['max_ms'], 1),
+                'backoff': stats['backoff'],
+                'retry_in': max(0, round(stats['retry_at'] - time.time(), 1)),
+                'last_error': stats['last_error'],
+            }
+        return {
+            'interval': CONFIG['update_interval'],
+            'overrun_policy': CONFIG.get('tick_overrun', 'skip'),
+            'ticks': TickScheduler.ticks,
+            'overruns': TickScheduler.overruns,
+            'skipped_ticks': TickScheduler.skipped_ticks,
+            'caught_up': TickScheduler.caught_up,
+            'backlog': len(TickScheduler.backlog),
+            'quarantined': TickScheduler.quarantined,
+            'last_tick': TickScheduler.last_tick,
+            'stages': stages,
+        }
+
+def fetch_raw():
+    """دریافت خام: stream (دفتر زنده WebSocket) یا poll (REST همزمان) → (items, sources, streaming)"""
+    sources = MarketAPI.configured_sources()
+    streaming = TickerStream.start(sources if CONFIG.get('ingest_mode') == 'stream' else [])
+    if streaming:
+        items = TickerStream.take(CONFIG['update_interval'])
+        items += TickerStream.poll_rest([source for source in sources if source not in streaming])
+        return items, sources, True
+    return MarketAPI.fetch_sources(sources), sources, False
+
+def fetch_market(unit):
+    """مرحله دریافت اجرای ترتیبی: دریافت خام + ingest → (market_data, sources, streaming)"""
+    raw, sources, streaming = fetch_raw()
+    return MarketAPI.ingest(raw, unit), sources, streaming
+
+def auto_trade(market_data, unit):
+    """مرحله اتوترید: بستن معاملات باز و اجرای اولین سیگنال معتبر صف"""
+    AutoTrader.check_open_trades(market_data, unit)
+    
+    # ترید جدید - بررسی صف سیگنال‌های معتبر
+    can, _ = AutoTrader.can_trade()
+    if can:
+        queue = AutoTrader.get_trade_queue()
+        if queue:
+            # اجرای معامله برای اولین سیگنال معتبر در صف
+            # (صف از دیتابیس خوانده می‌شود، پس سیگنال‌های همین تیک از تیک بعد دیده می‌شوند)
+            result = AutoTrader.execute_trade(queue[0], unit)
+            if result.get('success'):
+                print(f"✅ معامله اجرا شد: {queue[0]['symbol']} {queue[0]['signal_type']}")
+            else:
+                print(f"⚠️ خطا در معامله: {result.get('error', 'Unknown')}")
+
+def persist_tick(unit):
+    """ثبت یک unit: کل تیک همراه وضعیت حافظه در یک تراکنش (یک fsync)"""
+    EngineState.save(unit)
+    unit.flush()
+
+def publish_tick(market_data, sources):
+    """مرحله انتشار: snapshot برای /api/market و push تغییرات به داشبوردها (بعد از ثبت)"""
+    # payload بدون تغییر: snapshot منتشرشده قبلی هنوز معتبر است (نسخه/ETag عوض نمی‌شود)
+    if market_data and market_data.moved_count():
+        MarketCache.publish(market_data.items, sources)
+    
+    # push به داشبوردها: تغییرات قیمت + آمار خلاصه (فقط اگر عوض شده باشند)
+    live = []
+    if market_data:
+        changed = EventBus.market_delta(market_data.items)
+        if changed:
+            live.append(('market', {'items': changed, 'sources': MarketAPI.last_sources}))
+    with Database.connection() as conn:
+        stats = live_stats(conn.cursor())
+    if stats != EventBus._last_stats:
+        EventBus._last_stats = stats
+        live.append(('stats', stats))
+    if live:
+        EventBus.publish_many(live)
+
+def run_tick():
+    """
+    یک تیک کامل: دریافت → تشخیص → اعتبارسنجی → اتوترید → ثبت → انتشار → آرشیو
+    هر مرحله جداگانه زمان‌سنجی می‌شود و خطای آن فقط همان مرحله را به backoff می‌برد (TickScheduler)
+    خروجی: (market_data, streaming) - streaming یعنی تیک با دفتر زنده WebSocket اجرا شد
+    """
+    run = TickScheduler.run
+    TickScheduler.begin()
+    
+    # همه تغییرات این تیک در یک تراکنش ثبت می‌شوند
+    unit = TickUnit()
+    market_data, sources, streaming = (run('fetch', fetch_market, unit) or
+                                       (None, MarketAPI.configured_sources(), False))
+    
+    if market_data:
+        print(f"📊 Market data fetched: {len(market_data)} symbols ({market_data.moved_count()} changed)")
+        # تشخیص نهنگ و پامپ/دامپ
+        run('detect', WhaleDetector.detect, market_data, unit)
         
-        # روزانه
-        today = datetime.now().date().isoformat()
-        c.execute('''SELECT 
-                     COUNT(*) as total,
-                     SUM(CASE WHEN net_pnl > 0 THEN 1 ELSE 0 END) as wins,
-                     SUM(CASE WHEN net_pnl < 0 THEN 1 ELSE 0 END) as losses,
-                     SUM(net_pnl) as total_pnl,
-                     SUM(commission) as total_commission
-                     FROM trades WHERE DATE(opened_at) = ?''', (today,))
-        daily = c.fetchone()
-        
-        # ماهانه
-        month_start = datetime.now().replace(day=1).date().isoformat()
-        c.execute('''SELECT 
-                     COUNT(*) as total,
-                     SUM(CASE WHEN net_pnl > 0 THEN 1 ELSE 0 END) as wins,
-                     SUM(CASE WHEN net_pnl < 0 THEN 1 ELSE 0 END) as losses,
-                     SUM(net_pnl) as total_pnl,
-                     SUM(commission) as total_commission
-                     FROM trades WHERE DATE(opened_at) >= ?''', (month_start,))
-        monthly = c.fetchone()
-        
-        conn.close()
+        # بررسی سیگنال‌های در انتظار (اولویت اول - باید قبل از اتوترید باشد)
+        run('signals', SignalValidator.check_pending_signals, market_data, unit)
+        run('pumps', SignalValidator.check_pending_pumps, market_data, unit)
         
-        def calc_stats(row):
-            if not row or not row[0]:
-                return {'total': 0, 'wins': 0, 'losses': 0, 'pnl': 0, 'commission': 0, 'win_rate': 0}
-            total = row[0] or 0
-            wins = row[1] or 0
-            return {
-                'total': total,
-                'wins': wins,
-                'losses': row[2] or 0,
-                'pnl': round(row[3] or 0, 2),
-                'commission': round(row[4] or 0, 2),
-                'win_rate': round(wins / total * 100, 1) if total > 0 else 0
-            }
+        # اتوترید (بعد از اعتبارسنجی)
+        if AutoTrader.is_running:
+            run('trade', auto_trade, market_data, unit)
+    EngineState.capture(unit)
+    
+    # unit های ثبت‌نشده تیک‌های قبل اول و به ترتیب ثبت می‌شوند
+    TickScheduler.persist(unit)
+    
+    # انتشار بعد از ثبت، تا داشبورد و دیتابیس همخوان باشند
+    run('publish', publish_tick, market_data, sources)
+    
+    # انتقال پارتیشن‌های قدیمی به آرشیو (حداکثر یک پارتیشن در هر تیک)
+    run('retention', Retention.run_due)
+    
+    TickScheduler.end()
+    return market_data, streaming
+
+class Pipeline:
+    """
+    background_worker به صورت خط لوله: fetcher → normalizer → detector → validator → trader → persister
+    هر مرحله یک thread با صف ورودی محدود (pipeline_queue_size)؛ صف پر مرحله قبل را متوقف می‌کند (backpressure).
+    تیک N+1 دریافت می‌شود در حالی که تیک N پردازش و ثبت می‌شود؛ هر مرحله تیک‌ها را به ترتیب می‌بیند
+    و حالت مشترک هر مرحله فقط در thread همان مرحله تغییر می‌کند (اندیکاتورهای تیک در snapshot منجمد می‌شوند)
+    مراحلی که شناسه رزرو می‌کنند (detector، validator، trader) برای هر تیک پشت سر هم اجرا می‌شوند و detector تیک
+    بعد تا پایان trader تیک قبل صبر می‌کند: ترتیب شناسه‌ها همان ترتیب commit است (cursor های since_id ردیفی را جا نمی‌اندازند)
+    """
+    
+    STAGES = ('normalizer', 'detector', 'validator', 'trader', 'persister')
+    
+    queues = {}  # {stage: صف ورودی}
+    metrics = {}  # {stage: {'processed', 'max_depth', 'blocked_ms', 'busy_ms'}}
+    threads = {}
+    seq = 0
+    _id_turn = threading.Semaphore(1)  # نوبت رزرو شناسه: از شروع detector تا پایان trader یک تیک
+    
+    @staticmethod
+    def start():
+        """ساخت صف‌ها و thread های مراحل (یک بار)؛ fetcher خود background_worker است"""
+        if Pipeline.threads:
+            return
+        handlers = {
+            'normalizer': Pipeline._normalize,
+            'detector': Pipeline._detect,
+            'validator': Pipeline._validate,
+            'trader': Pipeline._trade,
+            'persister': Pipeline._persist,
+        }
+        for stage in Pipeline.STAGES:
+            Pipeline.queues[stage] = queue.Queue(maxsize=CONFIG['pipeline_queue_size'])
+            Pipeline.metrics[stage] = {'processed': 0, 'max_depth': 0, 'blocked_ms': 0.0, 'busy_ms': 0.0}
+        for i, stage in enumerate(Pipeline.STAGES):
+            following = Pipeline.STAGES[i + 1] if i + 1 < len(Pipeline.STAGES) else None
+            thread = threading.Thread(target=Pipeline._worker, args=(stage, handlers[stage], following),
+                                      daemon=True, name=f'pipeline-{stage}')
+            Pipeline.threads[stage] = thread
+            thread.start()
+    
+    @staticmethod
+    def put(stage, tick):
+        """ارسال تیک به صف مرحله (منتظر می‌ماند اگر صف پر است)"""
+        q = Pipeline.queues[stage]
+        metrics = Pipeline.metrics[stage]
+        started = time.perf_counter()
+        q.put(tick)
+        metrics['blocked_ms'] += (time.perf_counter() - started) * 1000
+        metrics['max_depth'] = max(metrics['max_depth'], q.qsize())
+    
+    @staticmethod
+    def _worker(stage, handler, following):
+        q = Pipeline.queues[stage]
+        metrics = Pipeline.metrics[stage]
+        while True:
+            tick = q.get()
+            started = time.perf_counter()
+            try:
+                handler(tick)
+            except Exception as e:
+                print(f"❌ {stage} Error: {e}")
+            ms = (time.perf_counter() - started) * 1000
+            metrics['busy_ms'] += ms
+            metrics['processed'] += 1
+            tick['stage_ms'][stage] = ms
+            if following:
+                Pipeline.put(following, tick)
+    
+    @staticmethod
+    def fetch():
+        """مرحله fetcher (thread کارگر): دریافت خام و ارسال به normalizer"""
+        Pipeline.seq += 1
+        fetch_started = time.perf_counter()
+        raw, sources, streaming = TickScheduler.run('fetch', fetch_raw) or (None, MarketAPI.configured_sources(), False)
+        tick = {
+            'seq': Pipeline.seq,
+            'unit': TickUnit(),
+            'raw': raw,
+            'market_data': None,
+            'sources': sources,
+            'started': fetch_started,
+            'stage_ms': {'fetcher': (time.perf_counter() - fetch_started) * 1000},
+        }
+        Pipeline.put('normalizer', tick)
+        return streaming
+    
+    @staticmethod
+    def _normalize(tick):
+        tick['market_data'] = TickScheduler.run('normalize', MarketAPI.ingest, tick['raw'], tick['unit'])
+        tick['raw'] = None
+    
+    @staticmethod
+    def _detect(tick):
+        Pipeline._id_turn.acquire()  # آزادسازی در _trade همین تیک
+        market_data = tick['market_data']
+        if market_data:
+            print(f"📊 Market data fetched: {len(market_data)} symbols ({market_data.moved_count()} changed)")
+            TickScheduler.run('detect', WhaleDetector.detect, market_data, tick['unit'])
+    
+    @staticmethod
+    def _validate(tick):
+        market_data = tick['market_data']
+        if market_data:
+            TickScheduler.run('signals', SignalValidator.check_pending_signals, market_data, tick['unit'])
+            TickScheduler.run('pumps', SignalValidator.check_pending_pumps, market_data, tick['unit'])
+    
+    @staticmethod
+    def _trade(tick):
+        try:
+            if tick['market_data'] and AutoTrader.is_running:
+                TickScheduler.run('trade', auto_trade, tick['market_data'], tick['unit'])
+            EngineState.capture(tick['unit'])  # قبل از آزاد شدن نوبت، تا detector تیک بعد وضعیت را تغییر نداده باشد
+        finally:
+            Pipeline._id_turn.release()
+    
+    @staticmethod
+    def _persist(tick):
+        started = time.perf_counter()
+        # unit های ثبت‌نشده تیک‌های قبل اول و به ترتیب ثبت می‌شوند
+        TickScheduler.persist(tick['unit'])
+        TickScheduler.run('publish', publish_tick, tick['market_data'], tick['sources'])
+        TickScheduler.run('retention', Retention.run_due)
         
+        # throughput با کندترین مرحله محدود می‌شود؛ latency = دریافت تا انتشار
+        finished = time.perf_counter()
+        stage_ms = tick['stage_ms']
+        stage_ms['persister'] = (finished - started) * 1000
+        TickScheduler.record(max(stage_ms.values()), stage_ms, (finished - tick['started']) * 1000)
+    
+    @staticmethod
+    def report():
         return {
-            'daily': calc_stats(daily),
-            'monthly': calc_stats(monthly),
-            'is_running': AutoTrader.is_running,
-            'daily_trades': AutoTrader.daily_trades,
-            'consecutive_losses': AutoTrader.consecutive_losses,
-            'open_trades': len(AutoTrader.open_trades)
+            'queue_size': CONFIG['pipeline_queue_size'],
+            'stages': {stage: {
+                'depth': Pipeline.queues[stage].qsize(),
+                'max_depth': Pipeline.metrics[stage]['max_depth'],
+                'processed': Pipeline.metrics[stage]['processed'],
+                'busy_ms': round(Pipeline.metrics[stage]['busy_ms'], 1),
+                'avg_ms': round(Pipeline.metrics[stage]['busy_ms'] / Pipeline.metrics[stage]['processed'], 1)
+                          if Pipeline.metrics[stage]['processed'] else 0,
+                'blocked_ms': round(Pipeline.metrics[stage]['blocked_ms'], 1),  # انتظار مرحله قبل روی صف پر
+            } for stage in Pipeline.STAGES if stage in Pipeline.queues},
         }
 
-# ═══════════════════════════════════════════════════════════════════════════
-# Background Worker
-# ═══════════════════════════════════════════════════════════════════════════
-
 def background_worker():
-    """کارگر پس‌زمینه برای بروزرسانی"""
+    """
+    کارگر پس‌زمینه: تیک‌ها روی cadence مطلق update_interval (TickScheduler)
+    با CONFIG['pipeline'] این thread فقط fetcher خط لوله است و بقیه مراحل در thread های Pipeline اجرا می‌شوند
+    """
     print("🔄 Background worker started")
+    pipelined = CONFIG.get('pipeline', True)
+    if pipelined:
+        Pipeline.start()
     while True:
+        TickScheduler.wait()
+        streaming = False
         try:
-            # دریافت قیمت (با استفاده از api_source از CONFIG)
-            market_data = MarketAPI.fetch(CONFIG['api_source'])
-            
-            if market_data:
-                print(f"📊 Market data fetched: {len(market_data)} symbols")
-                # تشخیص نهنگ و پامپ/دامپ
-                WhaleDetector.detect(market_data)
-                
-                # بررسی سیگنال‌های در انتظار (اولویت اول - باید قبل از اتوترید باشد)
-                SignalValidator.check_pending_signals(market_data)
-                SignalValidator.check_pending_pumps(market_data)
-                
-                # اتوترید (بعد از اعتبارسنجی)
-                if AutoTrader.is_running:
-                    AutoTrader.check_open_trades(market_data)
-                    
-                    # ترید جدید - بررسی صف سیگنال‌های معتبر
-                    can, _ = AutoTrader.can_trade()
-                    if can:
-                        queue = AutoTrader.get_trade_queue()
-                        if queue:
-                            # اجرای معامله برای اولین سیگنال معتبر در صف
-                            result = AutoTrader.execute_trade(queue[0])
-                            if result.get('success'):
-                                print(f"✅ معامله اجرا شد: {queue[0]['symbol']} {queue[0]['signal_type']}")
-                            else:
-                                print(f"⚠️ خطا در معامله: {result.get('error', 'Unknown')}")
-            
-            time.sleep(CONFIG['update_interval'])
-        
+            if pipelined:
+                streaming = Pipeline.fetch()
+            else:
+                _, streaming = run_tick()
         except Exception as e:
             print(f"❌ Background Error: {e}")
-            time.sleep(10)
+        TickScheduler.advance(streaming)
+
+def replay_digest():
+    """
+    (تعداد، md5) ردیف‌های جداول خروجی برای مقایسه bit-for-bit دو بازپخش
+    زمان ردیف‌ها از Clock نوشته می‌شود، پس همه ستون‌ها (از جمله timestamp) در digest هستند
+    """
+    digests = {}
+    with Database.connection() as conn:
+        for table in ('ohlcv', 'indicators', 'whales', 'signals', 'pump_dumps', 'trades'):
+            digest = hashlib.md5()
+            count = 0
+            for row in conn.execute(f"SELECT * FROM {table} ORDER BY rowid"):
+                digest.update(repr(row).encode())
+                count += 1
+            digests[table] = (count, digest.hexdigest())
+    return digests
+
+def reset_engine_state():
+    """
+    بازگرداندن همه وضعیت حافظه موتور به حالت شروع (بازپخش پشت سر هم در یک پروسه باید digest یکسان بدهد)
+    تاریخچه قیمت، کندل‌ها، قیمت‌های قبلی، سیگنال‌ها/پامپ‌های در انتظار، اتوترید، اثر انگشت منابع و زمان‌بندی
+    """
+    global price_history, candle_builder
+    price_history = PriceHistory()
+    candle_builder = CandleBuilder()
+    WhaleDetector.previous_prices = np.full(0, np.nan)
+    SymbolChanges.prices = np.full(0, np.nan)
+    SymbolChanges.volumes = np.full(0, np.nan)
+    
+    with SignalValidator._lock:
+        SignalValidator.pending_signals = {}
+        SignalValidator.pending_pumps = {}
+        SignalValidator.signal_schedule = []
+        SignalValidator.pump_schedule = []
+        SignalValidator._seq = itertools.count()
+    
+    AutoTrader.daily_trades = 0
+    AutoTrader.consecutive_losses = 0
+    AutoTrader.last_trade_date = None
+    AutoTrader.open_trades = {}
+    
+    MarketAPI.last_sources = {}
+    MarketAPI.fingerprints = {}
+    MarketAPI.noop_ticks = 0
+    MarketAPI._last_merged = None
+    MarketAPI._ingested = (None, None)
+    
+    EngineState._saved = {}
+    Summaries._pruned_minute = None
+    Retention.next_run = 0
+    EventBus._last_market = {}
+    EventBus._last_stats = None
+    with ValidationGrid._lock:
+        ValidationGrid.loaded = False
+        ValidationGrid.records = {}
+        ValidationGrid.rows = {}
+        ValidationGrid.changed = {}
+        ValidationGrid.order = {kind: deque() for kind in ValidationGrid.order}
+        ValidationGrid._merged = (None, [])
+    
+    TickScheduler.stats = {}
+    TickScheduler.next_at = None
+    TickScheduler.backlog = deque()
+    TickScheduler.quarantined = 0
+    TickScheduler.ticks = TickScheduler.overruns = TickScheduler.skipped_ticks = TickScheduler.caught_up = 0
+    TickScheduler.last_tick = {}
+    TickUnit._next_ids = {}
+
+def run_replay(path, speed=1.0, db_path='whale_hunter_replay.db'):
+    """
+    بازپخش headless ضبط‌های PayloadRecorder روی دیتابیس تازه: کل خط لوله با Clock مجازی اجرا می‌شود
+    و زمان پردازش تیک‌ها + digest جداول گزارش می‌شود (دو اجرا روی یک ضبط باید digest یکسان بدهند)
+    """
+    global DB_PATH
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    DB_PATH = db_path
+    Database.close_all()
+    reset_engine_state()
+    history.root = os.path.splitext(db_path)[0] + '_history'
+    if os.path.isdir(history.root):
+        import shutil
+        shutil.rmtree(history.root)
+    CONFIG.update(api_key='', secret_key='', ingest_mode='poll', capture_dir='')  # هرگز سفارش واقعی در بازپخش
+    init_db()
+    
+    PayloadReplay.start(path, speed)
+    durations = []
+    started = time.time()
+    while True:
+        market_data, _ = run_tick()
+        if PayloadReplay.finished:
+            break
+        durations.append(time.time() - PayloadReplay._last[1])  # بدون مکث تنظیم سرعت
+    elapsed = time.time() - started
+    PayloadReplay.active = False
+    
+    if not durations:
+        print(f"❌ تیکی در {path} پیدا نشد")
+        return {}
+    ms = np.array(durations) * 1000
+    print(f"📼 {len(durations)} تیک در {elapsed:.2f}s - پردازش تیک: "
+          f"p50 {np.percentile(ms, 50):.1f}ms، p95 {np.percentile(ms, 95):.1f}ms، max {ms.max():.1f}ms")
+    digests = replay_digest()
+    for table, (count, digest) in digests.items():
+        print(f"   {table:<11} {count:>8} {digest}")
+    return digests
 
 # شروع کارگر پس‌زمینه
 worker_thread = threading.Thread(target=background_worker, daemon=True)
@@ -1255,121 +3584,212 @@ def autotrade_dashboard():
 
 @app.route('/api/market')
 def api_market():
-    """دریافت دیتای بازار - با هماهنگی انتخاب صرافی (بدون cache)"""
-    source = request.args.get('source', CONFIG['api_source'])
+    """دیتای بازار از آخرین snapshot منتشرشده توسط background_worker (با ETag)"""
+    version, published_at, data, body = MarketCache.get()
+    if body is None:
+        # worker هنوز اولین تیک را کامل نکرده
+        return jsonify({'success': False, 'data': [], 'count': 0, 'version': 0,
+                        'timestamp': datetime.now().isoformat()})
+    
+    # بدون sync می‌شود snapshot را به یک صرافی محدود کرد (فیلتر در حافظه)
+    source = request.args.get('source')
+    if source and not CONFIG.get('api_source_sync', True):
+        data = [item for item in data if item.get('source') == source]
+        response = jsonify({
+            'success': True,
+            'data': data,
+            'source': source,
+            'count': len(data),
+            'version': version,
+            'timestamp': datetime.fromtimestamp(published_at).isoformat()
+        })
+        etag = f"{version}-{source}"
+    else:
+        response = app.response_class(body, mimetype='application/json')
+        etag = str(version)
+    
+    ttl = CONFIG.get('market_cache_ttl', 5)
+    age = time.time() - published_at
+    response.set_etag(etag)
+    response.cache_control.max_age = int(ttl)
+    response.headers['Age'] = str(int(age))
+    response.headers['X-Snapshot-Stale'] = 'true' if age > ttl + CONFIG['update_interval'] else 'false'
+    return response.make_conditional(request)
+
+PAGE_LIMIT = 100
+PAGE_MAX_LIMIT = 1000
+LIST_TABLES = {  # جدول → (ستون زمان ایجاد، ستون زمان تغییر برای دلتا)
+    'whales': ('timestamp', None),
+    'signals': ('timestamp', 'updated_at'),
+    'pump_dumps': ('timestamp', 'validated_at'),
+    'trades': ('opened_at', 'closed_at'),
+}
+_table_columns = {}
+CHANGED_MIN = '0'  # cursor تغییرات وقتی هنوز ردیفی تغییر نکرده (کوچک‌تر از هر زمان ثبت‌شده)
+
+def query_page(c, table, filters=None):
+    """
+    صفحه‌بندی keyset برای روت‌های لیست (پارامترها از query string):
+    - limit و fields (انتخاب ستون‌ها - id همیشه برگردانده می‌شود)
+    - before_id / before_ts: صفحه قدیمی‌تر
+    - since_id (+ changed_since, changed_id): فقط ردیف‌های جدید و ردیف‌هایی که بعد از cursor تغییر کرده‌اند
+      هر دو به ترتیب صعودی از cursor خوانده می‌شوند و cursor تا آخرین ردیف برگشتی جلو می‌رود؛
+      has_more یعنی صفحه پر بوده و درخواست بعدی با همین cursor ادامه می‌دهد (هیچ ردیفی جا نمی‌ماند)
+    خروجی: (rows, updated, cursor)
+    """
+    filters = filters or {}
+    time_column, changed_column = LIST_TABLES[table]
+    if table not in _table_columns:
+        _table_columns[table] = [row[1] for row in c.execute(f'PRAGMA table_info({table})')]
+    columns = _table_columns[table]
+    
+    fields = request.args.get('fields')
+    if fields:
+        selected = ['id'] + [f for f in fields.split(',') if f in columns and f != 'id']
+    else:
+        selected = columns
+    limit = max(1, min(request.args.get('limit', PAGE_LIMIT, type=int), PAGE_MAX_LIMIT))
+    since_id = request.args.get('since_id', type=int)
+    changed_since = request.args.get('changed_since')
+    changed_id = request.args.get('changed_id', type=int)  # tie-break ردیف‌های هم‌زمان تغییرکرده (صفحه ناتمام)
     
-    # اگر sync فعال است، از CONFIG استفاده کن
-    if CONFIG.get('api_source_sync', True):
-        source = CONFIG['api_source']
+    base = [f'{column} = ?' for column in filters]
+    base_params = list(filters.values())
     
-    # همیشه دیتای fresh بگیر (بدون cache)
-    data = MarketAPI.fetch(source)
+    # سقف cursor تغییرات قبل از خواندن ردیف‌ها گرفته می‌شود تا تغییری بین دو کوئری گم نشود
+    changed_max = None
+    if changed_column:
+        changed_max = c.execute(f'SELECT MAX({changed_column}) FROM {table}').fetchone()[0] or CHANGED_MIN
     
-    # بررسی یکتایی symbol ها برای جلوگیری از تکرار
-    if data:
-        seen = set()
-        unique_data = []
-        for item in data:
-            if item['symbol'] not in seen:
-                seen.add(item['symbol'])
-                unique_data.append(item)
-        data = unique_data
+    where = list(base)
+    params = list(base_params)
+    if since_id is not None:
+        where.append('id > ?')
+        params.append(since_id)
+    if request.args.get('before_id', type=int) is not None:
+        where.append('id < ?')
+        params.append(request.args.get('before_id', type=int))
+    if request.args.get('before_ts'):
+        where.append(f'{time_column} < ?')
+        params.append(request.args['before_ts'])
     
-    return jsonify({
-        'success': data is not None, 
-        'data': data or [], 
-        'source': source,
-        'count': len(data) if data else 0,
-        'timestamp': datetime.now().isoformat()  # برای ردیابی freshness
-    })
+    def select(names, conditions, order, values):
+        sql = f"SELECT {', '.join(names)} FROM {table}"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        c.execute(f'{sql} ORDER BY {order} LIMIT ?', values + [limit])
+        return [dict(zip(names, row)) for row in c.fetchall()]
+    
+    if since_id is None:
+        rows = select(selected, where, 'id DESC', params)
+        cursor = {'last_id': max([row['id'] for row in rows] + [0])}
+        if changed_column:
+            cursor['changed_since'] = changed_max
+        return rows, [], cursor
+    
+    # دلتا: قدیمی‌ترین ردیف‌های جدید اول؛ پاسخ مثل صفحه عادی نزولی است
+    rows = select(selected, where, 'id ASC', params)
+    cursor = {'last_id': rows[-1]['id'] if rows else since_id, 'has_more': len(rows) == limit}
+    rows.reverse()
+    
+    updated = []
+    if changed_column:
+        cursor['changed_since'] = changed_max or changed_since
+        if changed_since and changed_max:
+            names = selected if changed_column in selected else selected + [changed_column]
+            if changed_id is None:
+                after, after_params = f'{changed_column} > ?', [changed_since]
+            else:
+                after = f'({changed_column} > ? OR ({changed_column} = ? AND id > ?))'
+                after_params = [changed_since, changed_since, changed_id]
+            updated = select(names, base + ['id <= ?', after, f'{changed_column} <= ?'], f'{changed_column}, id',
+                             base_params + [since_id] + after_params + [changed_max])
+            if len(updated) == limit:
+                # صفحه تغییرات پر بود: ادامه از آخرین ردیف برگشتی، نه از سقف
+                cursor['changed_since'] = updated[-1][changed_column]
+                cursor['changed_id'] = updated[-1]['id']
+                cursor['has_more'] = True
+    return rows, updated, cursor
+
+def flow_payload(c):
+    """Whale Flow (از bucket های یک‌دقیقه‌ای 24 ساعت اخیر)"""
+    inflow, outflow = Summaries.flow_24h(c)
+    return {
+        'inflow': inflow or 0,
+        'outflow': outflow or 0,
+        'net': (inflow or 0) - (outflow or 0)
+    }
+
+def signal_stats_payload(c):
+    """آمار سیگنال‌ها (از جدول خلاصه)"""
+    stats = Summaries.signal_counts(c)
+    valid = stats.get('valid', 0)
+    invalid = stats.get('invalid', 0)
+    total = valid + invalid
+    return {
+        'valid': valid,
+        'invalid': invalid,
+        'pending': stats.get('pending', 0),
+        'accuracy': round(valid / total * 100, 1) if total > 0 else 0
+    }
+
+def live_stats(c):
+    """آمار مشترک پاسخ‌های REST و استریم"""
+    return {'signals': signal_stats_payload(c), 'flow': flow_payload(c)}
 
 @app.route('/api/whales')
 def api_whales():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM whales ORDER BY timestamp DESC LIMIT 100')
-    columns = [desc[0] for desc in c.description]
-    whales = [dict(zip(columns, row)) for row in c.fetchall()]
-    
-    # Whale Flow
-    c.execute('''SELECT 
-                 SUM(CASE WHEN whale_type = 'buy' THEN volume ELSE 0 END) as inflow,
-                 SUM(CASE WHEN whale_type = 'sell' THEN volume ELSE 0 END) as outflow
-                 FROM whales WHERE timestamp > datetime('now', '-24 hours')''')
-    flow = c.fetchone()
-    
-    conn.close()
+    with Database.connection() as conn:
+        c = conn.cursor()
+        whales, _, cursor = query_page(c, 'whales')
+        flow = flow_payload(c)
     
     return jsonify({
         'whales': whales,
-        'flow': {
-            'inflow': flow[0] or 0,
-            'outflow': flow[1] or 0,
-            'net': (flow[0] or 0) - (flow[1] or 0)
-        }
+        'cursor': cursor,
+        'delta': 'since_id' in request.args,
+        'flow': flow
     })
 
 @app.route('/api/signals')
 def api_signals():
     """دریافت سیگنال‌ها - همیشه fresh"""
     status = request.args.get('status', 'all')
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    if status == 'all':
-        c.execute('SELECT * FROM signals ORDER BY timestamp DESC LIMIT 100')
-    else:
-        c.execute('SELECT * FROM signals WHERE final_status = ? ORDER BY timestamp DESC LIMIT 100', (status,))
-    
-    columns = [desc[0] for desc in c.description]
-    signals = [dict(zip(columns, row)) for row in c.fetchall()]
-    
-    # آمار
-    c.execute('''SELECT 
-                 SUM(CASE WHEN final_status = 'valid' THEN 1 ELSE 0 END) as valid,
-                 SUM(CASE WHEN final_status = 'invalid' THEN 1 ELSE 0 END) as invalid,
-                 SUM(CASE WHEN final_status = 'pending' THEN 1 ELSE 0 END) as pending
-                 FROM signals''')
-    stats = c.fetchone()
-    
-    conn.close()
+    with Database.connection() as conn:
+        c = conn.cursor()
     
-    valid = stats[0] or 0
-    invalid = stats[1] or 0
-    total = valid + invalid
+        signals, updated, cursor = query_page(c, 'signals', {} if status == 'all' else {'final_status': status})
+        stats = signal_stats_payload(c)
     
     return jsonify({
         'signals': signals,
-        'stats': {
-            'valid': valid,
-            'invalid': invalid,
-            'pending': stats[2] or 0,
-            'accuracy': round(valid / total * 100, 1) if total > 0 else 0
-        },
+        'updated': updated,
+        'cursor': cursor,
+        'delta': 'since_id' in request.args,
+        'stats': stats,
         'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/pump_dumps')
 def api_pump_dumps():
     """دریافت پامپ/دامپ‌ها - همیشه fresh"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM pump_dumps ORDER BY timestamp DESC LIMIT 100')
-    columns = [desc[0] for desc in c.description]
-    data = [dict(zip(columns, row)) for row in c.fetchall()]
-    conn.close()
+    with Database.connection() as conn:
+        c = conn.cursor()
+        data, updated, cursor = query_page(c, 'pump_dumps')
     return jsonify({
         'data': data,
+        'updated': updated,
+        'cursor': cursor,
+        'delta': 'since_id' in request.args,
         'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/indicators/<symbol>')
 def api_indicators(symbol):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM indicators WHERE symbol = ? ORDER BY timestamp DESC LIMIT 1', (symbol,))
-    row = c.fetchone()
-    conn.close()
+    with Database.connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM indicators WHERE symbol = ? ORDER BY timestamp DESC LIMIT 1', (symbol,))
+        row = c.fetchone()
     
     if row:
         columns = [desc[0] for desc in c.description]
@@ -1379,19 +3799,23 @@ def api_indicators(symbol):
 @app.route('/api/trades')
 def api_trades():
     status = request.args.get('status', 'all')
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    if status == 'all':
-        c.execute('SELECT * FROM trades ORDER BY opened_at DESC LIMIT 100')
-    else:
-        c.execute('SELECT * FROM trades WHERE status = ? ORDER BY opened_at DESC LIMIT 100', (status,))
+    with Database.connection() as conn:
+        c = conn.cursor()
     
-    columns = [desc[0] for desc in c.description]
-    trades = [dict(zip(columns, row)) for row in c.fetchall()]
-    conn.close()
+        trades, updated, cursor = query_page(c, 'trades', {} if status == 'all' else {'status': status})
     
-    return jsonify(trades)
+    # بدون since_id همان لیست قبلی (سازگار با کلاینت‌های قدیمی)
+    if 'since_id' not in request.args:
+        return jsonify(trades)
+    return jsonify({'trades': trades, 'updated': updated, 'cursor': cursor, 'delta': True})
+
+@app.route('/api/scheduler')
+def api_scheduler():
+    """زمان‌بندی تیک‌ها: زمان هر مرحله، overrun ها، تیک‌های ردشده، backoff مراحل، عمق صف‌های خط لوله و تیک‌های no-op"""
+    return jsonify({'success': True, **TickScheduler.report(), 'pipeline': Pipeline.report(),
+                    'noop_ticks': MarketAPI.noop_ticks,
+                    'fingerprints': {source: {'updated_at': info['updated_at'], 'unchanged_polls': info['unchanged']}
+                                     for source, info in MarketAPI.fingerprints.items()}})
 
 @app.route('/api/trade_queue')
 def api_trade_queue():
@@ -1407,70 +3831,23 @@ def api_account():
 
 @app.route('/api/validation_data')
 def api_validation_data():
-    """دریافت داده‌های اعتبارسنجی (سیگنال، نهنگ، پامپ) - همیشه fresh"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    """
+    دیتاگرید اعتبارسنجی (سیگنال، نهنگ، پامپ) از مدل حافظه‌ای ValidationGrid
+    ETag = version؛ با since=<version> فقط ردیف‌های اضافه/تغییرکرده (304 اگر تغییری نبوده)
+    """
+    since = EventBus.parse_id(request.args.get('since'))
+    version, rows = ValidationGrid.snapshot(since)
+    tag = f"{EventBus.run_id}:{version}"
     
-    # دریافت سیگنال‌های معتبر و در انتظار (تازه‌ترین‌ها)
-    c.execute('SELECT * FROM signals ORDER BY timestamp DESC LIMIT 100')
-    sig_cols = [desc[0] for desc in c.description]
-    signals = [dict(zip(sig_cols, row)) for row in c.fetchall()]
-    
-    # دریافت نهنگ‌ها (تازه‌ترین‌ها)
-    c.execute('SELECT * FROM whales ORDER BY timestamp DESC LIMIT 100')
-    whale_cols = [desc[0] for desc in c.description]
-    whales = [dict(zip(whale_cols, row)) for row in c.fetchall()]
-    
-    # دریافت پامپ/دامپ‌ها (تازه‌ترین‌ها)
-    c.execute('SELECT * FROM pump_dumps ORDER BY timestamp DESC LIMIT 100')
-    pump_cols = [desc[0] for desc in c.description]
-    pump_dumps = [dict(zip(pump_cols, row)) for row in c.fetchall()]
-    
-    conn.close()
-    
-    # ترکیب داده‌ها برای دیتاگرید
-    grid_data = []
-    
-    for s in signals:
-        grid_data.append({
-            'type': 'signal',
-            'symbol': s['symbol'],
-            'action': s['signal_type'], # LONG/SHORT
-            'price': s['entry_price'],
-            'score': s['score'],
-            'status': s['final_status'],
-            'source': s['source'],
-            'time': s['timestamp'],
-            'details': f"مرحله: {s.get('valid_4min') or s.get('valid_2min') or s.get('valid_1min') or 0}/3"
-        })
-
-    for w in whales:
-        grid_data.append({
-            'type': 'whale',
-            'symbol': w['symbol'],
-            'action': 'BUY' if w['whale_type'] == 'buy' else 'SELL',
-            'price': w['price'],
-            'score': w['confidence_score'],
-            'status': 'detected',
-            'source': 'Whale Monitor',
-            'time': w['timestamp'],
-            'details': f"حجم: {w['volume']:,.0f}$"
-        })
-        
-    for p in pump_dumps:
-        grid_data.append({
-            'type': 'pump_dump',
-            'symbol': p['symbol'],
-            'action': p['event_type'].upper(),
-            'price': p['price_after'],
-            'score': p['score'],
-            'status': 'valid' if p['is_valid'] else 'invalid',
-            'source': 'Pump Detector',
-            'time': p['timestamp'],
-            'details': f"تغییر: {p['change_percent']:.2f}%"
-        })
-
-    return jsonify(grid_data)
+    # بدون since همان لیست قبلی (سازگار با کلاینت‌های قدیمی)
+    if since is None:
+        response = jsonify(rows)
+        response.set_etag(tag)
+        return response.make_conditional(request)
+    
+    if not rows:
+        return '', 304, {'ETag': f'"{tag}"'}
+    return jsonify({'version': tag, 'rows': rows, 'delta': True})
 
 @app.route('/api/config', methods=['GET', 'POST'])
 def api_config():
@@ -1490,7 +3867,10 @@ def api_config():
         allowed_keys = [
             'min_score_for_trade', 'trade_amount', 'stop_loss', 'take_profit',
             'api_source', 'validation_times', 'validation_weights',
-            'pump_dump_time', 'pump_dump_weight', 'whale_threshold'
+            'pump_dump_time', 'pump_dump_weight', 'whale_threshold',
+            'api_sources', 'source_deadlines', 'ingest_mode', 'stream_min_interval',
+            'tick_overrun', 'tick_max_catchup', 'stage_backoff_max', 'persist_max_retries',
+            'retention_raw_hours', 'retention_hot_days', 'retention_archive_days'
         ]
         
         updated = False
@@ -1499,8 +3879,16 @@ def api_config():
                 # تبدیل نوع داده در صورت نیاز
                 if key in ['min_score_for_trade']:
                     CONFIG[key] = int(data[key])
-                elif key in ['validation_times', 'validation_weights']:
+                elif key in ['validation_times', 'validation_weights', 'api_sources']:
                     CONFIG[key] = data[key]  # لیست
+                elif key == 'ingest_mode':
+                    CONFIG[key] = 'stream' if data[key] == 'stream' else 'poll'
+                elif key == 'tick_overrun':
+                    CONFIG[key] = 'catchup' if data[key] == 'catchup' else 'skip'
+                elif key == 'tick_max_catchup':
+                    CONFIG[key] = int(data[key])
+                elif key == 'source_deadlines':
+                    CONFIG[key] = {k: float(v) for k, v in data[key].items()}
                 elif key == 'api_source':
                     # هماهنگ کردن انتخاب صرافی
                     if CONFIG.get('api_source_sync', True):
@@ -1532,27 +3920,187 @@ def api_autotrade_stop():
     AutoTrader.is_running = False
     return jsonify({'success': True, 'message': 'اتوترید متوقف شد'})
 
-@app.route('/api/export/<table>')
-def api_export(table):
-    import csv
-    from io import StringIO
+EXPORT_TABLES = {  # جدول مجاز → ستون زمان برای فیلتر since/until
+    'whales': 'timestamp',
+    'signals': 'timestamp',
+    'pump_dumps': 'timestamp',
+    'trades': 'opened_at',
+    'ohlcv': 'timestamp',
+    'indicators': 'timestamp',
+}
+EXPORT_CHUNK = 5000  # ردیف در هر بخش استریم
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+class _ExportSink(io.RawIOBase):
+    """فایل فقط‌نوشتنی که بایت‌های نوشته‌شده را برای yield نگه می‌دارد (موقعیت را برای parquet حفظ می‌کند)"""
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(f'SELECT * FROM {table}')
-    columns = [desc[0] for desc in c.description]
-    rows = c.fetchall()
-    conn.close()
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
     
-    output = StringIO()
+    def tell(self):
+        return self.position
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _export_rows(sql, params):
+    """اجرای کوئری و yield ستون‌ها و سپس ردیف‌ها در بخش‌های EXPORT_CHUNK تایی"""
+    with Database.connection() as conn:
+        c = conn.execute(sql, params)
+        yield [desc[0] for desc in c.description]
+        while True:
+            rows = c.fetchmany(EXPORT_CHUNK)
+            if not rows:
+                break
+            yield rows
+
+def _export_csv(rows):
+    columns = next(rows)
+    output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(columns)
-    writer.writerows(rows)
+    for chunk in rows:
+        writer.writerows(chunk)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    yield output.getvalue()
+
+def _export_columnar(rows, table, fmt, pa):
+    """استریم Parquet یا Arrow IPC؛ schema از نوع ستون‌های جدول (نه از داده) گرفته می‌شود"""
+    columns = next(rows)
+    with Database.connection() as conn:
+        declared = {row[1]: (row[2] or '').upper() for row in conn.execute(f'PRAGMA table_info({table})')}
     
-    return output.getvalue(), 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename={table}.csv'
-    }
+    def arrow_type(column):
+        kind = declared.get(column, '')
+        if 'INT' in kind:
+            return pa.int64()
+        if 'REAL' in kind:
+            return pa.float64()
+        return pa.string()
+    
+    schema = pa.schema([(column, arrow_type(column)) for column in columns])
+    sink = _ExportSink()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    
+    for chunk in rows:
+        arrays = [pa.array([row[i] for row in chunk], type=field.type) for i, field in enumerate(schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+@app.route('/api/export/<table>')
+def api_export(table):
+    """
+    خروجی استریم جدول (بدون بارگذاری کل جدول در حافظه)
+    ?format=csv|parquet|arrow  &since=  &until=  &symbol=
+    """
+    if table not in EXPORT_TABLES:
+        return jsonify({'success': False, 'error': f'Unknown table: {table}'}), 404
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f'Unknown format: {fmt}'}), 400
+    
+    time_column = EXPORT_TABLES[table]
+    conditions = []
+    params = []
+    if request.args.get('since'):
+        conditions.append(f'{time_column} >= ?')
+        params.append(request.args['since'])
+    if request.args.get('until'):
+        conditions.append(f'{time_column} < ?')
+        params.append(request.args['until'])
+    if request.args.get('symbol'):
+        conditions.append('symbol = ?')
+        params.append(request.args['symbol'].upper())
+    
+    sql = f'SELECT * FROM {table}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY id'
+    
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    if fmt == 'csv':
+        body = _export_csv(_export_rows(sql, params))
+    else:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return jsonify({'success': False, 'error': 'pyarrow is not installed (pip install pyarrow)'}), 400
+        body = _export_columnar(_export_rows(sql, params), table, fmt, pa)
+    
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={table}.{extension}'
+    })
+
+def _stream_snapshot():
+    """وضعیت اولیه برای کلاینت تازه‌وارد (یا کلاینتی که از backlog عقب افتاده)"""
+    _, published_at, data, _ = MarketCache.get()
+    snapshot = {'market': {'items': data or [], 'sources': MarketAPI.last_sources,
+                           'published_at': published_at}}
+    with Database.connection() as conn:
+        c = conn.cursor()
+        for table in ('whales', 'signals', 'pump_dumps', 'trades'):
+            c.execute(f'SELECT * FROM {table} ORDER BY id DESC LIMIT ?', (PAGE_LIMIT,))
+            columns = [d[0] for d in c.description]
+            snapshot[table] = [dict(zip(columns, row)) for row in c.fetchall()]
+        snapshot['stats'] = live_stats(c)
+    return snapshot
+
+def _sse(event_id, event_type, data):
+    return f"id: {EventBus.run_id}:{event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    استریم SSE رویدادهای هر تیک (جایگزین polling داشبوردها)
+    اتصال جدید ابتدا یک snapshot می‌گیرد؛ اتصال مجدد با Last-Event-ID فقط رویدادهای جاافتاده را
+    """
+    position = EventBus.parse_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    
+    def generate():
+        nonlocal position
+        yield f"retry: {int(CONFIG['update_interval'] * 1000)}\n\n"
+        while True:
+            events = None if position is None else EventBus.since(position, STREAM_KEEPALIVE)
+            if events is None:
+                # شماره قبل از خواندن snapshot گرفته می‌شود؛ رویدادهای تکراری سمت کلاینت با id ادغام می‌شوند
+                position = EventBus.last_id
+                yield _sse(position, 'snapshot', json.dumps(_stream_snapshot(), default=str))
+            elif not events:
+                yield ': keepalive\n\n'
+            else:
+                for n, event_type, data in events:
+                    yield _sse(n, event_type, data)
+                position = events[-1][0]
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 # ═══════════════════════════════════════════════════════════════════════════
 # HTML Templates
@@ -1832,7 +4380,40 @@ DASHBOARD_HTML = '''
         // Fallback API Functions (در صورت قطع بک‌اند)
         let backendOnline = true;
         let fallbackRetryCount = 0;
+        
+        // کش سمت کلاینت برای پاسخ‌های دلتا (بعد از بار اول فقط ردیف‌های جدید/تغییرکرده دریافت می‌شوند)
+        const listCache = {whales: [], signals: [], pump_dumps: []};
+        const listCursor = {whales: null, signals: null, pump_dumps: null};
+        
+        function deltaQuery(key) {
+            const cursor = listCursor[key];
+            if (!cursor) return '';
+            let query = `&since_id=${cursor.last_id}`;
+            if (cursor.changed_since) query += `&changed_since=${encodeURIComponent(cursor.changed_since)}`;
+            if (cursor.changed_id) query += `&changed_id=${cursor.changed_id}`;
+            return query;
+        }
+        
+        function mergeDelta(key, res, listKey, keep) {
+            if (!res || !res.cursor || !Array.isArray(res[listKey])) return res;
+            let rows = res[listKey];
+            if (res.delta) {
+                const byId = new Map(listCache[key].map(r => [r.id, r]));
+                (res.updated || []).concat(rows).forEach(r => byId.set(r.id, r));
+                rows = Array.from(byId.values())
+                    .filter(keep || (() => true))
+                    .sort((a, b) => b.id - a.id)
+                    .slice(0, 100);
+            }
+            listCache[key] = rows;
+            // دلتای ناتمام (has_more): داشبورد فقط 100 ردیف آخر را نشان می‌دهد، پس بار بعد صفحه کامل تازه گرفته می‌شود
+            listCursor[key] = res.cursor.has_more ? null : res.cursor;
+            res[listKey] = rows;
+            return res;
+        }
         const MAX_FALLBACK_RETRIES = 3;
+        // {url: {etag, data}} - پاسخ‌های دارای ETag (مثل /api/market) با If-None-Match اعتبارسنجی می‌شوند
+        const etagCache = {};
         
         async function fetchWithFallback(url, fallbackFn) {
             try {
@@ -1840,23 +4421,39 @@ DASHBOARD_HTML = '''
                 const controller = new AbortController();
                 const timeoutId = setTimeout(() => controller.abort(), 8000); // 8 second timeout
                 
+                const headers = {
+                    'Cache-Control': 'no-cache, no-store, must-revalidate',
+                    'Pragma': 'no-cache',
+                    'Expires': '0'
+                };
+                const cached = etagCache[url];
+                if (cached) {
+                    headers['If-None-Match'] = cached.etag;
+                }
                 const response = await fetch(url, {
                     cache: 'no-store',
                     signal: controller.signal,
-                    headers: {
-                        'Cache-Control': 'no-cache, no-store, must-revalidate',
-                        'Pragma': 'no-cache',
-                        'Expires': '0'
-                    }
+                    headers
                 });
                 
                 clearTimeout(timeoutId);
                 
+                // 304: snapshot تغییری نکرده - همان بدنه قبلی
+                if (response.status === 304 && cached) {
+                    backendOnline = true;
+                    fallbackRetryCount = 0;
+                    return cached.data;
+                }
+                
                 if (!response.ok) {
                     throw new Error(`HTTP ${response.status}: ${response.statusText}`);
                 }
                 
                 const data = await response.json();
+                const etag = response.headers.get('ETag');
+                if (etag) {
+                    etagCache[url] = {etag, data};
+                }
                 backendOnline = true;
                 fallbackRetryCount = 0;
                 return data;
@@ -1894,28 +4491,110 @@ DASHBOARD_HTML = '''
             }
         }
         
-        // Fallback: مستقیم از CoinGecko
-        async function fetchMarketFallback() {
-            try {
-                const res = await fetch('https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=volume_desc&per_page=100&page=1');
-                const data = await res.json();
-                return {
-                    success: true,
-                    data: data.map(coin => ({
-                        symbol: coin.symbol.toUpperCase() + 'USDT',
-                        price: coin.current_price,
-                        change_24h: coin.price_change_percentage_24h || 0,
-                        volume: coin.total_volume || 0
-                    })),
-                    source: 'coingecko_fallback'
-                };
-            } catch (e) {
-                console.error('Fallback failed:', e);
-                return {success: false, data: []};
+        // استریم زنده (SSE): سرور بعد از هر تیک فقط تغییرات را push می‌کند؛ polling فقط اگر EventSource نباشد
+        let stream = null;
+        let apiSourceSync = true;
+        let lastFlow = {inflow: 0, outflow: 0, net: 0};
+        let lastSignalStats = {valid: 0, invalid: 0, pending: 0, accuracy: 0};
+        
+        function signalKeep(s) {
+            return signalFilter === 'all' || s.final_status === signalFilter;
+        }
+        
+        function upsertRows(key, rows, keep) {
+            const byId = new Map(listCache[key].map(r => [r.id, r]));
+            rows.forEach(r => byId.set(r.id, Object.assign(byId.get(r.id) || {}, r)));
+            listCache[key] = Array.from(byId.values())
+                .filter(keep || (() => true))
+                .sort((a, b) => b.id - a.id)
+                .slice(0, 100);
+        }
+        
+        function patchRows(key, patches, keep) {
+            // فقط ردیف‌هایی که در کش هستند (ردیف‌های قدیمی‌تر از 100 تای آخر نمایش داده نمی‌شوند)
+            const byId = new Map(listCache[key].map(r => [r.id, r]));
+            upsertRows(key, patches.filter(p => byId.has(p.id)), keep);
+        }
+        
+        function mergeMarket(items) {
+            if (!apiSourceSync) {
+                const apiSource = document.getElementById('apiSource')?.value;
+                if (apiSource) items = items.filter(item => item.source === apiSource);
+            }
+            const bySymbol = new Map(marketData.map(item => [item.symbol, item]));
+            items.forEach(item => bySymbol.set(item.symbol, item));
+            marketData = Array.from(bySymbol.values());
+        }
+        
+        function renderLists() {
+            renderWhales({whales: listCache.whales, flow: lastFlow});
+            renderSignals({signals: listCache.signals});
+            renderPumps(listCache.pump_dumps);
+            renderStats();
+        }
+        
+        function renderStats() {
+            const set = (id, text) => { const el = document.getElementById(id); if (el) el.textContent = text; };
+            set('statWhales', listCache.whales.length);
+            set('statFlow', '$' + formatNumber(lastFlow.net || 0));
+            set('statValid', lastSignalStats.valid || 0);
+            set('statPending', lastSignalStats.pending || 0);
+            set('statAccuracy', (lastSignalStats.accuracy || 0) + '%');
+            set('statPumpDump', listCache.pump_dumps.length);
+        }
+        
+        function setLiveStatus(online) {
+            const statusEl = document.querySelector('.live');
+            if (statusEl) {
+                statusEl.textContent = online ? '● آنلاین' : '⚠️ اتصال مجدد...';
+                statusEl.className = online ? 'px-3 py-1 rounded-full bg-green-500/20 text-green-400 text-sm live' : 'px-3 py-1 rounded-full bg-yellow-500/20 text-yellow-400 text-sm live';
             }
         }
         
-        // Fetch Data (بهینه‌سازی شده - همه درخواست‌ها به صورت موازی)
+        function connectStream() {
+            // EventSource بعد از قطع اتصال خودش با Last-Event-ID وصل می‌شود و رویدادهای جاافتاده را می‌گیرد
+            stream = new EventSource('/api/stream');
+            stream.onopen = () => setLiveStatus(true);
+            stream.onerror = () => setLiveStatus(false);
+            
+            const on = (type, handler) => stream.addEventListener(type, e => handler(JSON.parse(e.data)));
+            
+            on('snapshot', snap => {
+                marketData = [];
+                mergeMarket(snap.market.items);
+                listCache.whales = snap.whales;
+                listCache.pump_dumps = snap.pump_dumps;
+                listCache.signals = [];
+                upsertRows('signals', snap.signals, signalKeep);
+                lastFlow = snap.stats.flow;
+                lastSignalStats = snap.stats.signals;
+                if (signalFilter !== 'all') loadSignals();
+                renderMarket();
+                renderLists();
+            });
+            on('market', data => { mergeMarket(data.items); renderMarket(); });
+            on('stats', stats => {
+                lastFlow = stats.flow;
+                lastSignalStats = stats.signals;
+                renderWhales({whales: listCache.whales, flow: lastFlow});
+                renderStats();
+            });
+            on('whales', rows => { upsertRows('whales', rows); renderLists(); });
+            on('signals', rows => { upsertRows('signals', rows, signalKeep); renderLists(); });
+            on('signal_update', rows => { patchRows('signals', rows, signalKeep); renderLists(); });
+            on('pump_dumps', rows => { upsertRows('pump_dumps', rows); renderLists(); });
+            on('pump_update', rows => { patchRows('pump_dumps', rows); renderLists(); });
+        }
+        
+        // سیگنال‌ها با فیلتر وضعیت (یک بار از REST؛ بعد از آن رویدادهای استریم روی همین کش اعمال می‌شوند)
+        async function loadSignals() {
+            listCursor.signals = null;
+            const res = await fetchWithFallback(`/api/signals?status=${signalFilter}`, null);
+            mergeDelta('signals', res, 'signals');
+            renderLists();
+        }
+        
+        // Fetch Data (polling - فقط وقتی مرورگر EventSource ندارد)
         async function fetchData() {
             const startTime = performance.now();
             try {
@@ -1925,12 +4604,18 @@ DASHBOARD_HTML = '''
                 
                 // اجرای موازی همه درخواست‌ها برای سرعت بیشتر (با timestamp برای fresh data)
                 const [marketRes, whalesRes, signalsRes, pumpsRes] = await Promise.all([
-                    fetchWithFallback(`/api/market?source=${apiSource}&_t=${timestamp}`, fetchMarketFallback),
-                    fetchWithFallback(`/api/whales?_t=${timestamp}`, () => ({whales: [], flow: {inflow: 0, outflow: 0, net: 0}})),
-                    fetchWithFallback(`/api/signals?status=${signalFilter}&_t=${timestamp}`, () => ({signals: [], stats: {valid: 0, invalid: 0, pending: 0, accuracy: 0}})),
-                    fetchWithFallback(`/api/pump_dumps?_t=${timestamp}`, () => ({data: []}))
+                    // بدون _t: snapshot بازار با If-None-Match اعتبارسنجی می‌شود (304 وقتی تیک جدیدی نیامده)
+                    fetchWithFallback(`/api/market?source=${apiSource}`, null),
+                    fetchWithFallback(`/api/whales?_t=${timestamp}${deltaQuery('whales')}`, () => ({whales: [], flow: {inflow: 0, outflow: 0, net: 0}})),
+                    fetchWithFallback(`/api/signals?status=${signalFilter}&_t=${timestamp}${deltaQuery('signals')}`, () => ({signals: [], stats: {valid: 0, invalid: 0, pending: 0, accuracy: 0}})),
+                    fetchWithFallback(`/api/pump_dumps?_t=${timestamp}${deltaQuery('pump_dumps')}`, () => ({data: []}))
                 ]);
                 
+                // ادغام دلتاها با کش کلاینت
+                mergeDelta('whales', whalesRes, 'whales');
+                mergeDelta('signals', signalsRes, 'signals', signalKeep);
+                mergeDelta('pump_dumps', pumpsRes, 'data');
+                
                 // پردازش نتایج
                 if (marketRes && marketRes.success && marketRes.data) {
                     marketData = marketRes.data;
@@ -2180,7 +4865,9 @@ DASHBOARD_HTML = '''
         
         function filterSignals(status) {
             signalFilter = status;
-            fetchData();
+            listCursor.signals = null;  // فیلتر جدید = بار کامل
+            if (stream) loadSignals();
+            else fetchData();
         }
         
         function filterMarket() {
@@ -2212,8 +4899,13 @@ DASHBOARD_HTML = '''
                 const data = await res.json();
                 if (data.success) {
                     console.log('✅ API Source synced:', source);
-                    // آپدیت فوری دیتا
-                    await fetchData();
+                    // آپدیت فوری دیتا (با استریم، تیک بعدی خودش push می‌شود)
+                    if (!stream) await fetchData();
+                    else if (!apiSourceSync) {
+                        const marketRes = await fetchWithFallback(`/api/market?source=${source}`, null);
+                        marketData = marketRes.data || [];
+                        renderMarket();
+                    }
                 }
             } catch (e) {
                 console.error('Error changing API:', e);
@@ -2231,6 +4923,7 @@ DASHBOARD_HTML = '''
                     if (apiSourceSelect && data.config.api_source) {
                         apiSourceSelect.value = data.config.api_source;
                     }
+                    apiSourceSync = data.config.api_source_sync !== false;
                 }
             } catch (e) {
                 console.error('Error loading config:', e);
@@ -2285,9 +4978,13 @@ DASHBOARD_HTML = '''
         
         // Start - بارگذاری تنظیمات و شروع
         loadConfig().then(() => {
-            fetchData();
-            // آپدیت هر 10 ثانیه (بهینه شده)
-            setInterval(fetchData, 10000);
+            if (window.EventSource) {
+                connectStream();
+            } else {
+                fetchData();
+                // آپدیت هر 10 ثانیه (بهینه شده)
+                setInterval(fetchData, 10000);
+            }
         });
     </script>
 </body>
@@ -2844,9 +5541,19 @@ AUTOTRADE_HTML = '''
             fetchData();
         }
         
-        // Start
-        fetchData();
-        setInterval(fetchData, 5000);
+        // Start - بازخوانی فقط وقتی استریم خبر معامله/سیگنال جدید بدهد (polling اگر EventSource نباشد)
+        if (window.EventSource) {
+            const stream = new EventSource('/api/stream');
+            let pending = null;
+            const refresh = () => {
+                if (!pending) pending = setTimeout(() => { pending = null; fetchData(); }, 200);
+            };
+            // snapshot = اتصال اول یا اتصال مجدد بعد از عقب‌افتادن از backlog
+            ['snapshot', 'trades', 'trade_update', 'signals', 'signal_update'].forEach(type => stream.addEventListener(type, refresh));
+        } else {
+            fetchData();
+            setInterval(fetchData, 5000);
+        }
     </script>
 </body>
 </html>
@@ -2857,6 +5564,18 @@ AUTOTRADE_HTML = '''
 # ═══════════════════════════════════════════════════════════════════════════
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Whale Hunter Pro')
+    parser.add_argument('--replay', metavar='PATH', help='بازپخش فایل/پوشه ضبط‌شده (capture_dir) بدون داشبورد')
+    parser.add_argument('--speed', type=float, default=1.0, help='سرعت بازپخش (1 = زمان واقعی، 0 = بدون مکث)')
+    parser.add_argument('--db', default='whale_hunter_replay.db', help='دیتابیس بازپخش (هر بار از نو ساخته می‌شود)')
+    parser.add_argument('--capture', metavar='DIR', help='ضبط پاسخ‌های خام منابع در DIR')
+    args = parser.parse_args()
+    if args.replay:
+        run_replay(args.replay, args.speed, args.db)
+        raise SystemExit(0)
+    if args.capture:
+        CONFIG['capture_dir'] = args.capture
+    
     print("=" * 60)
     print("🐋 Whale Hunter Pro v6.0")
     print("=" * 60)
@@ -2868,6 +5587,7 @@ if __name__ == '__main__':
     
     # Initialize
     init_db()
+    EngineState.restore()
     worker_thread.start()
     
     # Run Flask
@@ -0,0 +1,205 @@
+"""
+📼 WS Replay Server - جایگزین محلی WebSocket تیکر صرافی برای تست آفلاین حالت stream
+فایل فریم‌ها: JSONL (اختیاری gzip) هر خط {"t": ثانیه از شروع ضبط, "frame": متن خام فریم}
+
+    python ws_replay_server.py record  frames.jsonl.gz --symbols BTCUSDT,ETHUSDT --seconds 300
+    python ws_replay_server.py generate frames.jsonl.gz --count 100 --seconds 300 --rate 20
+    python ws_replay_server.py serve   frames.jsonl.gz --port 8765 --speed 10 --loop
+
+سپس در whale_hunter_end4: CONFIG['ingest_mode'] = 'stream' و CONFIG['ws_urls']['bybit'] = 'ws://127.0.0.1:8765'
+(برای فریم‌های مصنوعی generate: CONFIG["stream_symbols"] = ["SYM0USDT", ...])
+سرور به subscribe/ping پاسخ می‌دهد، فقط topic های مشترک‌شده را می‌فرستد و ts فریم‌ها را با زمان ارسال
+بازنویسی می‌کند تا lag_ms سمت کلاینت تأخیر واقعی سرور→تشخیص باشد
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+
+import websockets
+
+BYBIT_URL = "wss://stream.bybit.com/v5/public/spot"
+
+
+def open_frames(path, mode='rt'):
+    return gzip.open(path, mode, encoding='utf-8') if path.endswith('.gz') else open(path, mode, encoding='utf-8')
+
+
+def load_frames(path):
+    with open_frames(path) as f:
+        return [(record['t'], record['frame']) for record in map(json.loads, f) if record.get('frame')]
+
+
+# ==================== ضبط ====================
+
+async def record(args):
+    """ضبط فریم‌های تیکر bybit (یا هر آدرس با پیام‌های --subscribe) در فایل"""
+    messages = [json.loads(m) for m in args.subscribe]
+    if args.symbols:
+        topics = [f"tickers.{symbol}" for symbol in args.symbols.split(',')]
+        messages += [{'op': 'subscribe', 'args': topics[i:i + 10]} for i in range(0, len(topics), 10)]
+    count = 0
+    async with websockets.connect(args.url, ping_interval=None, max_size=2 ** 22) as ws:
+        for message in messages:
+            await ws.send(json.dumps(message))
+        started = time.time()
+        last_ping = started
+        with open_frames(args.file, 'at') as out:
+            while time.time() - started < args.seconds:
+                try:
+                    frame = await asyncio.wait_for(ws.recv(), 1)
+                except asyncio.TimeoutError:
+                    frame = None
+                if time.time() - last_ping > 20:
+                    await ws.send(json.dumps({'op': 'ping'}))
+                    last_ping = time.time()
+                if frame is None or '"topic"' not in frame:
+                    continue
+                out.write(json.dumps({'t': round(time.time() - started, 3), 'frame': frame}) + '\n')
+                count += 1
+    print(f"✅ {count:,} فریم در {args.file} ضبط شد")
+
+
+def generate(args):
+    """فریم‌های مصنوعی تیکر bybit (random walk) بدون نیاز به شبکه"""
+    rng = random.Random(args.seed)
+    symbols = [f"SYM{i}USDT" for i in range(args.count)]
+    state = {s: [rng.uniform(0.5, 500), rng.uniform(1e5, 5e7)] for s in symbols}
+    total = int(args.seconds * args.rate)
+    with open_frames(args.file, 'wt') as out:
+        for n in range(total):
+            symbol = rng.choice(symbols)
+            price, turnover = state[symbol]
+            price *= 1 + rng.gauss(0, 0.002) + (rng.choice((-0.04, 0.04)) if rng.random() < 0.001 else 0)
+            turnover += rng.uniform(0, 2e4)
+            state[symbol] = [price, turnover]
+            t = n / args.rate
+            frame = {
+                'topic': f"tickers.{symbol}",
+                'ts': int(t * 1000),
+                'type': 'snapshot',
+                'cs': n,
+                'data': {
+                    'symbol': symbol,
+                    'lastPrice': f"{price:.6g}",
+                    'highPrice24h': f"{price * 1.05:.6g}",
+                    'lowPrice24h': f"{price * 0.95:.6g}",
+                    'prevPrice24h': f"{price:.6g}",
+                    'volume24h': f"{turnover / price:.2f}",
+                    'turnover24h': f"{turnover:.2f}",
+                    'price24hPcnt': f"{rng.uniform(-0.1, 0.1):.4f}",
+                },
+            }
+            out.write(json.dumps({'t': round(t, 3), 'frame': json.dumps(frame)}) + '\n')
+    print(f"✅ {total:,} فریم مصنوعی ({args.count} نماد، {args.rate}/s) در {args.file}")
+
+
+# ==================== پخش ====================
+
+def topic_of(message):
+    """topic های یک پیام subscribe (bybit: args، kucoin: topic)"""
+    if message.get('op') == 'subscribe':
+        return message.get('args') or []
+    if message.get('type') == 'subscribe':
+        return [message.get('topic')]
+    return []
+
+
+async def serve(args):
+    frames = load_frames(args.file)
+    if not frames:
+        print(f"❌ فایل {args.file} فریمی ندارد")
+        return
+    print(f"📼 {len(frames):,} فریم ({frames[-1][0]:.0f}s ضبط) - ws://{args.host}:{args.port} speed={args.speed}")
+
+    async def handler(ws, *_):
+        topics = set()
+        subscribed = asyncio.Event()
+
+        async def control():
+            # پاسخ به subscribe و ping کلاینت (مثل صرافی)
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get('op') == 'ping':
+                    await ws.send(json.dumps({'success': True, 'ret_msg': 'pong', 'op': 'pong'}))
+                elif message.get('type') == 'ping':
+                    await ws.send(json.dumps({'id': message.get('id'), 'type': 'pong'}))
+                elif topic_of(message):
+                    topics.update(topic_of(message))
+                    await ws.send(json.dumps({'success': True, 'op': 'subscribe', 'id': message.get('id'),
+                                              'type': 'ack'}))
+                    subscribed.set()
+
+        listener = asyncio.ensure_future(control())
+        sent = 0
+        started = time.time()
+        try:
+            await asyncio.wait_for(subscribed.wait(), 10)
+            await asyncio.sleep(0.2)  # subscribe های چندتایی bybit
+            while True:
+                base = time.time()
+                for t, raw in frames:
+                    if args.speed > 0:
+                        delay = base + t / args.speed - time.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    message = json.loads(raw)
+                    if message.get('topic') not in topics:
+                        continue
+                    if 'ts' in message:
+                        message['ts'] = int(time.time() * 1000)
+                    await ws.send(json.dumps(message))
+                    sent += 1
+                if not args.loop:
+                    break
+        except (asyncio.TimeoutError, websockets.ConnectionClosed):
+            pass
+        finally:
+            listener.cancel()
+            elapsed = max(time.time() - started, 1e-9)
+            print(f"📤 {ws.remote_address}: {sent:,} فریم در {elapsed:.1f}s ({sent / elapsed:,.0f} فریم/ثانیه)")
+
+    async with websockets.serve(handler, args.host, args.port, max_size=2 ** 22):
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket ticker record/replay')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('record', help='ضبط فریم‌های یک WebSocket واقعی')
+    p.add_argument('file')
+    p.add_argument('--url', default=BYBIT_URL)
+    p.add_argument('--symbols', default='BTCUSDT,ETHUSDT,SOLUSDT,XRPUSDT,DOGEUSDT')
+    p.add_argument('--subscribe', action='append', default=[], help='پیام subscribe خام (JSON)')
+    p.add_argument('--seconds', type=float, default=300)
+
+    p = sub.add_parser('generate', help='ساخت فریم‌های مصنوعی bybit')
+    p.add_argument('file')
+    p.add_argument('--count', type=int, default=100, help='تعداد نماد')
+    p.add_argument('--seconds', type=float, default=300)
+    p.add_argument('--rate', type=float, default=20, help='فریم در ثانیه')
+    p.add_argument('--seed', type=int, default=1)
+
+    p = sub.add_parser('serve', help='پخش فریم‌های ضبط‌شده')
+    p.add_argument('file')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--speed', type=float, default=1.0, help='ضریب سرعت (0 = بدون مکث، برای throughput)')
+    p.add_argument('--loop', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        generate(args)
+    else:
+        try:
+            asyncio.run(record(args) if args.command == 'record' else serve(args))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()